@@ -0,0 +1,329 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import argparse
+import copy
+import itertools
+import json
+import logging
+import math
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import torch
+from torch import optim
+import torch.distributed as dist
+
+from model_utils.train_utils import (get_model_config,
+                                   get_compute_device,
+                                   create_model,
+                                   wrap_model_with_fsdp,
+                                   apply_activation_checkpoint,
+                                   get_param_groups_by_weight_decay)
+from model_utils.arguments import parse_args
+
+
+logging.basicConfig(format="%(asctime)s [%(levelname)s] %(name)s: %(message)s", level=logging.INFO, stream=sys.stdout)
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+# train.py flag -> values to try. Overridden with --autotune_space.
+DEFAULT_SEARCH_SPACE = {
+    "sharding_strategy": ["full", "hybrid"],
+    "limit_all_gathers": [1, 0],
+    "cpu_offload": [0],
+    "activation_checkpointing": [1, 0],
+    "backward_prefetch": ["backward_pre", "backward_post"],
+    "train_batch_size": [1, 2, 4],
+}
+
+STATUS_OK = 0
+STATUS_TIMEOUT = 1
+STATUS_OOM = 2
+STATUS_ERROR = 3
+STATUS_NAMES = {STATUS_OK: "ok", STATUS_TIMEOUT: "timeout", STATUS_OOM: "oom", STATUS_ERROR: "error"}
+
+# indentation of the command list in FSDP/kubernetes/fsdp-hpto-template.yaml
+YAML_INDENT = " " * 16
+
+# set in the environment of trial processes, see `launch_trial`
+TRIAL_RESULT_ENV = "AUTOTUNE_TRIAL_RESULT"
+# seconds between checks of the trial processes
+TRIAL_POLL_INTERVAL = 1.0
+
+
+def parse_autotune_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Time short FSDP training runs over a search space of train.py flags "
+        "and emit the fastest flag set. Model and remaining flags are parsed like train.py.",
+    )
+    parser.add_argument("--autotune_space", type=str, default=None,
+                        help="JSON or YAML file mapping train.py flag names to lists of values to try")
+    parser.add_argument("--autotune_steps", type=int, default=5,
+                        help="number of timed training steps per trial, at least 1")
+    parser.add_argument("--autotune_warmup_steps", type=int, default=2,
+                        help="number of untimed steps before timing a trial")
+    parser.add_argument("--autotune_trial_timeout", type=float, default=300,
+                        help="seconds after which a trial, including building its model, is stopped and pruned")
+    parser.add_argument("--autotune_output", type=str, default="autotune.yaml",
+                        help="file the best flags are written to as YAML command args")
+    autotune_args = parser.parse_args(argv)
+    if autotune_args.autotune_steps < 1:
+        parser.error("--autotune_steps must be at least 1")
+    return autotune_args
+
+
+def load_search_space(path):
+    if path is None:
+        return dict(DEFAULT_SEARCH_SPACE)
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith((".yaml", ".yml")):
+            import yaml
+
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def get_candidates(space, args):
+    """Cartesian product of the search space, smallest micro-batch first."""
+    for name in space:
+        if not hasattr(args, name):
+            raise ValueError(f"Unknown train.py flag in search space: {name}")
+    names = sorted(space, key=lambda name: name == "train_batch_size")
+    for values in itertools.product(*(space[name] for name in names)):
+        yield dict(zip(names, values))
+
+
+def _agree(values, device, op=dist.ReduceOp.MAX):
+    tensor = torch.tensor(values, dtype=torch.float64, device=device)
+    dist.all_reduce(tensor, op=op)
+    return tensor.tolist()
+
+
+def nearest_rank(ordered, q):
+    """Nearest-rank `q`-th percentile of the sorted `ordered`."""
+    return ordered[max(math.ceil(q / 100 * len(ordered)) - 1, 0)]
+
+
+def run_trial(args, model_config, global_rank, autotune_args):
+    """Build the model with `args` and time a few training steps on random tokens.
+
+    Returns the per-step times, taking the slowest rank for every step.
+    """
+    device = get_compute_device()
+    model = create_model(args, model_config, global_rank)
+    model = wrap_model_with_fsdp(args, model, global_rank)
+    if args.activation_checkpointing > 0:
+        apply_activation_checkpoint(args, model=model)
+    optimizer = optim.AdamW(
+        get_param_groups_by_weight_decay(model),
+        betas=(args.beta1, args.beta2), lr=args.lr, weight_decay=args.weight_decay,
+    )
+    generator = torch.Generator().manual_seed(args.seed)
+    input_data = torch.randint(
+        0, model_config.vocab_size, (args.train_batch_size, args.max_context_width), generator=generator
+    )
+
+    step_times = []
+    for step in range(autotune_args.autotune_warmup_steps + autotune_args.autotune_steps):
+        step_start = time.time()
+        optimizer.zero_grad(set_to_none=True)
+        loss = model(input_ids=input_data, attention_mask=None, labels=input_data)["loss"]
+        loss.backward()
+        model.clip_grad_norm_(args.grad_clip)
+        optimizer.step()
+        loss.item()
+        (step_time,) = _agree([time.time() - step_start], device)
+        if step >= autotune_args.autotune_warmup_steps:
+            step_times.append(step_time)
+    return step_times
+
+
+def trial_main(args, autotune_args, result_path):
+    """One rank of a trial, in a process (and process group) of its own; see `launch_trial`.
+
+    Writes the step times and peak memory to `result_path` and exits with
+    the trial status, without waiting for other ranks after an OOM.
+    """
+    dist.init_process_group("cpu:gloo,cuda:nccl" if torch.cuda.is_available() else "gloo")
+    global_rank = dist.get_rank()
+    if torch.cuda.is_available():
+        torch.cuda.set_device(global_rank % torch.cuda.device_count())
+
+    status = STATUS_OK
+    step_times = []
+    try:
+        step_times = run_trial(args, get_model_config(args), global_rank, autotune_args)
+    except torch.cuda.OutOfMemoryError:
+        status = STATUS_OOM
+    peak_memory = torch.cuda.max_memory_allocated() if torch.cuda.is_available() else 0
+    with open(result_path, "w", encoding="utf-8") as f:
+        json.dump({"step_times": step_times, "peak_memory": peak_memory}, f)
+    if status == STATUS_OK:
+        dist.destroy_process_group()
+    sys.stdout.flush()
+    # other ranks may be stuck in a collective with the failed one, leave without shutting down
+    os._exit(status)
+
+
+def launch_trial(overrides, master, result_path):
+    """Start this script as the same rank of a trial with `overrides` (train.py flag -> value).
+
+    The trial processes form a process group of their own at `master`
+    (address, port), so a trial that hangs or dies leaves the autotune
+    ranks able to continue with the next one.
+    """
+    argv = [sys.executable, os.path.abspath(__file__), *sys.argv[1:]]
+    argv += [f"--{name}={value}" for name, value in overrides.items()]
+    env = dict(os.environ, MASTER_ADDR=master[0], MASTER_PORT=str(master[1]))
+    env[TRIAL_RESULT_ENV] = result_path
+    # torchrun's agent store is at the autotune master port, trial rank 0 hosts its own
+    env.pop("TORCHELASTIC_USE_AGENT_STORE", None)
+    return subprocess.Popen(argv, env=env)
+
+
+def wait_for_trial(process, timeout, device, poll_interval=TRIAL_POLL_INTERVAL):
+    """Wait until the trial processes of all ranks exit, one fails, or `timeout` seconds pass.
+
+    Trial processes still running after a failure or the timeout are
+    killed. Returns the trial status, agreed by all ranks: an OOM on any
+    rank wins over a timeout, which wins over other errors.
+    """
+    start = time.time()
+    while True:
+        returncode = process.poll()
+        running, failed, elapsed = _agree(
+            [returncode is None, returncode not in (None, 0), time.time() - start], device
+        )
+        if not running or failed or elapsed > timeout:
+            break
+        time.sleep(poll_interval)
+    timed_out = running and not failed
+    killed = process.poll() is None
+    if killed:
+        process.kill()
+        process.wait()
+
+    oom, error = _agree([
+        process.returncode == STATUS_OOM,
+        not killed and process.returncode not in (0, STATUS_OOM),
+    ], device)
+    if oom:
+        return STATUS_OOM
+    if timed_out:
+        return STATUS_TIMEOUT
+    if error:
+        return STATUS_ERROR
+    return STATUS_OK
+
+
+def format_yaml_args(flags, comment_lines):
+    lines = [f"{YAML_INDENT}# {line}" for line in comment_lines]
+    lines += [f"{YAML_INDENT}- '--{name}={value}'" for name, value in sorted(flags.items())]
+    return "\n".join(lines) + "\n"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("", 0))
+        return sock.getsockname()[1]
+
+
+def read_trial_result(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"step_times": [], "peak_memory": 0}
+
+
+def main(args, autotune_args):
+    # this process only coordinates, every trial runs in processes of its own (see `launch_trial`)
+    dist.init_process_group("gloo")
+    global_rank = dist.get_rank()
+    world_size = dist.get_world_size()
+    device = torch.device("cpu")
+
+    space = load_search_space(autotune_args.autotune_space)
+    result_dir = tempfile.mkdtemp(prefix="autotune-")
+
+    results = []
+    # (flags without train_batch_size) that ran out of memory at some micro-batch size
+    oom_at = {}
+    for overrides in get_candidates(space, args):
+        base_key = tuple((k, v) for k, v in overrides.items() if k != "train_batch_size")
+        batch_size = overrides.get("train_batch_size", args.train_batch_size)
+        if base_key in oom_at and batch_size >= oom_at[base_key]:
+            results.append({"flags": overrides, "status": "oom", "pruned": True})
+            continue
+
+        trial_args = copy.copy(args)
+        for name, value in overrides.items():
+            setattr(trial_args, name, value)
+        if global_rank == 0:
+            logger.info("Trial %d: %s", len(results), overrides)
+
+        # trial rank 0 runs next to this rank 0, on MASTER_ADDR
+        master = [(os.environ.get("MASTER_ADDR", "127.0.0.1"), free_port() if global_rank == 0 else None)]
+        dist.broadcast_object_list(master, src=0)
+        result_path = os.path.join(result_dir, f"trial{len(results)}.json")
+        process = launch_trial(overrides, master[0], result_path)
+        status = wait_for_trial(process, autotune_args.autotune_trial_timeout, device)
+        trial_result = read_trial_result(result_path)
+        peak_memory, no_steps = _agree([trial_result["peak_memory"], not trial_result["step_times"]], device)
+        if status == STATUS_OK and no_steps:
+            # e.g. a missing result file, there is nothing to take percentiles of
+            status = STATUS_ERROR
+
+        result = {"flags": overrides, "status": STATUS_NAMES[status], "peak_memory_gb": peak_memory / 1024**3}
+        if status == STATUS_OOM:
+            oom_at[base_key] = min(batch_size, oom_at.get(base_key, batch_size))
+        if status == STATUS_OK:
+            ordered = sorted(trial_result["step_times"])
+            # nearest-rank percentiles, read by tools/perf_gate.py
+            for q in (50, 90, 99):
+                result[f"step_ms_p{q}"] = nearest_rank(ordered, q) * 1000
+            step_time = nearest_rank(ordered, 50)
+            result["step_time"] = step_time
+            result["samples_per_sec"] = batch_size * world_size / step_time
+            result["tokens_per_sec"] = result["samples_per_sec"] * trial_args.max_context_width
+        results.append(result)
+        if global_rank == 0:
+            logger.info("Trial %d result: %s", len(results) - 1, result)
+
+    completed = [r for r in results if r["status"] == "ok"]
+    if global_rank == 0:
+        if not completed:
+            logger.error("No configuration completed, nothing written")
+        else:
+            best = max(completed, key=lambda r: r["samples_per_sec"])
+            comment = [
+                f"autotune: {args.model_type}, world size {world_size}, seq {args.max_context_width}",
+                f"best of {len(results)} trials: {best['samples_per_sec']:.2f} samples/sec, "
+                f"step time {best['step_time']:.3f}s, peak memory {best['peak_memory_gb']:.2f} GB",
+            ]
+            yaml_args = format_yaml_args(best["flags"], comment)
+            with open(autotune_args.autotune_output, "w", encoding="utf-8") as f:
+                f.write(yaml_args)
+            with open(autotune_args.autotune_output + ".json", "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+            logger.info("Best flags written to %s:\n%s", autotune_args.autotune_output, yaml_args)
+
+    shutil.rmtree(result_dir, ignore_errors=True)
+    dist.destroy_process_group()
+
+
+if __name__ == "__main__":
+    args, unknown = parse_args()
+    autotune_args = parse_autotune_args(unknown)
+    if TRIAL_RESULT_ENV in os.environ:
+        trial_main(args, autotune_args, os.environ[TRIAL_RESULT_ENV])
+    else:
+        main(args, autotune_args)
@@ -0,0 +1,151 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import argparse
+import gzip
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+
+from model_utils.streaming_dataset import JSONL_SUFFIXES, JsonlStream, get_jsonl_files
+
+
+logging.basicConfig(format="%(asctime)s [%(levelname)s] %(name)s: %(message)s", level=logging.INFO, stream=sys.stdout)
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+def parse_benchmark_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Compare bytes read and records/sec of the training data loader on plain, "
+        "zstd and gzip compressed JSONL files holding the same documents.",
+    )
+    parser.add_argument("--local_dataset_path", type=str, required=True,
+                        help="Directory with the JSONL files to read (plain and/or .jsonl.zst/.jsonl.gz).")
+    parser.add_argument("--split", type=str, default=None,
+                        help="Only read files of this split (e.g. train), like the training loader.")
+    parser.add_argument("--compress_to", type=str, default=None,
+                        help="Write zstd and gzip copies of the plain files to this directory first, "
+                        "and benchmark both directories.")
+    parser.add_argument("--max_documents", type=int, default=0,
+                        help="Stop reading each format after this many documents (0 reads all).")
+    parser.add_argument("--repeats", type=int, default=1,
+                        help="Read each format this many times; the first pass may come from a cold cache.")
+    parser.add_argument("--output", type=str, default=None, help="Also write the results as JSON to this file.")
+    return parser.parse_args(argv)
+
+
+def get_format(path):
+    for suffix in sorted(JSONL_SUFFIXES, key=len, reverse=True):
+        if path.endswith(suffix):
+            return suffix.lstrip(".")
+    return None
+
+
+def compress_files(paths, output_dir):
+    """Write `.jsonl.zst` and `.jsonl.gz` copies of plain JSONL files to `output_dir`, skipping existing ones."""
+    import zstandard
+
+    os.makedirs(output_dir, exist_ok=True)
+    for path in paths:
+        name = os.path.basename(path)
+        for suffix, open_compressed in (
+            (".zst", lambda p: zstandard.ZstdCompressor(level=3).stream_writer(open(p, "wb"))),
+            (".gz", lambda p: gzip.open(p, "wb", compresslevel=6)),
+        ):
+            target = os.path.join(output_dir, name + suffix)
+            if os.path.exists(target):
+                continue
+            logger.info("Compressing %s to %s", name, target)
+            with open(path, "rb") as src, open_compressed(target + ".tmp") as dst:
+                shutil.copyfileobj(src, dst, 4 * 1024 * 1024)
+            os.replace(target + ".tmp", target)
+
+
+def read_chars():
+    """Bytes this process has read through read() calls, from /proc/self/io, or None."""
+    try:
+        with open("/proc/self/io", "r") as f:
+            return next(int(line.split()[1]) for line in f if line.startswith("rchar:"))
+    except (OSError, StopIteration):
+        return None
+
+
+def read_files(paths, max_documents=0):
+    """Read all documents of `paths` through the training loader's streams."""
+    documents = text_bytes = 0
+    start_chars, start = read_chars(), time.perf_counter()
+    for path in paths:
+        for text in JsonlStream(path, os.path.basename(path)).documents():
+            if text is None:
+                continue
+            documents += 1
+            text_bytes += len(text.encode("utf-8"))
+            if documents == max_documents:
+                break
+        if documents == max_documents:
+            break
+    elapsed = time.perf_counter() - start
+    end_chars = read_chars()
+    return {
+        "documents": documents,
+        "text_bytes": text_bytes,
+        "bytes_read": end_chars - start_chars if start_chars is not None else None,
+        "seconds": elapsed,
+        "documents_per_sec": documents / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def main(argv):
+    args = parse_benchmark_args(argv)
+
+    paths = get_jsonl_files(args.local_dataset_path, args.split)
+    if args.compress_to:
+        compress_files([path for path in paths if get_format(path) == "jsonl"], args.compress_to)
+        paths += get_jsonl_files(args.compress_to, args.split)
+
+    by_format = {}
+    for path in paths:
+        by_format.setdefault(get_format(path), []).append(path)
+
+    results = []
+    for fmt, fmt_paths in sorted(by_format.items()):
+        size = sum(os.path.getsize(path) for path in fmt_paths)
+        for repeat in range(args.repeats):
+            result = read_files(fmt_paths, args.max_documents)
+            result.update(format=fmt, files=len(fmt_paths), file_bytes=size, repeat=repeat)
+            results.append(result)
+            bytes_read = result["bytes_read"]
+            logger.info(
+                "%-10s pass %d: %d files, %.1f MB on disk, %s MB read, %d documents in %.2fs, "
+                "%.0f documents/sec, %.1f MB/s of text",
+                fmt, repeat, len(fmt_paths), size / 1e6,
+                f"{bytes_read / 1e6:.1f}" if bytes_read is not None else "n/a",
+                result["documents"], result["seconds"], result["documents_per_sec"],
+                result["text_bytes"] / result["seconds"] / 1e6 if result["seconds"] > 0 else 0.0,
+            )
+
+    plain = next((r for r in reversed(results) if r["format"] == "jsonl"), None)
+    if plain:
+        for fmt in sorted(by_format):
+            if fmt == "jsonl":
+                continue
+            last = next(r for r in reversed(results) if r["format"] == fmt)
+            logger.info(
+                "%s vs jsonl: %.2fx fewer bytes on disk, %.2fx documents/sec",
+                fmt, plain["file_bytes"] / last["file_bytes"],
+                last["documents_per_sec"] / plain["documents_per_sec"] if plain["documents_per_sec"] else 0.0,
+            )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        logger.info("Results written to %s", args.output)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,317 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""Offline, CPU-only conversion of DCP checkpoints written by `save_checkpoint`.
+
+    # export the model weights as a HF safetensors model
+    python convert_checkpoint.py consolidate /fsx/checkpoints/llama_v3-1000steps /fsx/hf/llama-1000steps
+
+    # rewrite model and optimizer state as dim-0 chunks for 16 ranks
+    python convert_checkpoint.py reshard /fsx/checkpoints/llama_v3-1000steps /fsx/checkpoints-16/llama_v3-1000steps --world_size 16
+
+Both stream the checkpoint one tensor at a time: host memory is bounded by
+the largest tensor plus --max_shard_size, not by the checkpoint size.
+"""
+
+import argparse
+import dataclasses
+import json
+import logging
+import math
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+from collections import namedtuple
+
+import torch
+import torch.distributed.checkpoint as dist_cp
+from torch.distributed.checkpoint.default_planner import DefaultSavePlanner
+from torch.distributed.checkpoint.metadata import (BytesStorageMetadata,
+                                                   ChunkStorageMetadata,
+                                                   MetadataIndex,
+                                                   TensorProperties,
+                                                   TensorStorageMetadata)
+from torch.distributed.checkpoint.planner import (SavePlan,
+                                                  TensorWriteData,
+                                                  WriteItem,
+                                                  WriteItemType)
+
+
+logging.basicConfig(format="%(asctime)s [%(levelname)s] %(name)s: %(message)s", level=logging.INFO, stream=sys.stdout)
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+MODEL_PREFIX = "model."
+MODEL_CONFIG_KEY = "user_content.model_config"
+DTYPES = {"bfloat16": torch.bfloat16, "float16": torch.float16, "float32": torch.float32}
+SIZE_UNITS = {"KB": 1024, "MB": 1024**2, "GB": 1024**3}
+
+
+def parse_size(size):
+    """'5GB' -> bytes."""
+    size = size.strip().upper()
+    for unit, scale in SIZE_UNITS.items():
+        if size.endswith(unit):
+            return int(float(size[:-len(unit)]) * scale)
+    return int(size)
+
+
+class CachedMetadataReader(dist_cp.FileSystemReader):
+    """FileSystemReader that parses `.metadata` once instead of on every load."""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self._metadata = None
+
+    def read_metadata(self, *args, **kwargs):
+        if self._metadata is None:
+            self._metadata = super().read_metadata(*args, **kwargs)
+        return self._metadata
+
+
+def read_tensor(reader, key):
+    """Load one complete tensor, reassembled from all the chunks it was saved as."""
+    tensor_md = reader.read_metadata().state_dict_metadata[key]
+    state_dict = {key: torch.empty(tensor_md.size, dtype=tensor_md.properties.dtype)}
+    dist_cp.load(state_dict, storage_reader=reader, no_dist=True)
+    return state_dict[key]
+
+
+def read_object(reader, key):
+    state_dict = {key: None}
+    dist_cp.load(state_dict, storage_reader=reader, no_dist=True)
+    return state_dict[key]
+
+
+def read_model_config(reader, config_path=None):
+    """HF config recorded by `save_checkpoint`, or loaded from `config_path`."""
+    from transformers import AutoConfig
+
+    if config_path is not None:
+        return AutoConfig.from_pretrained(config_path)
+    if MODEL_CONFIG_KEY not in reader.read_metadata().state_dict_metadata:
+        raise ValueError(
+            "Checkpoint has no user_content.model_config (saved before it was recorded), "
+            "pass the model config with --config"
+        )
+    config_dict = json.loads(read_object(reader, MODEL_CONFIG_KEY))
+    return AutoConfig.for_model(config_dict.pop("model_type"), **config_dict)
+
+
+def consolidate(reader, output_dir, dtype, max_shard_size, config_path=None):
+    """Write the model weights of a DCP checkpoint as a HF safetensors model."""
+    from safetensors.torch import save_file
+
+    model_config = read_model_config(reader, config_path)
+    keys = [
+        key for key, md in reader.read_metadata().state_dict_metadata.items()
+        if key.startswith(MODEL_PREFIX) and isinstance(md, TensorStorageMetadata)
+    ]
+    os.makedirs(output_dir, exist_ok=True)
+
+    # file names need the total shard count, so shards are renamed at the end
+    shard_files = []
+    weight_map = {}
+    shard = {}
+    shard_bytes = 0
+    total_bytes = 0
+
+    def flush():
+        filename = f"model-{len(shard_files) + 1:05d}.safetensors.tmp"
+        save_file(shard, os.path.join(output_dir, filename), metadata={"format": "pt"})
+        shard_files.append(filename)
+        for name in shard:
+            weight_map[name] = filename
+        logger.info("Wrote %s (%d tensors, %.2f GB)", filename, len(shard), shard_bytes / 1024**3)
+
+    for key in keys:
+        tensor = read_tensor(reader, key).to(dtype)
+        tensor_bytes = tensor.numel() * tensor.element_size()
+        if shard and shard_bytes + tensor_bytes > max_shard_size:
+            flush()
+            shard, shard_bytes = {}, 0
+        shard[key[len(MODEL_PREFIX):]] = tensor
+        shard_bytes += tensor_bytes
+        total_bytes += tensor_bytes
+    if shard:
+        flush()
+
+    renames = {
+        tmp: f"model-{i:05d}-of-{len(shard_files):05d}.safetensors"
+        for i, tmp in enumerate(shard_files, start=1)
+    }
+    for tmp, filename in renames.items():
+        os.replace(os.path.join(output_dir, tmp), os.path.join(output_dir, filename))
+    index = {
+        "metadata": {"total_size": total_bytes},
+        "weight_map": {name: renames[tmp] for name, tmp in sorted(weight_map.items())},
+    }
+    with open(os.path.join(output_dir, "model.safetensors.index.json"), "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=2)
+    model_config.save_pretrained(output_dir)
+    logger.info("Saved %d tensors (%.2f GB) to %s", len(keys), total_bytes / 1024**3, output_dir)
+
+
+def chunk_dim0(size, world_size):
+    """(offsets, sizes) of each rank's dim-0 chunk, as FSDP's sharded state dict lays them out."""
+    if len(size) == 0:
+        return [((), ())]
+    chunk_rows = math.ceil(size[0] / world_size) if size[0] else 0
+    chunks = []
+    for start in range(0, size[0], chunk_rows or 1):
+        rows = min(chunk_rows, size[0] - start)
+        chunks.append(((start,) + (0,) * (len(size) - 1), (rows,) + tuple(size[1:])))
+    return chunks or [((0,) * len(size), tuple(size))]
+
+
+# a tensor of `size` to be saved as [(offsets, chunk), ...]
+TensorChunks = namedtuple("TensorChunks", ["size", "chunks"])
+
+
+class ChunkSavePlanner(DefaultSavePlanner):
+    """Saves a flat state dict of TensorChunks and plain objects as DCP shards."""
+
+    def __init__(self):
+        super().__init__(flatten_state_dict=False, flatten_sharded_tensors=False)
+
+    def create_local_plan(self):
+        items = []
+        for key, value in self.state_dict.items():
+            if not isinstance(value, TensorChunks):
+                items.append(WriteItem(index=MetadataIndex(key), type=WriteItemType.BYTE_IO))
+                continue
+            for offsets, chunk in value.chunks:
+                items.append(WriteItem(
+                    index=MetadataIndex(key, torch.Size(offsets)),
+                    type=WriteItemType.SHARD,
+                    tensor_data=TensorWriteData(
+                        chunk=ChunkStorageMetadata(offsets=torch.Size(offsets), sizes=chunk.size()),
+                        properties=TensorProperties.create_from_tensor(chunk),
+                        size=value.size,
+                    ),
+                ))
+        self.plan = SavePlan(items)
+        return self.plan
+
+    def lookup_object(self, index):
+        value = self.state_dict[index.fqn]
+        if not isinstance(value, TensorChunks):
+            return value
+        for offsets, chunk in value.chunks:
+            if torch.Size(offsets) == index.offset:
+                return chunk
+        raise KeyError(f"No chunk of {index.fqn} at {index.offset}")
+
+
+def reshard(reader, output_dir, world_size, max_shard_size):
+    """Rewrite a DCP checkpoint with every tensor split into `world_size` dim-0 chunks.
+
+    Keys, non-tensor entries and planner data are kept, so `load_checkpoint`
+    reads the result like the original. Tensors are written in batches of
+    about `max_shard_size`, each batch through its own DCP save, and the
+    per-batch metadata is merged into one `.metadata`.
+    """
+    metadata = reader.read_metadata()
+    os.makedirs(output_dir, exist_ok=True)
+    merged_md = {}
+    storage_data = {}
+    num_files = 0
+
+    def flush(batch):
+        nonlocal num_files
+        with tempfile.TemporaryDirectory(dir=output_dir) as batch_dir:
+            batch_md = dist_cp.save(
+                batch,
+                storage_writer=dist_cp.FileSystemWriter(batch_dir, single_file_per_rank=True),
+                planner=ChunkSavePlanner(),
+                no_dist=True,
+            )
+            renames = {}
+            for name in sorted(os.listdir(batch_dir)):
+                if name.endswith(".distcp"):
+                    renames[name] = f"__{num_files}_0.distcp"
+                    shutil.move(os.path.join(batch_dir, name), os.path.join(output_dir, renames[name]))
+                    num_files += 1
+        merged_md.update(batch_md.state_dict_metadata)
+        for index, info in batch_md.storage_data.items():
+            storage_data[index] = dataclasses.replace(info, relative_path=renames[info.relative_path])
+
+    # small non-tensor entries (scheduler, step counts, param groups) go first
+    objects = {
+        key: read_object(reader, key)
+        for key, md in metadata.state_dict_metadata.items()
+        if isinstance(md, BytesStorageMetadata)
+    }
+    if objects:
+        flush(objects)
+
+    batch, batch_bytes = {}, 0
+    for key, md in metadata.state_dict_metadata.items():
+        if not isinstance(md, TensorStorageMetadata):
+            continue
+        tensor = read_tensor(reader, key)
+        tensor_bytes = tensor.numel() * tensor.element_size()
+        if batch and batch_bytes + tensor_bytes > max_shard_size:
+            flush(batch)
+            batch, batch_bytes = {}, 0
+        batch[key] = TensorChunks(md.size, [
+            (offsets, tensor[tuple(slice(o, o + s) for o, s in zip(offsets, chunk_sizes))])
+            for offsets, chunk_sizes in chunk_dim0(md.size, world_size)
+        ])
+        batch_bytes += tensor_bytes
+    if batch:
+        flush(batch)
+
+    merged = dataclasses.replace(
+        metadata, state_dict_metadata=merged_md, storage_data=storage_data, storage_meta=None
+    )
+    with open(os.path.join(output_dir, ".metadata"), "wb") as f:
+        pickle.dump(merged, f)
+    logger.info(
+        "Wrote %d entries in %d files for world size %d to %s",
+        len(merged_md), num_files, world_size, output_dir,
+    )
+
+
+def parse_convert_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Convert a DCP checkpoint written by train.py without GPUs or a process group",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    consolidate_parser = subparsers.add_parser(
+        "consolidate", help="export model weights as a HF safetensors model")
+    consolidate_parser.add_argument("checkpoint", type=str, help="DCP checkpoint directory, e.g. llama_v3-1000steps")
+    consolidate_parser.add_argument("output", type=str, help="output HF model directory")
+    consolidate_parser.add_argument("--dtype", type=str, default="bfloat16", choices=list(DTYPES),
+                                    help="dtype the weights are saved as")
+    consolidate_parser.add_argument("--config", type=str, default=None,
+                                    help="HF config to use for checkpoints without user_content.model_config")
+    consolidate_parser.add_argument("--max_shard_size", type=parse_size, default="5GB",
+                                    help="maximum size of a safetensors file")
+
+    reshard_parser = subparsers.add_parser(
+        "reshard", help="rewrite model and optimizer state as chunks for another world size")
+    reshard_parser.add_argument("checkpoint", type=str, help="DCP checkpoint directory, e.g. llama_v3-1000steps")
+    reshard_parser.add_argument("output", type=str,
+                                help="output DCP checkpoint directory, keep the {model_type}-{N}steps name to resume from it")
+    reshard_parser.add_argument("--world_size", type=int, required=True, help="target number of ranks")
+    reshard_parser.add_argument("--max_shard_size", type=parse_size, default="5GB",
+                                help="tensor bytes buffered before writing a file")
+    return parser.parse_args(argv)
+
+
+def main(args):
+    reader = CachedMetadataReader(args.checkpoint)
+    if args.command == "consolidate":
+        consolidate(reader, args.output, DTYPES[args.dtype], args.max_shard_size, args.config)
+    else:
+        reshard(reader, args.output, args.world_size, args.max_shard_size)
+
+
+if __name__ == "__main__":
+    main(parse_convert_args())
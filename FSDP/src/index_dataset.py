@@ -0,0 +1,89 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import argparse
+import functools
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from model_utils.data_index import LINE_INTERVAL, build_index, load_index, tokenizer_fingerprint
+from model_utils.streaming_dataset import get_jsonl_files
+
+
+logging.basicConfig(format="%(asctime)s [%(levelname)s] %(name)s: %(message)s", level=logging.INFO, stream=sys.stdout)
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+_tokenizers = {}
+
+
+def parse_index_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Write an index sidecar (<file>.index.json) next to every JSONL file of a dataset directory: "
+        "record counts, byte offsets of every Nth line and token counts. train.py uses it to seek, "
+        "and to report steps per epoch and ETA.",
+    )
+    parser.add_argument("--local_dataset_path", type=str, required=True,
+                        help="Directory with the JSONL files (plain or .jsonl.zst/.jsonl.gz) to index.")
+    parser.add_argument("--tokenizer", type=str, nargs="*", default=["hf-internal-testing/llama-tokenizer"],
+                        help="Tokenizers to count tokens for, as passed to train.py --tokenizer.")
+    parser.add_argument("--line_interval", type=int, default=LINE_INTERVAL,
+                        help="Record the byte offset of every this many lines.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Files indexed in parallel.")
+    parser.add_argument("--force", action="store_true", help="Index files again that already have a valid index.")
+    return parser.parse_args(argv)
+
+
+def get_tokenizer(name):
+    if name not in _tokenizers:
+        from transformers import AutoTokenizer
+
+        _tokenizers[name] = AutoTokenizer.from_pretrained(name, legacy=False)
+    return _tokenizers[name]
+
+
+def index_file(path, tokenizer_names=(), line_interval=LINE_INTERVAL):
+    """Index `path` for the named tokenizers (picklable, runs in worker processes)."""
+    return build_index(path, [get_tokenizer(name) for name in tokenizer_names], line_interval)
+
+
+def main(argv):
+    args = parse_index_args(argv)
+
+    paths = get_jsonl_files(args.local_dataset_path)
+    if not args.force:
+        fingerprints = [tokenizer_fingerprint(get_tokenizer(name)) for name in args.tokenizer]
+        paths = [
+            path for path in paths
+            if not all(fingerprint in (load_index(path) or {"tokens": {}})["tokens"] for fingerprint in fingerprints)
+        ]
+    logger.info("Indexing %d files with %d workers", len(paths), args.workers)
+
+    index = functools.partial(index_file, tokenizer_names=args.tokenizer, line_interval=args.line_interval)
+    with ProcessPoolExecutor(max_workers=max(args.workers, 1)) as executor:
+        for path, file_index in zip(paths, executor.map(index, paths)):
+            logger.info("%s: %d documents, %s", os.path.basename(path), file_index["documents"], ", ".join(
+                f"{counts['tokens']} tokens ({counts['tokenizer']})" for counts in file_index["tokens"].values()
+            ))
+
+    # totals over all files, including those indexed before
+    totals = {}
+    documents = 0
+    for path in get_jsonl_files(args.local_dataset_path):
+        file_index = load_index(path)
+        if file_index is None:
+            logger.warning("%s has no valid index", path)
+            continue
+        documents += file_index["documents"]
+        for counts in file_index["tokens"].values():
+            totals[counts["tokenizer"]] = totals.get(counts["tokenizer"], 0) + counts["tokens"]
+    logger.info("Dataset: %d documents", documents)
+    for tokenizer, tokens in totals.items():
+        logger.info("  %d tokens with %s", tokens, tokenizer)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -20,12 +20,17 @@ def parse_args():  # pylint: disable=too-many-statements
         help="batch size per dp rank",  # pylint: disable=line-too-long
     )
     opt_grp.add_argument("--val_batch_size", type=int, default=4)
+    opt_grp.add_argument("--batch_tokens", type=int, default=0,
+                         help="if > 0, fill each batch with as many samples as fit in this many tokens "
+                         "once padded to the longest, instead of --train_batch_size/--val_batch_size samples")
     opt_grp.add_argument("--max_steps",
                          "--max_training_steps",
                          type=int,
                          default=5000)
-    opt_grp.add_argument("--seed", type=int, default=12345)
-    opt_grp.add_argument("--same_seed", type=int, default=0)
+    opt_grp.add_argument("--seed", type=int, default=12345,
+                         help="seed of model initialization, data order and per-rank random state")
+    opt_grp.add_argument("--same_seed", type=int, default=0,
+                         help="use the same random state on every rank instead of one derived per rank")
     opt_grp.add_argument("--bf16",
                          default=1,
                          type=int,
@@ -52,6 +57,32 @@ def parse_args():  # pylint: disable=too-many-statements
         default=1,
         help="enable gradient checkpointing to reduce memory consumption",
     )
+    opt_grp.add_argument(
+        "--activation_checkpointing_policy",
+        type=str,
+        default="all",
+        choices=["all", "every_k", "attention", "mlp", "memory_budget"],
+        help="which modules to checkpoint when --activation_checkpointing is enabled",
+    )
+    opt_grp.add_argument(
+        "--activation_checkpointing_interval",
+        type=int,
+        default=2,
+        help="checkpoint every k-th transformer layer with the every_k policy",
+    )
+    opt_grp.add_argument(
+        "--activation_memory_budget",
+        type=float,
+        default=None,
+        help="GB per GPU available for transformer layer activations with the memory_budget policy",
+    )
+    opt_grp.add_argument(
+        "--chunked_loss_size",
+        type=int,
+        default=0,
+        help="compute the LM head and cross entropy over chunks of this many tokens "
+        "instead of materializing full (batch, seq, vocab) logits, 0 disables",
+    )
     opt_grp.add_argument(
         "--intermediate_size",
         type=int,
@@ -85,6 +116,19 @@ def parse_args():  # pylint: disable=too-many-statements
     model_grp.add_argument("--model_type", type=str, default="gpt_neox")
     model_grp.add_argument("--rotary_pct", type=float, default=0.25)
     model_grp.add_argument("--rotary_emb_base", type=int, default=10000)
+    model_grp.add_argument(
+        "--pretrained_path",
+        type=str,
+        default=None,
+        help="HF model directory with config.json and safetensors weights to start from; "
+        "replaces the model flags above, --model_type still selects the wrapping policy",
+    )
+    model_grp.add_argument(
+        "--pretrained_load_threads",
+        type=int,
+        default=8,
+        help="threads per rank reading --pretrained_path weights",
+    )
 
     fsdp_grp = parser.add_argument_group(
         title="fsdp", description="arguments for fully sharded data parallel")
@@ -95,9 +139,37 @@ def parse_args():  # pylint: disable=too-many-statements
         "--sharding_strategy",
         type=str,
         default="full",
-        choices=["full", "hybrid"],
+        choices=["full", "hybrid", "shard_grad_op", "hybrid_zero2"],
         help="FSDP sharding strategy https://pytorch.org/docs/stable/fsdp.html",
     )
+    fsdp_grp.add_argument(
+        "--shard_group_size",
+        type=int,
+        default=None,
+        help="number of consecutive ranks parameters are sharded across with hybrid "
+        "and hybrid_zero2, replicated across the rest (default: GPUs per node); "
+        "ignored with a warning for the other strategies",
+    )
+    fsdp_grp.add_argument(
+        "--backward_prefetch",
+        type=str,
+        default="backward_pre",
+        choices=["backward_pre", "backward_post", "none"],
+        help="FSDP backward prefetch policy https://pytorch.org/docs/stable/fsdp.html#torch.distributed.fsdp.BackwardPrefetch",
+    )
+    fsdp_grp.add_argument(
+        "--forward_prefetch",
+        type=int,
+        default=0,
+        help="issue the next all-gather before the current forward computation",
+    )
+    fsdp_grp.add_argument(
+        "--meta_init",
+        type=int,
+        default=0,
+        help="build the model on meta on every rank and initialize each shard in place "
+        "from --seed, instead of materializing on rank 0 and broadcasting",
+    )
     fsdp_grp.add_argument(
         "--cpu_offload",
         type=int,
@@ -153,7 +225,32 @@ def parse_args():  # pylint: disable=too-many-statements
     io_grp.add_argument("--dataset", type=str, default="allenai/c4")
     io_grp.add_argument("--dataset_config_name", type=str, default="en")
     io_grp.add_argument("--local_dataset_path", type=str, default=None, 
-                        help="Path to local JSONL dataset directory (overrides --dataset if provided)")
+                        help="Path to local JSONL dataset directory, or s3:// prefix of JSONL objects "
+                        "(overrides --dataset if provided)")
+    io_grp.add_argument("--data_mixture", type=str, default=None,
+                        help="YAML or JSON file listing datasets and sampling weights to blend "
+                        "(overrides --dataset and --local_dataset_path if provided)")
+    io_grp.add_argument("--data_cache_dir", type=str, default=None,
+                        help="node-local directory the tokenizer and dataset file lists are resolved into "
+                        "by local rank 0 and read from by the other ranks, and s3:// objects are kept in "
+                        "once read, without a size limit. Unset by default: every rank resolves them and "
+                        "s3:// objects are always streamed")
+    io_grp.add_argument("--data_stripes", type=int, default=8,
+                        help="number of streams each data file or dataset shard is split into, more if "
+                        "needed for every rank and DataLoader worker to get one. "
+                        "Data positions are recorded per stream, keep it unchanged when resuming")
+    io_grp.add_argument("--s3_read_ahead", type=int, default=4,
+                        help="number of 8 MB ranged GETs each data reader keeps in flight ahead of it "
+                        "when streaming s3:// datasets")
+    io_grp.add_argument("--prefetch_batches", type=int, default=2,
+                        help="number of batches fetched from the DataLoader in a background thread and copied "
+                        "to the GPU on a side stream ahead of the training step")
+    io_grp.add_argument("--pack_documents", type=int, default=1,
+                        help="pack documents into --max_context_width token samples. "
+                        "0 makes every document its own (shorter, padded) samples")
+    io_grp.add_argument("--shuffle_block_size", type=int, default=1024,
+                        help="shuffle the documents of each stream in blocks of this many documents, "
+                        "seeded from --seed. 0 reads them in file order")
     io_grp.add_argument("--tokenizer",
                         type=str,
                         default="EleutherAI/gpt-neox-20b")
@@ -220,5 +317,11 @@ def parse_args():  # pylint: disable=too-many-statements
         default=10,
         help="number of batches to estimate validation loss",
     )
+    parser.add_argument(
+        "--validation_async",
+        type=int,
+        default=0,
+        help="overlap the validation loss all_reduce with the next training step and log it one step later",
+    )
 
     return parser.parse_known_args()
@@ -3,6 +3,7 @@
 
 import os
 import re
+import json
 import pickle
 import statistics
 import time
@@ -101,6 +102,14 @@ def save_checkpoint_mtc(model, optimizer, scheduler, user_content, root_dir, sub
             "scheduler": scheduler.state_dict(),
             "total_steps": user_content["total_steps"],
             "start_batch_index": user_content["start_batch_index"],
+            # one JSON object, DCP would flatten a nested dict into per-stream keys
+            "data_state": json.dumps(user_content["data_state"]),
+            # RNG states of all ranks, indexed by rank
+            "rng_state": pickle.dumps(user_content["rng_state"]),
+            # read back by convert_checkpoint.py, not needed to resume
+            "user_content": {
+                "model_config": user_content["model_config"].to_json_string(use_diff=False),
+            },
         }
 
         # Create storage writer for current step
@@ -148,6 +157,8 @@ def load_checkpoint_mtc(model, optimizer, scheduler, checkpoint_dir, model_type,
 
         # Load latest checkpoint
         sm_storage_reader = SageMakerTieredStorageReader(checkpoint_config=sm_checkpoint_config)
+        for key in get_optional_state_keys(sm_storage_reader):
+            state_dict[key] = None
 
         dist_cp.load_state_dict(
             state_dict=state_dict,
@@ -190,10 +201,22 @@ def load_checkpoint_mtc(model, optimizer, scheduler, checkpoint_dir, model_type,
         scheduler,
         state_dict["total_steps"],
         state_dict["start_batch_index"],
+        json.loads(state_dict["data_state"]) if "data_state" in state_dict else None,
+        pickle.loads(state_dict["rng_state"]) if "rng_state" in state_dict else None,
     )
 
 
 
+# entries that checkpoints written by older versions of this script do not have
+OPTIONAL_STATE_KEYS = ("data_state", "rng_state")
+
+
+def get_optional_state_keys(storage_reader):
+    """The OPTIONAL_STATE_KEYS present in a checkpoint."""
+    saved = storage_reader.read_metadata().state_dict_metadata
+    return [key for key in OPTIONAL_STATE_KEYS if key in saved]
+
+
 def save_checkpoint(model, optimizer, scheduler, user_content, root_dir, sub_dir):
     torch.cuda.empty_cache()
 
@@ -210,6 +233,14 @@ def save_checkpoint(model, optimizer, scheduler, user_content, root_dir, sub_dir
             "scheduler": scheduler.state_dict(),
             "total_steps": user_content["total_steps"],
             "start_batch_index": user_content["start_batch_index"],
+            # one JSON object, DCP would flatten a nested dict into per-stream keys
+            "data_state": json.dumps(user_content["data_state"]),
+            # RNG states of all ranks, indexed by rank
+            "rng_state": pickle.dumps(user_content["rng_state"]),
+            # read back by convert_checkpoint.py, not needed to resume
+            "user_content": {
+                "model_config": user_content["model_config"].to_json_string(use_diff=False),
+            },
         }
         dist_cp.save_state_dict(
                     state_dict=state_dict,
@@ -246,6 +277,8 @@ def load_checkpoint(model, optimizer, scheduler, checkpoint_dir, model_type, dev
             scheduler,
             0,
             0,
+            None,
+            None,
         )
     if dist.get_rank() == 0:
         logger.info("Loading checkpoint from %s ...", last_checkpoint)
@@ -260,9 +293,12 @@ def load_checkpoint(model, optimizer, scheduler, checkpoint_dir, model_type, dev
             "start_batch_index": 0,
             # cannot load the optimizer state_dict together with the model state_dict
         }
+        storage_reader = dist_cp.FileSystemReader(last_checkpoint)
+        for key in get_optional_state_keys(storage_reader):
+            state_dict[key] = None
         dist_cp.load_state_dict(
             state_dict=state_dict,
-            storage_reader=dist_cp.FileSystemReader(last_checkpoint),
+            storage_reader=storage_reader,
         )
         model.load_state_dict(state_dict["model"])
         scheduler.load_state_dict(state_dict["scheduler"])
@@ -295,4 +331,6 @@ def load_checkpoint(model, optimizer, scheduler, checkpoint_dir, model_type, dev
         scheduler,
         state_dict["total_steps"],
         state_dict["start_batch_index"],
+        json.loads(state_dict["data_state"]) if "data_state" in state_dict else None,
+        pickle.loads(state_dict["rng_state"]) if "rng_state" in state_dict else None,
     )
@@ -0,0 +1,74 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import types
+
+import torch
+import torch.nn.functional as F
+from torch.utils.checkpoint import checkpoint
+from transformers.modeling_outputs import CausalLMOutputWithPast
+
+
+def _chunk_loss_sum(hidden_states, weight, labels, ignore_index):
+    # Same numerics as the HF causal LM loss: project, upcast logits, sum CE.
+    logits = F.linear(hidden_states, weight).float()
+    return F.cross_entropy(logits, labels, ignore_index=ignore_index, reduction="sum")
+
+
+def chunked_cross_entropy(hidden_states, weight, labels, chunk_size, ignore_index=-100):
+    """Causal LM loss computed over chunks of tokens.
+
+    Equivalent to `cross_entropy(lm_head(hidden_states)[:, :-1], labels[:, 1:])`,
+    but only one (chunk_size, vocab) slice of logits is alive at a time.
+    Each chunk is checkpointed so its logits are recomputed in backward
+    instead of being saved, which keeps the (batch, seq, vocab) fp32 tensor
+    out of activation memory.
+    """
+    hidden_size = hidden_states.shape[-1]
+    hidden_states = hidden_states[:, :-1, :].reshape(-1, hidden_size)
+    labels = labels[:, 1:].reshape(-1).to(device=hidden_states.device, dtype=torch.long)
+
+    loss_sum = hidden_states.new_zeros((), dtype=torch.float32)
+    for start in range(0, labels.numel(), chunk_size):
+        end = start + chunk_size
+        if torch.is_grad_enabled():
+            chunk_loss = checkpoint(
+                _chunk_loss_sum,
+                hidden_states[start:end],
+                weight,
+                labels[start:end],
+                ignore_index,
+                use_reentrant=False,
+            )
+        else:
+            chunk_loss = _chunk_loss_sum(hidden_states[start:end], weight, labels[start:end], ignore_index)
+        loss_sum = loss_sum + chunk_loss
+
+    num_tokens = (labels != ignore_index).sum().clamp(min=1)
+    return loss_sum / num_tokens
+
+
+def apply_chunked_cross_entropy(model, chunk_size):
+    """Make a HF causal LM compute its loss with `chunked_cross_entropy`.
+
+    The forward of the given (not yet FSDP-wrapped) model is replaced. When
+    labels are passed it runs the base model and feeds the final hidden states
+    and the output embedding weight to `chunked_cross_entropy`; no logits are
+    returned in that case. Calls without labels use the original forward.
+    Patching the inner module keeps the LM head inside the root FSDP unit's
+    forward, so its parameters are gathered as usual.
+    """
+    original_forward = model.forward
+
+    def forward(self, input_ids=None, attention_mask=None, labels=None, **kwargs):
+        if labels is None:
+            return original_forward(input_ids=input_ids, attention_mask=attention_mask, **kwargs)
+        base_model = getattr(self, self.base_model_prefix)
+        outputs = base_model(input_ids=input_ids, attention_mask=attention_mask, **kwargs)
+        loss = chunked_cross_entropy(
+            outputs[0], self.get_output_embeddings().weight, labels, chunk_size
+        )
+        return CausalLMOutputWithPast(loss=loss)
+
+    model.forward = types.MethodType(forward, model)
+    return model
@@ -0,0 +1,132 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import hashlib
+import json
+import os
+
+from model_utils.streaming_dataset import JsonlStream, S3Stream, _parse_jsonl_line, open_jsonl
+
+# sidecar written next to each data file: <file>.index.json
+INDEX_SUFFIX = ".index.json"
+INDEX_VERSION = 1
+# byte offsets are recorded for every this many lines
+LINE_INTERVAL = 1024
+
+
+def get_index_path(path):
+    return path + INDEX_SUFFIX
+
+
+def tokenizer_fingerprint(tokenizer):
+    """Identifies a tokenizer by its vocabulary and special tokens, whatever path it was loaded from."""
+    vocab = sorted(tokenizer.get_vocab().items())
+    special = [tokenizer.bos_token_id, tokenizer.eos_token_id, tokenizer("a")["input_ids"]]
+    return hashlib.sha1(json.dumps([vocab, special]).encode()).hexdigest()[:16]
+
+
+def count_tokens(tokenizer, texts):
+    """Tokens the loader gets from `texts`: the tokenized text plus an eos token each."""
+    return sum(len(ids) + 1 for ids in tokenizer(texts, padding=False)["input_ids"])
+
+
+def build_index(path, tokenizers=(), line_interval=LINE_INTERVAL, batch_size=1000):
+    """Index a (optionally compressed) JSONL file and write it to its sidecar.
+
+    The index holds the number of lines (`records`) and of usable documents,
+    the characters of text and, per tokenizer, the number of tokens. For
+    plain files it also holds the byte offset of every `line_interval`-th
+    line, which lets readers seek to a line instead of reading up to it.
+    Token counts of other tokenizers already in the sidecar are kept.
+    """
+    index_path = get_index_path(path)
+    previous = load_index(path) or {}
+    records = documents = text_chars = 0
+    tokens = [0] * len(tokenizers)
+    texts = []
+    offsets = [] if path.endswith(".jsonl") else None
+
+    def flush():
+        for i, tokenizer in enumerate(tokenizers):
+            tokens[i] += count_tokens(tokenizer, texts)
+        texts.clear()
+
+    def lines():
+        if offsets is None:
+            with open_jsonl(path) as f:
+                yield from f
+            return
+        # binary reads give exact byte offsets
+        with open(path, "rb", buffering=4 * 1024 * 1024) as f:
+            offset = 0
+            for line_num, line in enumerate(f):
+                if line_num % line_interval == 0:
+                    offsets.append(offset)
+                offset += len(line)
+                yield line.decode("utf-8")
+
+    for line in lines():
+        text = _parse_jsonl_line(line, records, path)
+        records += 1
+        if text is None:
+            continue
+        documents += 1
+        text_chars += len(text)
+        texts.append(text)
+        if len(texts) == batch_size:
+            flush()
+    flush()
+
+    token_counts = previous.get("tokens", {})
+    for tokenizer, count in zip(tokenizers, tokens):
+        token_counts[tokenizer_fingerprint(tokenizer)] = {"tokenizer": tokenizer.name_or_path, "tokens": count}
+    index = {
+        "version": INDEX_VERSION,
+        "file": os.path.basename(path),
+        "size": os.path.getsize(path),
+        "records": records,
+        "documents": documents,
+        "text_chars": text_chars,
+        "line_interval": line_interval,
+        "offsets": offsets,
+        "tokens": token_counts,
+    }
+    tmp_path = f"{index_path}.tmp{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f)
+    os.replace(tmp_path, index_path)
+    return index
+
+
+def load_index(path):
+    """Index of the data file `path`, or None if it has none or the file changed since it was indexed."""
+    try:
+        with open(get_index_path(path), "r", encoding="utf-8") as f:
+            index = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+    if index.get("version") != INDEX_VERSION or index.get("size") != os.path.getsize(path):
+        return None
+    return index
+
+
+def attach_indexes(streams, tokenizer=None):
+    """Load the index of every local file stream into `stream.index`; returns the number of indexed files.
+
+    With `tokenizer`, streams also get `stream.tokens`: the file's token
+    count for that tokenizer split evenly over its stripes, or None.
+    """
+    fingerprint = None
+    indexes = {}
+    for stream in streams:
+        if not isinstance(stream, JsonlStream) or isinstance(stream, S3Stream):
+            continue
+        if stream.path not in indexes:
+            indexes[stream.path] = load_index(stream.path)
+        stream.index = indexes[stream.path]
+        if stream.index and tokenizer is not None:
+            fingerprint = fingerprint or tokenizer_fingerprint(tokenizer)
+        if stream.index and fingerprint in stream.index["tokens"]:
+            stream.tokens = stream.index["tokens"][fingerprint]["tokens"] / stream.num_stripes
+            stream.num_documents = stream.index["documents"] / stream.num_stripes
+    return sum(index is not None for index in indexes.values())
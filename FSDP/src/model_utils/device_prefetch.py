@@ -0,0 +1,156 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import collections
+import queue
+import threading
+import time
+
+import torch
+
+# seconds between checks for `close` while the fetch thread waits for room in the queue
+FETCH_POLL_INTERVAL = 0.1
+
+
+class DevicePrefetcher:
+    """Iterate over `batches` with the tensors under `keys` already on `device`.
+
+    A background thread takes up to `depth` batches from `batches` ahead, so
+    waiting for the DataLoader overlaps with the current step instead of
+    delaying the next one. Up to `depth` of the fetched batches are copied
+    ahead with non_blocking=True on a side CUDA stream, so the host-to-device
+    copy of the next batch overlaps with the current step as well. The copy
+    of a batch is made visible to the compute stream when the batch is
+    returned. Other entries (e.g. data positions) stay on the host. On CPU,
+    batches are passed through unchanged.
+
+    Call `close` when stopping before `batches` is exhausted, e.g. at
+    --max_steps, so the fetch thread exits and releases the DataLoader
+    iterator, its workers and the batches it holds.
+    """
+
+    def __init__(self, batches, device, keys=("input_ids", "attention_mask"), depth=2):
+        self.batches = iter(batches)
+        self.device = torch.device(device)
+        self.keys = keys
+        self.depth = max(depth, 1)
+        self.stream = torch.cuda.Stream(self.device) if self.device.type == "cuda" else None
+        # (batch, copy start event, copy end event)
+        self.queue = collections.deque()
+        self.exhausted = False
+        self.last_events = None
+        # host seconds spent on batches since the last `transfer_time`, reported on CPU
+        self.issue_time = 0.0
+        # (batch, exception) from the fetch thread, (None, None) once `batches` is exhausted
+        self.fetched = queue.Queue(maxsize=self.depth)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._fetch, name="device-prefetch", daemon=True)
+        self.thread.start()
+
+    @property
+    def buffered(self):
+        """Number of batches copied (or being copied) ahead of the one returned last."""
+        return len(self.queue)
+
+    def __iter__(self):
+        return self
+
+    def _put(self, item):
+        """Queue `item` for `__next__`; False if `close` was called while waiting for room."""
+        while not self.stopped.is_set():
+            try:
+                self.fetched.put(item, timeout=FETCH_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _fetch(self):
+        try:
+            for batch in self.batches:
+                if not self._put((batch, None)):
+                    return
+        except Exception as error:  # pylint: disable=broad-except
+            # raised again by `__next__` in the training loop
+            self._put((None, error))
+            return
+        finally:
+            # the DataLoader iterator shuts its workers down once released
+            self.batches = None
+        self._put((None, None))
+
+    def close(self, timeout=60):
+        """Stop the fetch thread and drop the batches fetched ahead; idempotent.
+
+        A thread waiting for the DataLoader exits once it returns the batch,
+        `timeout` bounds how long this waits for that. The thread is a
+        daemon, so it never keeps the process alive.
+        """
+        self.stopped.set()
+        self.exhausted = True
+        self.queue.clear()
+        self._drain()
+        self.thread.join(timeout)
+        # a put in progress when stopped may have gone through
+        self._drain()
+
+    def _drain(self):
+        while True:
+            try:
+                self.fetched.get_nowait()
+            except queue.Empty:
+                return
+
+    def _fill(self, wait):
+        """Start copying the fetched batches, waiting for one if `wait` and none is queued."""
+        while not self.exhausted and len(self.queue) < self.depth:
+            try:
+                batch, error = self.fetched.get(block=wait and not self.queue)
+            except queue.Empty:
+                break
+            if error is not None:
+                raise error
+            if batch is None:
+                self.exhausted = True
+                break
+            issue_start = time.perf_counter()
+            if self.stream is None:
+                self.queue.append((batch, None, None))
+            else:
+                start, end = torch.cuda.Event(enable_timing=True), torch.cuda.Event(enable_timing=True)
+                with torch.cuda.stream(self.stream):
+                    start.record()
+                    batch = {
+                        key: value.to(self.device, non_blocking=True) if key in self.keys else value
+                        for key, value in batch.items()
+                    }
+                    end.record()
+                self.queue.append((batch, start, end))
+            self.issue_time += time.perf_counter() - issue_start
+
+    def __next__(self):
+        self._fill(wait=True)
+        if not self.queue:
+            raise StopIteration
+        batch, start, end = self.queue.popleft()
+        if self.stream is not None:
+            current = torch.cuda.current_stream(self.device)
+            current.wait_event(end)
+            for key in self.keys:
+                if key in batch:
+                    # memory was allocated on the side stream, keep it until the step is done
+                    batch[key].record_stream(current)
+            self.last_events = (start, end)
+        # start copying the following batches while this one is used,
+        # those the DataLoader has not produced yet are copied on the next call
+        self._fill(wait=False)
+        return batch
+
+    def transfer_time(self):
+        """Seconds the copy of the batch returned last took on device (host time to issue it on CPU)."""
+        if self.last_events is None:
+            issue_time, self.issue_time = self.issue_time, 0.0
+            return issue_time
+        start, end = self.last_events
+        end.synchronize()
+        return start.elapsed_time(end) / 1000
@@ -0,0 +1,102 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import contextlib
+import zlib
+
+import torch
+
+from model_utils.seeding import derive_seed
+
+
+@contextlib.contextmanager
+def init_empty_weights():
+    """Create module parameters on the `meta` device while keeping buffers real.
+
+    Non-persistent buffers such as rotary `inv_freq` are computed in the module
+    constructors and are not part of any checkpoint, so they are kept (on CPU)
+    and only parameters are deferred. The tensors constructors allocate for
+    their parameters are replaced before being written to, so no host memory
+    is committed and the constructors' own initialization runs on `meta`.
+    """
+    register_parameter = torch.nn.Module.register_parameter
+
+    def register_meta_parameter(module, name, param):
+        register_parameter(module, name, param)
+        if param is not None:
+            param = module._parameters[name]
+            module._parameters[name] = torch.nn.Parameter(
+                param.to("meta"), requires_grad=param.requires_grad
+            )
+
+    torch.nn.Module.register_parameter = register_meta_parameter
+    try:
+        yield
+    finally:
+        torch.nn.Module.register_parameter = register_parameter
+
+
+def _param_seed(seed, fqn):
+    # mixes all bits: the CPU generator only uses the low 32 bits of its seed
+    return derive_seed(seed, zlib.crc32(fqn.encode("utf-8")))
+
+
+@torch.no_grad()
+def init_parameter_(tensor, fqn, module, seed, init_std, generator):
+    """Initialize one parameter from a seed derived from `seed` and its name.
+
+    Follows the HF `_init_weights` scheme (normal weights, zero biases, unit
+    norm scales), but every parameter draws from its own seed on the CPU
+    `generator` and the values are copied to the parameter's device, so they
+    do not depend on the order or the device in which parameters are
+    materialized (CUDA generators draw other values for the same seed).
+    """
+    generator.manual_seed(_param_seed(seed, fqn))
+    name = fqn.rsplit(".", 1)[-1]
+    if "norm" in type(module).__name__.lower():
+        if name == "weight":
+            tensor.fill_(1.0)
+        else:
+            tensor.zero_()
+    elif name == "bias":
+        tensor.zero_()
+    else:
+        values = torch.empty(tensor.shape, dtype=tensor.dtype).normal_(mean=0.0, std=init_std, generator=generator)
+        tensor.copy_(values)
+        padding_idx = getattr(module, "padding_idx", None)
+        if isinstance(module, torch.nn.Embedding) and padding_idx is not None:
+            tensor[padding_idx].zero_()
+
+
+def init_parameters_(model, seed, init_std):
+    """Deterministically (re)initialize all parameters of a materialized model."""
+    generator = torch.Generator()
+    for prefix, module in model.named_modules():
+        for name, param in module.named_parameters(recurse=False):
+            fqn = f"{prefix}.{name}" if prefix else name
+            init_parameter_(param, fqn, module, seed, init_std, generator)
+
+
+def get_param_init_fn(model, seed, init_std, device):
+    """FSDP `param_init_fn` materializing a model built under `init_empty_weights`.
+
+    FSDP calls it per module while constructing each unit, right before the
+    unit is flattened and sharded, so only one unit is ever unsharded on a rank.
+    Values match `init_parameters_` on the full model with the same seed.
+    """
+    module_names = {module: name for name, module in model.named_modules()}
+    generator = torch.Generator()
+
+    def param_init_fn(module):
+        prefix = module_names[module]
+        for name, param in list(module.named_parameters(recurse=False)):
+            if not param.is_meta:
+                continue
+            fqn = f"{prefix}.{name}" if prefix else name
+            tensor = torch.empty_like(param, device=device)
+            init_parameter_(tensor, fqn, module, seed, init_std, generator)
+            setattr(module, name, torch.nn.Parameter(tensor, requires_grad=param.requires_grad))
+        for name, buffer in list(module.named_buffers(recurse=False)):
+            module._buffers[name] = buffer.to(device)
+
+    return param_init_fn
@@ -0,0 +1,71 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import hashlib
+import json
+import os
+import re
+import shutil
+
+import torch.distributed as dist
+
+
+def get_local_rank():
+    return int(os.environ.get("LOCAL_RANK", 0))
+
+
+def get_cache_path(cache_dir, kind, *keys):
+    """Path in `cache_dir` for an entry of `kind` identified by `keys`."""
+    digest = hashlib.sha1(json.dumps(keys).encode()).hexdigest()[:12]
+    readable = re.sub(r"[^A-Za-z0-9._-]+", "_", str(keys[0]))[-48:] if keys else ""
+    return os.path.join(cache_dir, f"{kind}-{readable}-{digest}")
+
+
+def node_local_cache(path, materialize):
+    """Create `path` once per node and return it. Collective, call on every rank.
+
+    Local rank 0 runs `materialize(tmp_path)` unless `path` already exists
+    (e.g. from an earlier run on this node) and moves the result into place;
+    the other ranks wait for it and then read the node-local copy. This
+    turns per-rank hub or shared file system requests into per-node ones.
+    """
+    if get_local_rank() == 0 and not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        materialize(tmp_path)
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            # a node sharing the directory got there first
+            if not os.path.exists(path):
+                raise
+            if os.path.isdir(tmp_path):
+                shutil.rmtree(tmp_path)
+            else:
+                os.remove(tmp_path)
+    if dist.is_initialized():
+        dist.barrier()
+    return path
+
+
+def node_cached_json(path, compute):
+    """JSON value of `compute()`, computed once per node. Collective, call on every rank."""
+
+    def materialize(tmp_path):
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(compute(), f)
+
+    with open(node_local_cache(path, materialize), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_tokenizer(name, cache_dir=None):
+    """AutoTokenizer `name`, downloaded once per node into `cache_dir` if given."""
+    from transformers import AutoTokenizer
+
+    if cache_dir:
+        name = node_local_cache(
+            get_cache_path(cache_dir, "tokenizer", name),
+            lambda path: AutoTokenizer.from_pretrained(name, legacy=False).save_pretrained(path),
+        )
+    return AutoTokenizer.from_pretrained(name, legacy=False)
@@ -0,0 +1,105 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import glob
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+from safetensors import safe_open
+from torch.distributed.fsdp import FullyShardedDataParallel as FSDP
+from torch.distributed.fsdp._common_utils import clean_tensor_name
+
+
+SAFETENSORS_INDEX_NAME = "model.safetensors.index.json"
+
+
+def get_safetensors_weight_map(path):
+    """Map each tensor name in a HF safetensors checkpoint to the file holding it."""
+    index_file = os.path.join(path, SAFETENSORS_INDEX_NAME)
+    if os.path.exists(index_file):
+        with open(index_file, "r", encoding="utf-8") as f:
+            weight_map = json.load(f)["weight_map"]
+        return {name: os.path.join(path, filename) for name, filename in weight_map.items()}
+
+    files = sorted(glob.glob(os.path.join(path, "*.safetensors")))
+    if not files:
+        raise FileNotFoundError(f"No safetensors files found in {path}")
+    weight_map = {}
+    for filename in files:
+        with safe_open(filename, framework="pt") as f:
+            for name in f.keys():
+                weight_map[name] = filename
+    return weight_map
+
+
+def get_local_shard_slices(model):
+    """List the parts of pretrained tensors that make up this rank's flat-param shards.
+
+    Returns (flat_param, offset_in_shard, name, shape, start, end) tuples, where
+    elements [start, end) of the flattened tensor `name` belong at
+    flat_param[offset_in_shard:offset_in_shard + end - start].
+    """
+    slices = []
+    for prefix, module in model.named_modules():
+        if not isinstance(module, FSDP) or module._handle is None:
+            continue
+        flat_param = module._handle.flat_param
+        for fqn, shape, info in zip(flat_param._fqns, flat_param._shapes, flat_param._shard_param_infos):
+            if not info.in_shard:
+                continue
+            name = clean_tensor_name(f"{prefix}.{fqn}" if prefix else fqn)
+            slices.append((
+                flat_param, info.offset_in_shard, name, shape,
+                info.intra_param_start_idx, info.intra_param_end_idx + 1,
+            ))
+    return slices
+
+
+def _read_flat_range(tensor_slice, shape, start, end):
+    """Read elements [start, end) of a flattened tensor, touching only the rows they span."""
+    if len(shape) == 0:
+        return tensor_slice[:].reshape(-1)[start:end]
+    row_numel = shape.numel() // shape[0]
+    first_row = start // row_numel
+    last_row = (end + row_numel - 1) // row_numel
+    rows = tensor_slice[first_row:last_row].reshape(-1)
+    return rows[start - first_row * row_numel:end - first_row * row_numel]
+
+
+@torch.no_grad()
+def load_pretrained_weights(model, path, num_threads=8):
+    """Load HF safetensors weights from `path` into an FSDP-wrapped model's local shards.
+
+    The model must be wrapped with `use_orig_params=False`. Files are memory-mapped
+    and every rank reads only the rows covering its own shard, from `num_threads`
+    threads, so host memory and read volume scale with the shard, not the model.
+    Returns the number of elements loaded on this rank.
+    """
+    weight_map = get_safetensors_weight_map(path)
+    slices = get_local_shard_slices(model)
+    missing = sorted({name for _, _, name, _, _, _ in slices if name not in weight_map})
+    if missing:
+        raise KeyError(f"Parameters not found in {path}: {missing}")
+
+    # one mmap'd handle per file and thread, opened lazily
+    handles = threading.local()
+
+    def load_slice(flat_param, offset, name, shape, start, end):
+        files = handles.__dict__.setdefault("files", {})
+        filename = weight_map[name]
+        if filename not in files:
+            files[filename] = safe_open(filename, framework="pt")
+        tensor_slice = files[filename].get_slice(name)
+        if tuple(tensor_slice.get_shape()) != tuple(shape):
+            raise ValueError(
+                f"Shape mismatch for {name}: checkpoint {tensor_slice.get_shape()}, model {tuple(shape)}"
+            )
+        values = _read_flat_range(tensor_slice, shape, start, end)
+        flat_param.data[offset:offset + end - start].copy_(values)
+        return end - start
+
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        return sum(executor.map(lambda s: load_slice(*s), slices))
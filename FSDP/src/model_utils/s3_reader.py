@@ -0,0 +1,155 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import collections
+import io
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import torch.distributed as dist
+
+# size of one ranged GET
+S3_CHUNK_SIZE = 8 * 1024 * 1024
+
+_clients = {}
+
+
+def get_s3_client():
+    """S3 client of this process, created once and reused for all objects.
+
+    The client keeps a pool of connections, so ranged GETs of the read-ahead
+    threads reuse them. DataLoader workers get their own client. The endpoint
+    follows the AWS_ENDPOINT_URL(_S3) environment variables, e.g. of a local
+    S3-compatible server.
+    """
+    pid = os.getpid()
+    if pid not in _clients:
+        try:
+            import boto3
+            from botocore.config import Config
+        except ImportError:
+            raise ImportError("Reading s3:// datasets requires boto3: pip install boto3")
+        _clients[pid] = boto3.client(
+            "s3",
+            config=Config(max_pool_connections=32, retries={"max_attempts": 10, "mode": "adaptive"}),
+        )
+    return _clients[pid]
+
+
+def parse_s3_url(url):
+    """Split s3://bucket/key into (bucket, key)."""
+    if not url.startswith("s3://"):
+        raise ValueError(f"Not an S3 URL: {url}")
+    bucket, _, key = url[len("s3://"):].partition("/")
+    if not bucket:
+        raise ValueError(f"S3 URL must include a bucket: {url}")
+    return bucket, key
+
+
+def list_s3_objects(url, suffixes):
+    """Objects under the S3 prefix `url` whose key ends with one of `suffixes`, sorted by key.
+
+    Listed on global rank 0 and broadcast to the other ranks (collective
+    if the process group is initialized).
+    """
+    objects = None
+    if not dist.is_initialized() or dist.get_rank() == 0:
+        bucket, prefix = parse_s3_url(url)
+        if prefix and not prefix.endswith("/"):
+            prefix += "/"
+        objects = []
+        for page in get_s3_client().get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                if obj["Key"].endswith(tuple(suffixes)):
+                    objects.append({
+                        "url": f"s3://{bucket}/{obj['Key']}",
+                        "name": obj["Key"][len(prefix):],
+                        "size": obj["Size"],
+                        "etag": obj["ETag"].strip('"'),
+                    })
+        objects.sort(key=lambda obj: obj["url"])
+    if dist.is_initialized():
+        holder = [objects]
+        dist.broadcast_object_list(holder, src=0)
+        objects = holder[0]
+    if not objects:
+        raise FileNotFoundError(f"No JSONL objects found under {url}")
+    return objects
+
+
+class S3RangeReader(io.RawIOBase):
+    """Sequential binary reader of an S3 object, fetched with ranged GETs.
+
+    Up to `read_ahead` chunks of `chunk_size` bytes are requested in
+    parallel ahead of the reader, so it rarely waits for S3. With
+    `cache_path`, the fetched bytes are also written there; the file only
+    appears once the whole object has been read. Readers of the same object
+    (e.g. two stripes dealt to one reader) write separate temporary files,
+    and the first one to finish fills the cache entry.
+    """
+
+    def __init__(self, url, size, chunk_size=S3_CHUNK_SIZE, read_ahead=4, cache_path=None):
+        super().__init__()
+        self.bucket, self.key = parse_s3_url(url)
+        self.size = size
+        self.chunk_size = chunk_size
+        self.client = get_s3_client()
+        self.executor = ThreadPoolExecutor(max_workers=max(read_ahead, 1), thread_name_prefix="s3-read")
+        self.read_ahead = max(read_ahead, 1)
+        self.next_offset = 0
+        self.pending = collections.deque()
+        self.chunk = memoryview(b"")
+        self.bytes_read = 0
+        self.cache_path = cache_path
+        self.cache_tmp = self.cache_tmp_path = None
+        if cache_path:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            fd, self.cache_tmp_path = tempfile.mkstemp(
+                prefix=f"{os.path.basename(cache_path)}.tmp", dir=os.path.dirname(cache_path)
+            )
+            self.cache_tmp = os.fdopen(fd, "wb")
+
+    def readable(self):
+        return True
+
+    def _get_range(self, start, end):
+        response = self.client.get_object(Bucket=self.bucket, Key=self.key, Range=f"bytes={start}-{end - 1}")
+        return response["Body"].read()
+
+    def _fill(self):
+        while len(self.pending) < self.read_ahead and self.next_offset < self.size:
+            end = min(self.next_offset + self.chunk_size, self.size)
+            self.pending.append(self.executor.submit(self._get_range, self.next_offset, end))
+            self.next_offset = end
+
+    def readinto(self, buffer):
+        if not self.chunk:
+            self._fill()
+            if not self.pending:
+                return 0
+            data = self.pending.popleft().result()
+            self._fill()
+            if self.cache_tmp:
+                self.cache_tmp.write(data)
+            self.chunk = memoryview(data)
+        n = min(len(buffer), len(self.chunk))
+        buffer[:n] = self.chunk[:n]
+        self.chunk = self.chunk[n:]
+        self.bytes_read += n
+        return n
+
+    def close(self):
+        if self.closed:
+            return
+        for future in self.pending:
+            future.cancel()
+        self.executor.shutdown(wait=True)
+        if self.cache_tmp:
+            self.cache_tmp.close()
+            if self.bytes_read == self.size and not os.path.exists(self.cache_path):
+                os.replace(self.cache_tmp_path, self.cache_path)
+            else:
+                # stopped early, e.g. at the end of an epoch, or another reader of the object filled the entry
+                os.remove(self.cache_tmp_path)
+        super().close()
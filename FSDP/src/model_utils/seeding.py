@@ -0,0 +1,62 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import random
+
+import numpy as np
+import torch
+import torch.distributed as dist
+
+
+def derive_seed(seed, *keys):
+    """Seed for a context such as (rank,), (rank, worker) or (epoch, stream), derived from `seed`.
+
+    Seeds of different contexts are statistically independent, unlike
+    `seed + rank`, which makes rank 1 of one run replay rank 0 of the next.
+    """
+    state = np.random.SeedSequence([seed, *keys]).generate_state(2, np.uint32)
+    return (int(state[0]) << 31) ^ int(state[1])
+
+
+def set_seed(seed):
+    """Seed python, numpy and torch (CPU and all GPUs) of this process."""
+    random.seed(seed)
+    np.random.seed(seed % 2**32)
+    torch.manual_seed(seed)
+
+
+def seed_worker(worker_id):
+    """DataLoader `worker_init_fn`: seed python and numpy from the worker's torch seed.
+
+    The DataLoader seeds torch in each worker from its `generator` and the
+    worker id, so every worker of every rank gets its own seed.
+    """
+    seed = torch.initial_seed()
+    random.seed(seed)
+    np.random.seed(seed % 2**32)
+
+
+def get_rng_state():
+    state = {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state()
+    return state
+
+
+def set_rng_state(state):
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if torch.cuda.is_available() and "cuda" in state:
+        torch.cuda.set_rng_state(state["cuda"])
+
+
+def gather_rng_states():
+    """RNG states of all ranks, indexed by rank. Collective, call on every rank."""
+    states = [None] * dist.get_world_size()
+    dist.all_gather_object(states, get_rng_state())
+    return states
@@ -0,0 +1,647 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import collections
+import contextlib
+import glob
+import gzip
+import io
+import itertools
+import json
+import math
+import os
+import time
+import zlib
+
+import numpy as np
+import torch
+import torch.distributed as dist
+from torch.utils.data import IterableDataset, get_worker_info
+
+from model_utils.node_cache import get_cache_path, node_cached_json
+from model_utils.s3_reader import S3RangeReader, list_s3_objects
+
+JSONL_SUFFIXES = (".jsonl", ".jsonl.zst", ".jsonl.gz")
+
+# large reads keep the number of requests to the shared file system low
+READ_BUFFER_SIZE = 4 * 1024 * 1024
+
+
+@contextlib.contextmanager
+def open_jsonl(path, buffer_size=READ_BUFFER_SIZE, fileobj=None):
+    """Open a JSONL file for reading text, decompressing `.zst` and `.gz` files on the fly.
+
+    Compressed files may consist of several concatenated frames (members),
+    as written by tools/dataset/download_c4.py. With `fileobj`, that binary
+    file object is read instead of opening `path`, whose suffix still selects
+    the decompression.
+    """
+    if path.endswith(".zst"):
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError(f"Reading {path} requires the zstandard package: pip install zstandard")
+    with fileobj or open(path, "rb", buffering=buffer_size) as raw:
+        if path.endswith(".zst"):
+            raw = io.BufferedReader(
+                zstandard.ZstdDecompressor().stream_reader(raw, read_size=buffer_size, read_across_frames=True),
+                buffer_size,
+            )
+        elif path.endswith(".gz"):
+            raw = io.BufferedReader(gzip.GzipFile(fileobj=raw, mode="rb"), buffer_size)
+        with io.TextIOWrapper(raw, encoding="utf-8") as f:
+            yield f
+
+
+class JsonlStream:
+    """Every `num_stripes`-th document of a local (optionally compressed) JSONL file, starting at line `stripe`.
+
+    Streams are the unit data is dealt to readers in and positions are
+    recorded for. They only depend on the files and `num_stripes`, never on
+    the world size, so positions stay valid when the job restarts at a
+    different scale.
+    """
+
+    # name of the mixture source the stream belongs to, see `get_mixture_streams`
+    source = ""
+    # index sidecar of the file, and this stream's share of its tokens and documents, see `attach_indexes`
+    index = None
+    tokens = None
+    num_documents = None
+
+    def __init__(self, path, key, stripe=0, num_stripes=1):
+        self.path = path
+        self.key = f"{key}:{stripe}/{num_stripes}"
+        self.stripe = stripe
+        self.num_stripes = num_stripes
+
+    def open(self, offset=0):
+        if not offset:
+            return open_jsonl(self.path)
+        raw = open(self.path, "rb", buffering=READ_BUFFER_SIZE)
+        raw.seek(offset)
+        return open_jsonl(self.path, fileobj=raw)
+
+    def seek_line(self, line_num):
+        """(byte offset, line number) of the closest indexed line at or before `line_num`."""
+        if not self.index or not self.index.get("offsets"):
+            return 0, 0
+        indexed = min(line_num // self.index["line_interval"], len(self.index["offsets"]) - 1)
+        return self.index["offsets"][indexed], indexed * self.index["line_interval"]
+
+    def documents(self, start=0):
+        """Yield the text of documents `start`, `start + 1`, ... (None for unusable lines)."""
+        # with an index, start reading close to the first line instead of at the top of the file
+        offset, first_line = self.seek_line(start * self.num_stripes + self.stripe)
+        with self.open(offset) as f:
+            for line_num, line in enumerate(f, start=first_line):
+                if line_num % self.num_stripes != self.stripe or line_num // self.num_stripes < start:
+                    continue
+                yield _parse_jsonl_line(line, line_num, self.path)
+
+
+def _parse_jsonl_line(line, line_num, path):
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        data = json.loads(line)
+    except json.JSONDecodeError as e:
+        print(f"Warning: JSON decode error at line {line_num + 1} in {os.path.basename(path)}: {e}")
+        return None
+    if 'text' not in data:
+        print(f"Warning: Line {line_num + 1} in {os.path.basename(path)} missing 'text' field")
+        return None
+    return data['text']
+
+
+class S3Stream(JsonlStream):
+    """Every `num_stripes`-th document of a (optionally compressed) JSONL object in S3.
+
+    The object is streamed with ranged GETs, `read_ahead` chunks ahead of
+    the reader. With `cache_dir`, a complete read is kept on the node's disk
+    and re-reads (later epochs, restarts) come from there. Cache entries are
+    keyed by the object's ETag, so a replaced object is fetched again.
+    """
+
+    def __init__(self, obj, key, stripe=0, num_stripes=1, cache_dir=None, read_ahead=4):
+        super().__init__(obj["url"], key, stripe, num_stripes)
+        self.size = obj["size"]
+        self.cache_path = get_cache_path(cache_dir, "s3", obj["url"], obj["etag"]) if cache_dir else None
+        self.read_ahead = read_ahead
+
+    def open(self, offset=0):
+        if self.cache_path and os.path.exists(self.cache_path):
+            return open_jsonl(self.path, fileobj=open(self.cache_path, "rb", buffering=READ_BUFFER_SIZE))
+        reader = S3RangeReader(self.path, self.size, read_ahead=self.read_ahead, cache_path=self.cache_path)
+        return open_jsonl(self.path, fileobj=io.BufferedReader(reader, READ_BUFFER_SIZE))
+
+
+class HFStream:
+    """Every `num_stripes`-th document of one shard of a streaming HF dataset."""
+
+    source = ""
+    # hub datasets have no index sidecars, see `JsonlStream`
+    index = None
+    tokens = None
+    num_documents = None
+
+    def __init__(self, dataset, shard, num_shards, stripe=0, num_stripes=1):
+        self.dataset = dataset
+        self.shard = shard
+        self.num_shards = num_shards
+        self.key = f"shard{shard:05d}:{stripe}/{num_stripes}"
+        self.stripe = stripe
+        self.num_stripes = num_stripes
+
+    def documents(self, start=0):
+        data = self.dataset
+        if self.num_shards > 1:
+            data = data.shard(num_shards=self.num_shards, index=self.shard)
+        for doc_num, sample in enumerate(data):
+            if doc_num % self.num_stripes != self.stripe or doc_num // self.num_stripes < start:
+                continue
+            yield sample.get('text')
+
+
+def get_jsonl_files(dataset, split=None):
+    if not os.path.exists(dataset):
+        raise FileNotFoundError(f"Local dataset directory not found: {dataset}")
+
+    # Find all JSONL files in the directory, plain or compressed
+    if split == 'train':
+        pattern = '*train*'
+    elif split == 'validation':
+        pattern = '*validation*'
+    else:
+        # Default to all JSONL files
+        pattern = '*'
+
+    def find(pattern):
+        return sorted(path for suffix in JSONL_SUFFIXES for path in glob.glob(os.path.join(dataset, pattern + suffix)))
+
+    jsonl_files = find(pattern)
+    if not jsonl_files:
+        # Fallback to all JSONL files if no split-specific files found
+        jsonl_files = find('*')
+
+    if not jsonl_files:
+        raise FileNotFoundError(f"No JSONL files found in {dataset}")
+    return jsonl_files
+
+
+def resolve_hf_data_files(dataset, name=None, split=None):
+    """Packaged loader and data files of a HF dataset split, or None if it is not plain files.
+
+    Loading the dataset from these skips resolving it on the hub again.
+    """
+    from datasets import load_dataset_builder
+    from datasets.packaged_modules import _PACKAGED_DATASETS_MODULES
+
+    builder = load_dataset_builder(dataset, name=name)
+    module = type(builder).__module__.split(".")
+    loader = module[2] if module[:2] == ["datasets", "packaged_modules"] else None
+    data_files = {str(key): list(files) for key, files in (builder.config.data_files or {}).items()}
+    if loader not in _PACKAGED_DATASETS_MODULES or split not in data_files:
+        return None
+    return {"loader": loader, "data_files": data_files[split]}
+
+
+def get_split_objects(objects, split=None):
+    """Objects of `split` among the listed S3 `objects`, matched by name like `get_jsonl_files`."""
+    if split in ('train', 'validation'):
+        split_objects = [obj for obj in objects if split in os.path.basename(obj["name"])]
+        if split_objects:
+            return split_objects
+    return objects
+
+
+def get_streams(dataset, name=None, split=None, num_stripes=1, cache_dir=None, s3_read_ahead=4, min_streams=0):
+    """Split a local JSONL directory, an S3 prefix or a HF dataset into streams of documents.
+
+    Files and shards are split into more than `num_stripes` stripes if that
+    makes fewer than `min_streams` streams, so that every reader gets one.
+    With `cache_dir`, the file list or the HF dataset's data files are
+    resolved once per node, and S3 objects are kept on the node's disk
+    once read (collective, call on every rank).
+    """
+    def stripes_for(num_files, stripes):
+        needed = max(stripes, math.ceil(min_streams / max(num_files, 1)))
+        if needed > stripes:
+            print(f"Splitting each of {num_files} data files into {needed} streams for {min_streams} readers")
+        return needed
+
+    if dataset.startswith('s3://'):
+        objects = get_split_objects(list_s3_objects(dataset, JSONL_SUFFIXES), split)
+        print(f"Found {len(objects)} JSONL objects for split '{split}' under {dataset}: "
+              f"{[obj['name'] for obj in objects]}")
+        # one stream per object unless there are fewer objects than readers:
+        # each stripe of an object fetches all of it
+        num_stripes = stripes_for(len(objects), 1)
+        return [
+            S3Stream(obj, obj["name"], stripe, num_stripes, cache_dir=cache_dir, read_ahead=s3_read_ahead)
+            for obj in objects for stripe in range(num_stripes)
+        ]
+    if dataset.startswith('/') or dataset.startswith('./'):
+        if cache_dir:
+            jsonl_files = node_cached_json(
+                # a new file changes the directory's mtime and with it the cache entry
+                get_cache_path(cache_dir, "files", dataset, split, os.stat(dataset).st_mtime_ns),
+                lambda: get_jsonl_files(dataset, split),
+            )
+        else:
+            jsonl_files = get_jsonl_files(dataset, split)
+        print(f"Found {len(jsonl_files)} JSONL files for split '{split}': {[os.path.basename(f) for f in jsonl_files]}")
+        num_stripes = stripes_for(len(jsonl_files), num_stripes)
+        return [
+            JsonlStream(path, os.path.relpath(path, dataset), stripe, num_stripes)
+            for path in jsonl_files for stripe in range(num_stripes)
+        ]
+
+    from datasets import load_dataset
+
+    resolved = None
+    if cache_dir:
+        resolved = node_cached_json(
+            get_cache_path(cache_dir, "hf_files", dataset, name, split),
+            lambda: resolve_hf_data_files(dataset, name=name, split=split),
+        )
+    if resolved:
+        data = load_dataset(resolved["loader"], data_files={split: resolved["data_files"]}, streaming=True, split=split)
+    else:
+        data = load_dataset(dataset, name=name, streaming=True, split=split)
+    num_stripes = stripes_for(data.n_shards, num_stripes)
+    return [
+        HFStream(data, shard, data.n_shards, stripe, num_stripes)
+        for shard in range(data.n_shards) for stripe in range(num_stripes)
+    ]
+
+
+def load_mixture(path):
+    """Read a data mixture spec from a YAML or JSON file.
+
+    The spec lists the sources to blend and their sampling weights:
+
+        sources:
+          - name: c4                  # unique, used in logs and data positions
+            dataset: allenai/c4       # HF dataset name, local JSONL directory or s3:// prefix
+            config: en                # HF dataset config, optional
+            weight: 0.8
+          - name: code
+            dataset: /fsx/code_jsonl
+            weight: 0.2
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith((".yaml", ".yml")):
+            import yaml
+
+            spec = yaml.safe_load(f)
+        else:
+            spec = json.load(f)
+    sources = spec.get("sources") if isinstance(spec, dict) else None
+    if not sources:
+        raise ValueError(f"No sources in data mixture {path}")
+    names = set()
+    for source in sources:
+        if "name" not in source or "dataset" not in source:
+            raise ValueError(f"Data mixture source needs a name and a dataset: {source}")
+        if source["name"] in names:
+            raise ValueError(f"Duplicate data mixture source: {source['name']}")
+        if not source.get("weight", 1.0) > 0:
+            raise ValueError(f"Data mixture source {source['name']} needs a positive weight")
+        names.add(source["name"])
+    return sources
+
+
+def get_mixture_streams(sources, split=None, num_stripes=1, cache_dir=None, s3_read_ahead=4, min_streams=0):
+    """Streams of all mixture `sources`, with keys prefixed by the source name.
+
+    Each source is split into at least `min_streams` streams, as it is dealt
+    to the readers on its own.
+    """
+    streams = []
+    for source in sources:
+        source_streams = get_streams(
+            source["dataset"], name=source.get("config"), split=split, num_stripes=num_stripes, cache_dir=cache_dir,
+            s3_read_ahead=s3_read_ahead, min_streams=min_streams,
+        )
+        for stream in source_streams:
+            stream.source = source["name"]
+            stream.key = f"{source['name']}/{stream.key}"
+            streams.append(stream)
+    return streams
+
+
+class StreamingTokensDataset(IterableDataset):
+    """Tokenized and packed batches read from streams, resumable from data positions.
+
+    Streams are dealt to readers (one per rank and DataLoader worker, of
+    `num_workers`), every reader must get at least one stream of every
+    source: `get_streams` splits files into `min_streams` streams for that,
+    and this number is kept in the state so a resumed run splits them the
+    same way. A
+    reader packs the documents of each of its streams into `max_length`
+    token samples (or, with `pack=False`, splits every document into
+    samples of at most `max_length` tokens) and takes samples from its
+    streams in turn. Documents of a
+    stream are shuffled in blocks of `shuffle_block_size`, with a permutation
+    that only depends on `seed`, the epoch, the stream and the block, so the
+    order can be replayed from any position. Call `set_epoch` before
+    iterating to reshuffle, and to deal the streams differently, each epoch.
+
+    Every sample carries the position of its stream right after it:
+    (e, t, n) = t tokens of the e-th document (in shuffled order) have been
+    consumed, in n samples. Batches hold them in "data_position" rows of
+    [stream index, e, t, n]. Readers take the next sample from the stream
+    with the fewest samples taken, i.e. round-robin in a way that continues
+    where it was left after a restart.
+
+    Streams of a data mixture are grouped by their `source`, and each source
+    is dealt to the readers on its own. Readers pick the source whose sample
+    count is furthest behind its share of `weights` (source name -> weight),
+    then the stream of that source with the fewest samples taken. Batches
+    also hold "source_stats" rows of [tokens, read seconds] per source.
+
+    Batches have `batch_size` samples or, with `batch_tokens`, as many
+    consecutive samples as fit in `batch_tokens` once padded to the longest
+    one. "input_ids" are int32, padded with the pad (or eos) token, and come
+    with an "attention_mask" if the batch has padding.
+
+    The copy of this object in the main process records the positions of
+    consumed batches (`update_positions`). Iterators created from it, e.g.
+    after a restart with `load_state_dict`, resume every stream where it
+    was left, whichever reader it is dealt to. The DataLoader takes batches
+    from its workers in turn, starting at worker 0; it also records which
+    of the rank's readers is next, and a resumed run at the same scale
+    deals that reader to worker 0, so batches come in the same order as
+    without the restart.
+    """
+
+    def __init__(self, streams, tokenizer, max_length, batch_size, global_rank=0, world_size=1, seed=42,
+                 shuffle_block_size=0, weights=None, pack=True, batch_tokens=0, num_workers=0, min_streams=0):
+        os.environ['TOKENIZERS_PARALLELISM'] = 'false'
+        self.streams = streams
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        self.batch_size = batch_size
+        self.pack = pack
+        self.batch_tokens = batch_tokens
+        if batch_tokens and batch_tokens < max_length:
+            raise ValueError(f"batch_tokens ({batch_tokens}) must be at least max_length ({max_length})")
+        self.pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+        self.global_rank = global_rank
+        self.world_size = world_size
+        self.seed = seed
+        self.shuffle_block_size = shuffle_block_size
+        self.epoch = 0
+        self.sources = list(dict.fromkeys(stream.source for stream in streams))
+        self.weights = [(weights or {}).get(source, 1.0) for source in self.sources]
+        self.stream_sources = [self.sources.index(stream.source) for stream in streams]
+        self.num_workers = num_workers
+        self.min_streams = min_streams
+        # DataLoader worker w reads as reader (w + reader_offset) % num_workers of this rank
+        self.reader_offset = 0
+        # reader of this rank whose batch the DataLoader returns next, and stream index -> reader
+        self.next_reader = 0
+        self._stream_readers = None
+        num_readers = world_size * max(num_workers, 1)
+        for source, name in enumerate(self.sources):
+            num_streams = self.stream_sources.count(source)
+            if num_streams < num_readers:
+                raise ValueError(
+                    f"{num_streams} data streams{f' of source {name}' if name else ''} for {num_readers} readers "
+                    f"({world_size} ranks x {max(num_workers, 1)} DataLoader workers), some readers would get no "
+                    f"data; streams are split as in the resumed run, resume with at most {num_streams} readers"
+                )
+        # stream key -> (e, t, n) of the last consumed sample
+        self.positions = {}
+        # samples consumed before the last `load_state_dict`, over all ranks
+        self.consumed_samples = 0
+        self.local_consumed_samples = 0
+        # the same per source
+        self.source_samples = [0] * len(self.sources)
+        self.local_source_samples = [0] * len(self.sources)
+
+    def reader_streams(self):
+        """Indices of the streams dealt to this rank and DataLoader worker."""
+        worker = get_worker_info()
+        num_workers, worker_id = (worker.num_workers, worker.id) if worker is not None else (1, 0)
+        reader = (worker_id + self.reader_offset) % num_workers
+        return self.dealt_streams(self.global_rank * num_workers + reader, self.world_size * num_workers)
+
+    def dealt_streams(self, reader, num_readers):
+        """Indices of the streams dealt to `reader` of `num_readers` in the current epoch."""
+        rng = np.random.default_rng([self.seed, self.epoch])
+        streams = []
+        for source in range(len(self.sources)):
+            indices = [i for i, stream_source in enumerate(self.stream_sources) if stream_source == source]
+            streams.extend(int(index) for index in rng.permutation(indices)[reader::num_readers])
+        return streams
+
+    def estimated_batches(self, num_workers=0):
+        """Batches per epoch of this rank estimated from the streams' token counts, None if unknown.
+
+        Ranks stop together when the first one runs out, so this is the
+        minimum over all ranks. It needs the token count of every stream
+        (see `model_utils.data_index`) and a single data source.
+        """
+        if len(self.sources) > 1 or any(stream.tokens is None for stream in self.streams):
+            return None
+        num_workers = max(num_workers, 1)
+        num_readers = self.world_size * num_workers
+        batches = []
+        for rank in range(self.world_size):
+            streams = [
+                index for worker in range(num_workers)
+                for index in self.dealt_streams(rank * num_workers + worker, num_readers)
+            ]
+            tokens = sum(self.streams[index].tokens for index in streams)
+            # unpacked, every document is at least one sample
+            samples = tokens / self.max_length if self.pack else max(
+                tokens / self.max_length, sum(self.streams[index].num_documents for index in streams)
+            )
+            batches.append(tokens / self.batch_tokens if self.batch_tokens else samples / self.batch_size)
+        return int(min(batches))
+
+    def stream_documents(self, index, start=0):
+        """Yield the documents of stream `index` from shuffled position `start` on."""
+        stream = self.streams[index]
+        block_size = self.shuffle_block_size
+        if block_size <= 1:
+            yield from stream.documents(start)
+            return
+        block, skip = divmod(start, block_size)
+        documents = stream.documents(block * block_size)
+        while texts := list(itertools.islice(documents, block_size)):
+            rng = np.random.default_rng([self.seed, self.epoch, zlib.crc32(stream.key.encode()), block])
+            for i in rng.permutation(len(texts))[skip:]:
+                yield texts[i]
+            block, skip = block + 1, 0
+
+    def stream_samples(self, index):
+        """Yield (tokens, e, t) for the samples of stream `index` after its current position."""
+        start_doc, start_token, _ = self.positions.get(self.streams[index].key, (0, 0, 0))
+        buffer = []
+        # [document, first token, number of tokens] of the documents in `buffer`
+        segments = collections.deque()
+        documents = self.stream_documents(index, start_doc)
+        for doc_index, text in enumerate(documents, start=start_doc):
+            if text is None:
+                continue
+            tokens = self.tokenizer(text, padding=False)['input_ids'] + [self.tokenizer.eos_token_id]
+            first = start_token if doc_index == start_doc else 0
+            if not self.pack:
+                for start in range(first, len(tokens), self.max_length):
+                    end = start + self.max_length
+                    if end < len(tokens):
+                        yield tokens[start:end], doc_index, end
+                    elif len(tokens) - start > 1:
+                        # a single token has nothing to predict
+                        yield tokens[start:], doc_index + 1, 0
+                continue
+            buffer.extend(tokens[first:])
+            segments.append([doc_index, first, len(tokens) - first])
+            while len(buffer) >= self.max_length:
+                sample = buffer[:self.max_length]
+                buffer = buffer[self.max_length:]
+                remaining = self.max_length
+                while segments and segments[0][2] <= remaining:
+                    remaining -= segments.popleft()[2]
+                if segments:
+                    segments[0][1] += remaining
+                    segments[0][2] -= remaining
+                    yield sample, segments[0][0], segments[0][1]
+                else:
+                    yield sample, doc_index + 1, 0
+
+    def __iter__(self):
+        samples = {index: self.stream_samples(index) for index in self.reader_streams()}
+        taken = {
+            index: self.positions.get(self.streams[index].key, (0, 0, 0))[2] for index in samples
+        }
+        source_taken = [0] * len(self.sources)
+        for index, count in taken.items():
+            source_taken[self.stream_sources[index]] += count
+        # [tokens, read seconds] per source since the last batch
+        stats = np.zeros((len(self.sources), 2))
+        batch = []
+        batch_length = 0
+        while samples:
+            # ties go to the source and stream dealt first
+            source = min(
+                {self.stream_sources[index] for index in samples},
+                key=lambda source: ((source_taken[source] + 1) / self.weights[source], source),
+            )
+            index = min(
+                (index for index in samples if self.stream_sources[index] == source), key=taken.__getitem__
+            )
+            read_start = time.perf_counter()
+            sample = next(samples[index], None)
+            read_time = time.perf_counter() - read_start
+            if sample is None:
+                del samples[index]
+                continue
+            taken[index] += 1
+            source_taken[source] += 1
+            tokens, doc_index, token_index = sample
+            if batch and self.batch_tokens and (len(batch) + 1) * max(batch_length, len(tokens)) > self.batch_tokens:
+                yield self.collate(batch, stats)
+                batch, batch_length, stats = [], 0, np.zeros_like(stats)
+            stats[source] += (len(tokens), read_time)
+            batch.append((tokens, (index, doc_index, token_index, taken[index])))
+            batch_length = max(batch_length, len(tokens))
+            if not self.batch_tokens and len(batch) == self.batch_size:
+                yield self.collate(batch, stats)
+                batch, batch_length, stats = [], 0, np.zeros_like(stats)
+        if batch:
+            yield self.collate(batch, stats)
+
+    def collate(self, batch, stats):
+        # int32 halves the host-to-device bytes of int64 ids; the DataLoader pins the result
+        length = max(len(tokens) for tokens, _ in batch)
+        input_ids = np.full((len(batch), length), self.pad_token_id, dtype=np.int32)
+        attention_mask = np.zeros((len(batch), length), dtype=np.int32)
+        for row, (tokens, _) in enumerate(batch):
+            input_ids[row, :len(tokens)] = tokens
+            attention_mask[row, :len(tokens)] = 1
+        collated = {
+            "input_ids": torch.from_numpy(input_ids),
+            "data_position": torch.tensor([position for _, position in batch], dtype=torch.long),
+            "source_stats": torch.from_numpy(stats),
+        }
+        if not attention_mask.all():
+            collated["attention_mask"] = torch.from_numpy(attention_mask)
+        return collated
+
+    def set_epoch(self, epoch):
+        """Set the epoch of the next iterators; positions only hold within an epoch."""
+        if epoch != self.epoch:
+            self.reset_positions()
+        self.epoch = epoch
+
+    def stream_readers(self):
+        """Stream index -> reader of this rank it is dealt to in the current epoch."""
+        if self._stream_readers is None or self._stream_readers[0] != self.epoch:
+            num_workers = max(self.num_workers, 1)
+            self._stream_readers = (self.epoch, {
+                index: reader for reader in range(num_workers)
+                for index in self.dealt_streams(self.global_rank * num_workers + reader, self.world_size * num_workers)
+            })
+        return self._stream_readers[1]
+
+    def update_positions(self, data_position):
+        """Record the positions of a batch consumed by training."""
+        # a batch comes from a single reader, the DataLoader takes the next one from the next reader
+        reader = self.stream_readers().get(int(data_position[0, 0]), 0) if len(data_position) else 0
+        self.next_reader = (reader + 1) % max(self.num_workers, 1)
+        for index, doc_index, token_index, count in data_position.tolist():
+            self.positions[self.streams[index].key] = (doc_index, token_index, count)
+            self.local_source_samples[self.stream_sources[index]] += 1
+        self.local_consumed_samples += len(data_position)
+
+    def reset_positions(self):
+        self.positions = {}
+        self.reader_offset = 0
+        self.next_reader = 0
+
+    def state_dict(self):
+        """Epoch, positions and consumed samples of all ranks. Collective, call on every rank."""
+        gathered = [None] * dist.get_world_size()
+        dist.all_gather_object(
+            gathered, (self.positions, self.local_consumed_samples, self.local_source_samples, self.next_reader)
+        )
+        positions = {}
+        for rank_positions, *_ in gathered:
+            for key, position in rank_positions.items():
+                # a stream is read by one rank at a time, others may hold its position from resume
+                positions[key] = max(tuple(position), positions.get(key, (0, 0, 0)))
+        return {
+            "epoch": self.epoch,
+            "min_streams": self.min_streams,
+            "positions": positions,
+            "consumed_samples": self.consumed_samples + sum(count for _, count, _, _ in gathered),
+            "source_samples": {
+                source: self.source_samples[i] + sum(counts[i] for _, _, counts, _ in gathered)
+                for i, source in enumerate(self.sources)
+            },
+            # next reader of every rank, only meaningful at the same number of ranks and workers
+            "readers": [self.world_size, max(self.num_workers, 1)],
+            "next_readers": [next_reader for *_, next_reader in gathered],
+        }
+
+    def load_state_dict(self, state_dict):
+        keys = {stream.key for stream in self.streams}
+        unknown = [key for key in state_dict["positions"] if key not in keys]
+        if unknown and self.global_rank == 0:
+            print(f"Warning: {len(unknown)} checkpointed data streams do not exist anymore, e.g. {unknown[0]}")
+        self.positions = {key: tuple(position) for key, position in state_dict["positions"].items()}
+        self.consumed_samples = state_dict["consumed_samples"]
+        self.epoch = state_dict.get("epoch", 0)
+        source_samples = state_dict.get("source_samples", {})
+        self.source_samples = [source_samples.get(source, 0) for source in self.sources]
+        self.local_source_samples = [0] * len(self.sources)
+        self.local_consumed_samples = 0
+        # at another scale the streams are dealt differently and no batch order can be kept
+        same_scale = state_dict.get("readers") == [self.world_size, max(self.num_workers, 1)]
+        self.reader_offset = state_dict["next_readers"][self.global_rank] if same_scale else 0
+        self.next_reader = self.reader_offset
@@ -3,6 +3,8 @@
 
 import os
 import math
+import resource
+import time
 import functools
 import numpy as np
 import torch
@@ -11,13 +13,18 @@ from torch.utils.data import DataLoader
 from datetime import datetime
 import tqdm
 import logging
-import glob
-import json
-from torch.distributed.fsdp import BackwardPrefetch, ShardingStrategy
-from transformers import AutoTokenizer
-from datasets import load_dataset, IterableDataset
-
-from model_utils.concat_dataset import ConcatTokensDataset
+from torch.distributed.fsdp import FullyShardedDataParallel as FSDP
+from torch.distributed.fsdp import BackwardPrefetch, ShardingStrategy, MixedPrecision, CPUOffload
+from torch.distributed.fsdp.wrap import transformer_auto_wrap_policy
+from transformers import AutoModelForCausalLM
+from transformers.modeling_utils import no_init_weights
+
+from model_utils.streaming_dataset import StreamingTokensDataset, get_streams, get_mixture_streams
+from model_utils.chunked_loss import apply_chunked_cross_entropy
+from model_utils.meta_init import init_empty_weights, init_parameters_, get_param_init_fn
+from model_utils.seeding import derive_seed, seed_worker
+from model_utils.node_cache import load_tokenizer
+from model_utils.data_index import attach_indexes
 
 from transformers import LlamaForCausalLM, LlamaTokenizer, LlamaConfig
 from transformers.models.llama.modeling_llama import LlamaDecoderLayer
@@ -112,7 +119,12 @@ def validation(model, rank, world_size, val_loader):
     return val_loss
 
 def get_model_config(args):
-    if "gpt_neox" in args.model_type:
+    if args.pretrained_path:
+        from transformers import AutoConfig
+
+        model_config = AutoConfig.from_pretrained(args.pretrained_path)
+        model_config.use_cache = False
+    elif "gpt_neox" in args.model_type:
         from transformers import GPTNeoXConfig
 
         model_config = GPTNeoXConfig(
@@ -288,19 +300,400 @@ def get_transformer_layer(model_type="gpt2"):
 
     return transformer_layer
 
+# --sharding_strategy names that differ from the ShardingStrategy member
+_SHARDING_STRATEGY_ALIASES = {
+    "full": "FULL_SHARD",
+    "hybrid": "HYBRID_SHARD",
+    "hybrid_zero2": "_HYBRID_SHARD_ZERO2",
+}
+
 def get_sharding_strategy(strategy: str):
     """Get sharding strategy."""
-    sharding_strategy = getattr(ShardingStrategy, strategy.upper())
-    _logger.debug("Translating %s to %s.", strategy, sharding_strategy)
+    name = _SHARDING_STRATEGY_ALIASES.get(strategy.lower(), strategy.upper())
+    sharding_strategy = getattr(ShardingStrategy, name)
+    get_logger().debug("Translating %s to %s.", strategy, sharding_strategy)
     return sharding_strategy
 
 
 def get_backward_fetch_policy(policy: str):
-    """Get backward fetch policy."""
+    """Get backward fetch policy, "none" disables backward prefetching."""
+    if policy.lower() == "none":
+        return None
     backward_fetch_policy = getattr(BackwardPrefetch, policy.upper())
-    _logger.debug("Translating %s to %s.", policy, backward_fetch_policy)
+    get_logger().debug("Translating %s to %s.", policy, backward_fetch_policy)
     return backward_fetch_policy
 
+_hybrid_shard_process_groups = {}
+
+def get_hybrid_shard_process_groups(shard_group_size):
+    """(shard group, replicate group) of this rank for hybrid sharding.
+
+    Parameters are sharded within blocks of `shard_group_size` consecutive
+    ranks and replicated across blocks, so all-gathers stay inside a block
+    (e.g. one or two P5 nodes) and only gradient all-reduces cross blocks.
+    Groups are created once per size since every rank has to take part in
+    creating all of them.
+    """
+    if shard_group_size not in _hybrid_shard_process_groups:
+        world_size = dist.get_world_size()
+        rank = dist.get_rank()
+        if world_size % shard_group_size:
+            raise ValueError(
+                f"World size {world_size} is not divisible by shard group size {shard_group_size}"
+            )
+        shard_group = replicate_group = None
+        for start in range(0, world_size, shard_group_size):
+            group = dist.new_group(list(range(start, start + shard_group_size)))
+            if start <= rank < start + shard_group_size:
+                shard_group = group
+        for offset in range(shard_group_size):
+            group = dist.new_group(list(range(offset, world_size, shard_group_size)))
+            if rank % shard_group_size == offset:
+                replicate_group = group
+        _hybrid_shard_process_groups[shard_group_size] = (shard_group, replicate_group)
+    return _hybrid_shard_process_groups[shard_group_size]
+
+def get_compute_device():
+    """Device the FSDP model computes on: the current GPU, or CPU without CUDA."""
+    if torch.cuda.is_available():
+        return torch.device("cuda", torch.cuda.current_device())
+    return torch.device("cpu")
+
+def get_peak_host_memory():
+    """Peak resident host memory (bytes) of this process, max over all ranks."""
+    # ru_maxrss is reported in KiB on Linux
+    peak = torch.tensor(
+        [resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024],
+        dtype=torch.float64, device=get_compute_device(),
+    )
+    dist.all_reduce(peak, op=dist.ReduceOp.MAX)
+    return int(peak.item())
+
+def get_model_inputs(batch, device):
+    """Move a batch to `device` and build the model inputs, with padding masked out of the labels."""
+    input_ids = batch["input_ids"].to(device, non_blocking=True)
+    attention_mask = batch.get("attention_mask")
+    labels = input_ids.long()
+    if attention_mask is not None:
+        attention_mask = attention_mask.to(device, non_blocking=True)
+        labels = labels.masked_fill(attention_mask == 0, -100)
+    return {"input_ids": input_ids, "attention_mask": attention_mask, "labels": labels}
+
+
+def eval_model(model, dataloader, num_batches, async_op=False, sync_every=8):
+    """Eval step.
+
+    Ranks evaluate their batches in lockstep until every rank has run out or
+    evaluated `num_batches`; a rank without a batch runs a forward on a dummy
+    input instead, so FSDP collectives stay matched when ranks hold different
+    numbers of validation batches. Whether all ranks have run out is only
+    checked every `sync_every` batches, each check being a collective and a
+    host sync; in between, ranks that ran out keep running dummy forwards.
+    The token-level loss and the number of predicted tokens are summed on
+    device and reduced with a single all_reduce, so the result is the
+    per-token mean over all evaluated batches.
+
+    Returns (loss, ppl). With async_op=True the all_reduce is left in flight and
+    a callable returning (loss, ppl) is returned instead, so the reduction can
+    overlap with the next training step.
+    """
+    model = model.eval()
+    device = get_compute_device()
+    # [loss_sum, num_tokens]
+    stats = torch.zeros(2, dtype=torch.float64, device=device)
+    batches = iter(dataloader)
+    exhausted = False
+
+    # torch.inference_mode() would be cheaper, but FSDP keeps the root's
+    # unsharded views alive after forward and those cannot be reused for
+    # autograd in the next training step if they were created as inference tensors.
+    with torch.no_grad():
+        for step in range(num_batches):
+            batch = None if exhausted else next(batches, None)
+            exhausted = batch is None
+            if step % sync_every == 0:
+                done = torch.tensor([exhausted], dtype=torch.int32)
+                dist.all_reduce(done, op=dist.ReduceOp.MIN)
+                if done.item():
+                    break
+            if batch is None:
+                model(input_ids=torch.zeros((1, 1), dtype=torch.long, device=device))
+                continue
+
+            inputs = get_model_inputs(batch, device)
+            loss = model(**inputs)["loss"]
+            # HF shifts labels by one position and averages over the remaining tokens;
+            # counted on device, a host sync per batch would stall the eval loop
+            batch_tokens = (inputs["labels"][..., 1:] != -100).sum()
+            stats[0] += loss.detach() * batch_tokens
+            stats[1] += batch_tokens
+
+    handle = dist.all_reduce(stats, async_op=async_op)
+
+    def wait():
+        if handle is not None:
+            handle.wait()
+        loss_sum, total_tokens = stats.tolist()
+        if total_tokens == 0:
+            return -1.0, -1.0
+        loss = loss_sum / total_tokens
+        return loss, math.exp(loss)
+
+    return wait if async_op else wait()
+
+def next_batch(batches, step, sync_every=8):
+    """Batch for training step `step` of an epoch, or None on every rank once any rank has run out.
+
+    Ranks read different streams and run out at different steps; stopping
+    together keeps FSDP collectives matched at the end of an epoch. Whether
+    any rank has run out is only checked every `sync_every` steps, each check
+    being a collective and a host sync. In between, a rank that ran out gets
+    a dummy batch to keep stepping with the others: its loss is to be
+    multiplied by zero and its data positions not recorded, so it adds
+    nothing but zero gradients to the average.
+
+    Returns (batch, seconds this rank waited for its own batch, whether the
+    batch is a dummy).
+    """
+    wait_start = time.time()
+    batch = next(batches, None)
+    data_wait = time.time() - wait_start
+    if step % sync_every == 0:
+        exhausted = torch.tensor([batch is None], dtype=torch.int32)
+        dist.all_reduce(exhausted, op=dist.ReduceOp.MAX)
+        if exhausted.item():
+            return None, data_wait, False
+    if batch is None:
+        # two tokens, so that there is a label and the loss is not NaN
+        return {"input_ids": torch.zeros((1, 2), dtype=torch.int32)}, data_wait, True
+    return batch, data_wait, False
+
+def create_model(args, model_config, global_rank):
+    """Instantiate the HF model that `wrap_model_with_fsdp` will shard."""
+    # Instantiate model on CPU on rank=0 only to prevent CPU OOM
+    # (e.g. 70B * 4 bytes * 8 processes > 2T RAM available on P5).
+    # FSDP's sync_module_states needs CUDA, so CPU-only runs (small configs
+    # for validation) materialize the model on every rank instead.
+    # With meta_init no rank materializes it; shards are initialized in FSDP
+    # (and overwritten by `load_pretrained_weights` with --pretrained_path).
+    if args.meta_init > 0 or args.pretrained_path:
+        with init_empty_weights():
+            model = AutoModelForCausalLM.from_config(model_config)
+    elif global_rank == 0 or not torch.cuda.is_available():
+        # skip HF's own initialization, the parameters are initialized once below
+        with no_init_weights():
+            model = AutoModelForCausalLM.from_config(model_config)
+        # same values as meta_init for the same seed, instead of HF's draws from the global RNG
+        init_parameters_(model, args.seed, model_config.initializer_range)
+    else:
+        with torch.device("meta"):
+            # Instantiating model on `meta` device doesn't consume CPU memory,
+            # but requires specifing `param_init_fn=...`
+            # and `sync_module_states=True` in FSDP c-tor.
+            model = AutoModelForCausalLM.from_config(model_config)
+
+    if args.chunked_loss_size > 0:
+        apply_chunked_cross_entropy(model, args.chunked_loss_size)
+    return model
+
+def wrap_model_with_fsdp(args, model, global_rank):
+    """Wrap a model from `create_model` with FSDP according to the fsdp args."""
+    if args.bf16:
+        dtype = torch.bfloat16
+    else:
+        dtype = torch.get_default_dtype()
+
+    transformer_layer = get_transformer_layer(args.model_type)
+
+    gpt_auto_wrap_policy = functools.partial(
+        transformer_auto_wrap_policy,
+        transformer_layer_cls={
+            transformer_layer,
+        },
+    )
+
+    mixed_precision_policy = MixedPrecision(
+        param_dtype=dtype, reduce_dtype=dtype, buffer_dtype=dtype
+    )
+
+    sharding_strategy = get_sharding_strategy(args.sharding_strategy)
+    process_group = None
+    if args.shard_group_size:
+        if sharding_strategy in (ShardingStrategy.HYBRID_SHARD, ShardingStrategy._HYBRID_SHARD_ZERO2):
+            process_group = get_hybrid_shard_process_groups(args.shard_group_size)
+        elif global_rank == 0:
+            # full and shard_grad_op shard across all ranks, e.g. an autotune trial of the full strategy
+            get_logger().warning(
+                "Ignoring --shard_group_size=%d, it only applies to the hybrid sharding strategies, not %s.",
+                args.shard_group_size, args.sharding_strategy,
+            )
+
+    if args.cpu_offload == 1:
+        cpu_offload = CPUOffload(offload_params=True)
+    else:
+        cpu_offload = None
+
+    device = get_compute_device()
+    on_meta = any(p.is_meta for p in model.parameters())
+    if args.meta_init > 0 or args.pretrained_path:
+        # Every rank computes the same values for its own shards, nothing to broadcast.
+        param_init_fn = get_param_init_fn(model, args.seed, model.config.initializer_range, device)
+        sync_module_states = False
+    else:
+        param_init_fn = (lambda module: module.to_empty(device=device, recurse=False)) if on_meta else None
+        sync_module_states = torch.cuda.is_available()
+    model = FSDP(
+        model,
+        auto_wrap_policy=gpt_auto_wrap_policy,
+        mixed_precision=mixed_precision_policy,
+        limit_all_gathers=args.limit_all_gathers,
+        device_id=device,
+        use_orig_params=False,
+        sharding_strategy=sharding_strategy,
+        process_group=process_group,
+        backward_prefetch=get_backward_fetch_policy(args.backward_prefetch),
+        forward_prefetch=args.forward_prefetch > 0,
+        cpu_offload=cpu_offload,
+        sync_module_states=sync_module_states,
+        param_init_fn=param_init_fn,
+    )
+    return model
+
+_ATTENTION_MODULE_NAMES = ("self_attn", "attention", "self_attention", "attn")
+_MLP_MODULE_NAMES = ("mlp", "block_sparse_moe", "feed_forward")
+
+
+def _get_submodule_by_names(layer, names):
+    for name in names:
+        submodule = getattr(layer, name, None)
+        if isinstance(submodule, torch.nn.Module):
+            return submodule
+    raise NotImplementedError(
+        f"{type(layer).__name__} has none of the submodules {names}"
+    )
+
+
+def _is_parameter(tensor):
+    # FSDP hands out views of the flat parameter, so look at the view's base
+    while tensor._base is not None:
+        tensor = tensor._base
+    return isinstance(tensor, torch.nn.Parameter)
+
+
+def measure_layer_activation_bytes(model, transformer_layer, batch_size, seq_len):
+    """Measure the activation memory of one transformer layer.
+
+    Runs a single forward pass with autograd enabled on a random batch and
+    counts the storage saved for backward while each transformer layer runs,
+    excluding parameters. Saved tensors are only held until their layer
+    finishes and never handed to autograd, so the probe needs about the
+    memory of a step with every layer checkpointed, not of an unchecked one.
+    Returns the largest per-layer footprint and the size of a layer's input
+    hidden states, which is what a checkpointed layer keeps. Both are reduced
+    with MAX over ranks so every rank takes the same decision.
+    """
+    layers = [m for m in model.modules() if isinstance(m, transformer_layer)]
+    layer_bytes = {id(layer): 0 for layer in layers}
+    input_bytes = [0]
+    running = []
+    # storages saved by the running layer, kept alive so their addresses are not reused
+    saved_storages = {}
+
+    def pre_hook(module, args, kwargs):
+        running.append(id(module))
+        hidden_states = args[0] if args else kwargs["hidden_states"]
+        input_bytes[0] = max(input_bytes[0], hidden_states.numel() * hidden_states.element_size())
+
+    def post_hook(module, args, kwargs, output):
+        running.pop()
+        saved_storages.clear()
+
+    def pack(tensor):
+        if running and not _is_parameter(tensor):
+            storage = tensor.untyped_storage()
+            if storage.data_ptr() not in saved_storages:
+                saved_storages[storage.data_ptr()] = storage
+                layer_bytes[running[-1]] += storage.nbytes()
+        # nothing is kept for backward, the probe never runs one
+        return None
+
+    handles = []
+    for layer in layers:
+        handles.append(layer.register_forward_pre_hook(pre_hook, with_kwargs=True))
+        handles.append(layer.register_forward_hook(post_hook, with_kwargs=True))
+
+    device = get_compute_device()
+    vocab_size = model.get_input_embeddings().num_embeddings
+    # private generator, so probing does not shift the global RNG stream
+    generator = torch.Generator().manual_seed(0)
+    input_ids = torch.randint(0, vocab_size, (batch_size, seq_len), generator=generator).to(device)
+    try:
+        with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+            # with labels, the loss is computed as in training, e.g. in chunks with --chunked_loss_size
+            outputs = model(input_ids=input_ids, attention_mask=None, labels=input_ids)
+        del outputs
+    finally:
+        for handle in handles:
+            handle.remove()
+
+    measured = torch.tensor(
+        [max(layer_bytes.values(), default=0), input_bytes[0]], dtype=torch.int64, device=device
+    )
+    if dist.is_initialized():
+        dist.all_reduce(measured, op=dist.ReduceOp.MAX)
+    return tuple(measured.tolist())
+
+
+def get_activation_checkpoint_modules(args, model, transformer_layer):
+    """Pick the modules to wrap with activation checkpointing.
+
+    Policies:
+        all: every transformer layer.
+        every_k: every `activation_checkpointing_interval`-th transformer layer.
+        attention / mlp: only the attention or MLP sub-module of every layer.
+        memory_budget: as few leading layers as needed for the measured
+            activations of all layers to fit in `activation_memory_budget` GB.
+    """
+    layers = [m for m in model.modules() if isinstance(m, transformer_layer)]
+    policy = args.activation_checkpointing_policy
+
+    if policy == "all":
+        return layers
+    if policy == "every_k":
+        return layers[::args.activation_checkpointing_interval]
+    if policy == "attention":
+        return [_get_submodule_by_names(layer, _ATTENTION_MODULE_NAMES) for layer in layers]
+    if policy == "mlp":
+        return [_get_submodule_by_names(layer, _MLP_MODULE_NAMES) for layer in layers]
+    if policy == "memory_budget":
+        if args.activation_memory_budget is None:
+            raise ValueError("--activation_memory_budget is required for the memory_budget policy")
+        layer_bytes, boundary_bytes = measure_layer_activation_bytes(
+            model, transformer_layer, args.train_batch_size, args.max_context_width
+        )
+        budget_bytes = args.activation_memory_budget * g_gigabyte
+        num_layers = len(layers)
+        # n layers kept whole cost n * layer_bytes, the rest only keep their input
+        if layer_bytes > boundary_bytes:
+            num_kept = int((budget_bytes - num_layers * boundary_bytes) // (layer_bytes - boundary_bytes))
+        else:
+            num_kept = num_layers
+        num_kept = min(max(num_kept, 0), num_layers)
+        if dist.get_rank() == 0:
+            get_logger().info(
+                "Activation memory per layer: %.3f GB (checkpointed: %.3f GB), budget %.2f GB, "
+                "checkpointing %d of %d layers",
+                format_metrics_to_gb(layer_bytes),
+                format_metrics_to_gb(boundary_bytes),
+                args.activation_memory_budget,
+                num_layers - num_kept,
+                num_layers,
+            )
+        # activations of early layers live the longest, so checkpoint those first
+        return layers[:num_layers - num_kept]
+    raise NotImplementedError(f"Activation checkpointing policy {policy} not implemented")
+
+
 def apply_activation_checkpoint(args, model=None):
     from torch.distributed.algorithms._checkpoint.checkpoint_wrapper import (
         CheckpointImpl,
@@ -309,9 +702,10 @@ def apply_activation_checkpoint(args, model=None):
     )
 
     transformer_layer = get_transformer_layer(args.model_type)
-    check_fn_gpt = lambda submodule: isinstance(
-        submodule, transformer_layer
-    )
+    checkpoint_modules = {
+        id(module) for module in get_activation_checkpoint_modules(args, model, transformer_layer)
+    }
+    check_fn_gpt = lambda submodule: id(submodule) in checkpoint_modules
     entrant_wrapper = functools.partial(
         checkpoint_wrapper, checkpoint_impl=CheckpointImpl.NO_REENTRANT
     )
@@ -502,80 +896,74 @@ def create_streaming_dataloader(dataset,
                       tokenizer,
                       name=None,
                       global_rank=0,
+                      world_size=1,
                       batch_size=1,
                       max_context_width=4096,
                       workers=4,
-                      split=None):
-    print(f"dataset={dataset}, name={name}")
-    tokenizer = AutoTokenizer.from_pretrained(tokenizer,legacy=False)
-    
-    # Check if dataset is a local path (starts with / or ./)
-    if dataset.startswith('/') or dataset.startswith('./'):
-        # Load local JSONL files
-        print(f"Loading local dataset from: {dataset}")
-        
-        if not os.path.exists(dataset):
-            raise FileNotFoundError(f"Local dataset directory not found: {dataset}")
-        
-        # Find all JSONL files in the directory
-        if split == 'train':
-            pattern = os.path.join(dataset, '*train*.jsonl')
-        elif split == 'validation':
-            pattern = os.path.join(dataset, '*validation*.jsonl')
-        else:
-            # Default to all JSONL files
-            pattern = os.path.join(dataset, '*.jsonl')
-        
-        jsonl_files = glob.glob(pattern)
-        if not jsonl_files:
-            # Fallback to all JSONL files if no split-specific files found
-            jsonl_files = glob.glob(os.path.join(dataset, '*.jsonl'))
-        
-        if not jsonl_files:
-            raise FileNotFoundError(f"No JSONL files found in {dataset}")
-        
-        print(f"Found {len(jsonl_files)} JSONL files for split '{split}': {[os.path.basename(f) for f in jsonl_files]}")
-        
-        # Create a generator that yields from all JSONL files
-        def jsonl_generator():
-            total_samples = 0
-            for file_path in jsonl_files:
-                file_samples = 0
-                print(f"Loading data from: {os.path.basename(file_path)}")
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        for line_num, line in enumerate(f, 1):
-                            try:
-                                line = line.strip()
-                                if line:  # Skip empty lines
-                                    data = json.loads(line)
-                                    # Ensure the data has a 'text' field
-                                    if 'text' in data:
-                                        yield data
-                                        file_samples += 1
-                                        total_samples += 1
-                                    else:
-                                        print(f"Warning: Line {line_num} in {os.path.basename(file_path)} missing 'text' field")
-                            except json.JSONDecodeError as e:
-                                print(f"Warning: JSON decode error at line {line_num} in {os.path.basename(file_path)}: {e}")
-                                continue
-                    print(f"Loaded {file_samples} samples from {os.path.basename(file_path)}")
-                except Exception as e:
-                    print(f"Error reading file {file_path}: {e}")
-                    continue
-            print(f"Total samples loaded: {total_samples}")
-        
-        # Convert generator to HuggingFace IterableDataset
-        data = IterableDataset.from_generator(jsonl_generator).shuffle(42+global_rank)
+                      split=None,
+                      num_stripes=1,
+                      seed=42,
+                      shuffle_block_size=0,
+                      mixture=None,
+                      pack=True,
+                      batch_tokens=0,
+                      cache_dir=None,
+                      s3_read_ahead=4,
+                      min_streams=None):
+    """DataLoader over a `StreamingTokensDataset` of a local JSONL directory, an S3 prefix or a HF dataset.
+
+    Batches are dicts with int32 "input_ids", "data_position" and, if they are
+    padded, "attention_mask" (see `StreamingTokensDataset`); the positions of
+    consumed batches are recorded with `dataloader.dataset.update_positions`.
+    The data order only depends on `seed`, and workers are seeded per rank.
+    With `mixture` (sources from `load_mixture`), its sources are blended by
+    weight instead of reading `dataset`. `tokenizer` is a tokenizer or its
+    name; with `cache_dir`, names and file lists are resolved once per node.
+    s3:// objects are streamed `s3_read_ahead` ranged GETs ahead and, with
+    `cache_dir`, kept on the node's disk for re-reads. Files are split into
+    at least `min_streams` streams, by default one per reader (rank and
+    DataLoader worker); pass the value from a resumed data state.
+    """
+    if isinstance(tokenizer, str):
+        tokenizer = load_tokenizer(tokenizer, cache_dir)
+
+    if min_streams is None:
+        min_streams = world_size * max(workers, 1)
+    weights = None
+    if mixture:
+        print(f"data mixture: {[(source['name'], source['dataset']) for source in mixture]}")
+        streams = get_mixture_streams(
+            mixture, split=split, num_stripes=num_stripes, cache_dir=cache_dir, s3_read_ahead=s3_read_ahead,
+            min_streams=min_streams,
+        )
+        weights = {source["name"]: source.get("weight", 1.0) for source in mixture}
     else:
-        # Use HuggingFace datasets for remote datasets
-        data = load_dataset(dataset, name=name, streaming=True, split=split).shuffle(42+global_rank)
-    
-    train_concat_dataset = ConcatTokensDataset(data, tokenizer, max_context_width, True)
-    train_dataloader = DataLoader(train_concat_dataset,
-                                       batch_size=batch_size,
+        print(f"dataset={dataset}, name={name}")
+        # Check if dataset is a local path (starts with / or ./)
+        if dataset.startswith('/') or dataset.startswith('./'):
+            print(f"Loading local dataset from: {dataset}")
+        elif dataset.startswith('s3://'):
+            print(f"Streaming dataset from: {dataset}")
+        streams = get_streams(
+            dataset, name=name, split=split, num_stripes=num_stripes, cache_dir=cache_dir, s3_read_ahead=s3_read_ahead,
+            min_streams=min_streams,
+        )
+
+    num_indexed = attach_indexes(streams, tokenizer)
+    if num_indexed:
+        print(f"Loaded the index of {num_indexed} data files")
+
+    train_dataset = StreamingTokensDataset(
+        streams, tokenizer, max_context_width, batch_size, global_rank=global_rank, world_size=world_size,
+        seed=seed, shuffle_block_size=shuffle_block_size, weights=weights,
+        pack=pack, batch_tokens=batch_tokens, num_workers=workers, min_streams=min_streams,
+    )
+    train_dataloader = DataLoader(train_dataset,
+                                       batch_size=None,
                                        num_workers=workers,
                                        pin_memory=True,
-                                       prefetch_factor=4,
-                                       timeout=600)
+                                       worker_init_fn=seed_worker,
+                                       generator=torch.Generator().manual_seed(derive_seed(seed, global_rank)),
+                                       prefetch_factor=4 if workers > 0 else None,
+                                       timeout=600 if workers > 0 else 0)
     return train_dataloader
@@ -2,8 +2,8 @@
 # SPDX-License-Identifier: MIT-0
 
 import datetime
-import functools
-import math
+import itertools
+import os
 import re
 import time
 
@@ -14,27 +14,32 @@ import torch.distributed as dist
 import torch.utils.data
 
 import transformers
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from transformers import AutoTokenizer
 from datasets import load_dataset
 
-from torch.distributed.fsdp import FullyShardedDataParallel as FSDP
-from torch.distributed.fsdp import MixedPrecision
-from torch.distributed.fsdp import ShardingStrategy
-from torch.distributed.fsdp import CPUOffload
-from torch.distributed.fsdp.wrap import size_based_auto_wrap_policy, transformer_auto_wrap_policy
+from torch.distributed.fsdp.wrap import size_based_auto_wrap_policy
 from torch.utils.data import DataLoader
 
 from model_utils.concat_dataset import ConcatTokensDataset
 from model_utils.train_utils import (get_model_config, 
                                    compute_num_params,
-                                   get_transformer_layer,
-                                   get_sharding_strategy,
-                                   get_backward_fetch_policy,
+                                   get_compute_device,
+                                   create_model,
+                                   wrap_model_with_fsdp,
+                                   get_peak_host_memory,
                                    apply_activation_checkpoint,
                                    get_param_groups_by_weight_decay,
                                    get_logger,
                                    get_learning_rate_scheduler,
-                                   create_streaming_dataloader)
+                                   create_streaming_dataloader,
+                                   get_model_inputs,
+                                   eval_model,
+                                   next_batch)
+from model_utils.pretrained_loader import load_pretrained_weights
+from model_utils.streaming_dataset import load_mixture
+from model_utils.device_prefetch import DevicePrefetcher
+from model_utils.node_cache import get_local_rank, load_tokenizer
+from model_utils.seeding import set_seed, derive_seed, gather_rng_states, set_rng_state
 from model_utils.checkpoint import save_checkpoint, load_checkpoint
 from model_utils.checkpoint import save_checkpoint_mtc, load_checkpoint_mtc
 from model_utils.arguments import parse_args
@@ -54,32 +59,6 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 
-def eval_model(model, dataloader, num_batches):
-    """Eval step."""
-    model = model.eval()
-    n_batches = 0
-    loss = 0.0
-
-    with torch.no_grad():
-        for batch_idx, input_data in enumerate(dataloader):
-            if batch_idx >= num_batches:
-                break
-
-            loss += model(input_ids=input_data, attention_mask=None, labels=input_data)["loss"]
-            n_batches += 1
-
-    if n_batches > 0:
-        detached_loss = loss.detach()
-        torch.distributed.all_reduce(detached_loss)
-        loss = detached_loss.item() / dist.get_world_size()
-        loss /= n_batches
-        ppl = math.exp(loss)
-    else:
-        loss = -1.0
-        ppl = -1.0
-
-    return loss, ppl
-
 def train(
         model,
         optimizer,
@@ -92,177 +71,263 @@ def train(
         global_rank,
         world_size,
         total_steps=0,
-        start_batch_index=0
+        start_batch_index=0,
+        resume_from_positions=False,
+        steps_per_epoch=None
     ):
     model.train()
-    for index in range(args.epochs):
-        for batch_idx, input_data in enumerate(train_dataloader):
-            if batch_idx < start_batch_index:
-                continue
-            optimizer.zero_grad(set_to_none=True)
-            step_start = time.time()
-            loss = model(input_ids=input_data, attention_mask=None, labels=input_data)["loss"]
-            loss.backward()
-            model.clip_grad_norm_(args.grad_clip)
-            optimizer.step()
-            lr_scheduler.step()
-            total_steps += 1
-            loss_metric = loss.item()
-            step_time = time.time() - step_start
-            sample_processed = input_data.shape[0] * world_size
-            throughput = sample_processed / step_time
-            loss_scalar = loss.item()
-            current_lr = lr_scheduler.get_lr()
-            if global_rank==0 and batch_idx%args.logging_freq==0:
-                logger.info(
-                    "Batch %d Loss: %.5f, Speed: %.2f samples/sec, lr: %.6f",  # pylint: disable=line-too-long
+    pending_eval = None
+    train_dataset = train_dataloader.dataset
+    device = get_compute_device()
+
+    def log_validation(batch_idx, val_loss, val_ppl):
+        if global_rank == 0:
+            logger.info(
+                    "Batch %d Validation loss: %s, ppl: %s",
                     batch_idx,
-                    loss_scalar,
-                    throughput,
-                    current_lr,
-                )
-            if args.validation_freq and not total_steps % args.validation_freq:
-                val_loss, val_ppl = eval_model(
-                    model, val_dataloader, args.validation_batches
+                    val_loss,
+                    val_ppl,
                 )
-                model = model.train()
-                if global_rank == 0:
+
+    def log_sources(source_stats, elapsed):
+        # consumed rates follow the weights, a source with a low read rate slows the input down
+        logger.info(
+            "Data sources (tokens/sec consumed, read): %s",
+            ", ".join(
+                f"{source}: {tokens * world_size / elapsed:.0f}, {tokens / max(seconds, 1e-9):.0f}"
+                for source, (tokens, seconds) in zip(train_dataset.sources, source_stats.tolist())
+            ),
+        )
+
+    def log_checkpoint(stall):
+        # time the training loop waited for the save, tracked by the perf regression gate
+        if global_rank == 0:
+            logger.info("Step %d Checkpoint stall: %.2fs", total_steps, stall)
+
+    # [tokens, read seconds] per data source since the last log
+    source_stats = torch.zeros(len(train_dataset.sources), 2, dtype=torch.float64)
+    source_log_start = time.time()
+
+    # with an indexed dataset, progress and ETA are logged against the estimated epoch length
+    run_start, run_start_steps = time.time(), total_steps
+    target_steps = min(args.max_steps, args.epochs * steps_per_epoch) if steps_per_epoch else None
+
+    def log_progress(epoch, batch_idx):
+        eta = (target_steps - total_steps) * (time.time() - run_start) / max(total_steps - run_start_steps, 1)
+        logger.info(
+            "Epoch %d: %.1f%% (batch %d of ~%d), ETA %s",
+            epoch, 100 * min((batch_idx + 1) / steps_per_epoch, 1), batch_idx, steps_per_epoch,
+            datetime.timedelta(seconds=int(max(eta, 0))),
+        )
+
+    # a resumed dataset starts in the epoch it was checkpointed in
+    for epoch in range(train_dataset.epoch, args.epochs):
+        train_dataset.set_epoch(epoch)
+        if global_rank == 0:
+            logger.info("Starting epoch %d", epoch)
+        batches = DevicePrefetcher(train_dataloader, device, depth=args.prefetch_batches)
+        # with recorded positions the dataset resumes where it left off,
+        # older checkpoints only have the batch index to skip to.
+        # Either way only the resumed epoch is affected.
+        batch_idx = start_batch_index - 1 if resume_from_positions else -1
+        try:
+            for step in itertools.count():
+                batch, data_wait, dry = next_batch(batches, step)
+                if batch is None:
+                    break
+                batch_idx += 1
+                if batch_idx < start_batch_index:
+                    continue
+                if not dry:
+                    train_dataset.update_positions(batch["data_position"])
+                    source_stats += batch["source_stats"]
+                optimizer.zero_grad(set_to_none=True)
+                step_start = time.time()
+                inputs = get_model_inputs(batch, device)
+                loss = model(**inputs)["loss"]
+                if dry:
+                    # this rank ran out of data, it steps with the others until they all stop
+                    loss = loss * 0
+                loss.backward()
+                model.clip_grad_norm_(args.grad_clip)
+                optimizer.step()
+                lr_scheduler.step()
+                total_steps += 1
+                loss_metric = loss.item()
+                step_time = time.time() - step_start
+                sample_processed = inputs["input_ids"].shape[0] * world_size
+                throughput = sample_processed / step_time
+                token_throughput = inputs["input_ids"].numel() * world_size / step_time
+                loss_scalar = loss.item()
+                current_lr = lr_scheduler.get_lr()
+                if batch_idx % args.logging_freq == 0:
+                    transfer_ms = batches.transfer_time() * 1000
+                if global_rank==0 and batch_idx%args.logging_freq==0:
                     logger.info(
-                            "Batch %d Validation loss: %s",
-                            batch_idx,
-                            val_loss,
+                        "Batch %d Loss: %.5f, Speed: %.2f samples/sec, lr: %.6f, H2D: %.2fms, prefetched: %d",  # pylint: disable=line-too-long
+                        batch_idx,
+                        loss_scalar,
+                        throughput,
+                        current_lr,
+                        transfer_ms,
+                        batches.buffered,
+                    )
+                    if steps_per_epoch:
+                        log_progress(epoch, batch_idx)
+                if get_local_rank() == 0 and batch_idx % args.logging_freq == 0:
+                    # one line per node, so that pod logs show which node is slow;
+                    # steps end together, a node with slow input waits longer for its data
+                    logger.info(
+                        "Node %d Batch %d Step time: %.1fms, Data wait: %.1fms, Speed: %.2f samples/sec, "
+                        "%.0f tokens/sec, H2D: %.2fms, prefetched: %d",
+                        global_rank // int(os.environ.get("LOCAL_WORLD_SIZE", 1)),
+                        batch_idx,
+                        step_time * 1000,
+                        data_wait * 1000,
+                        throughput,
+                        token_throughput,
+                        transfer_ms,
+                        batches.buffered,
+                    )
+                if batch_idx % args.logging_freq == 0 and len(train_dataset.sources) > 1:
+                    if global_rank == 0:
+                        log_sources(source_stats, time.time() - source_log_start)
+                    source_stats.zero_()
+                    source_log_start = time.time()
+                if pending_eval is not None:
+                    # reduction was issued during the previous step, it has overlapped with this one
+                    eval_batch_idx, wait_eval = pending_eval
+                    log_validation(eval_batch_idx, *wait_eval())
+                    pending_eval = None
+                if args.validation_freq and not total_steps % args.validation_freq:
+                    result = eval_model(
+                        model, val_dataloader, args.validation_batches,
+                        async_op=args.validation_async > 0,
+                    )
+                    model = model.train()
+                    if args.validation_async > 0:
+                        pending_eval = (batch_idx, result)
+                    else:
+                        log_validation(batch_idx, *result)
+
+                # for MTC
+                if use_mtc:
+                
+                    save_in_memory = total_steps % args.in_memory_checkpointing_freq == 0
+                    save_s3 = total_steps % args.s3_checkpointing_freq == 0
+
+                    if save_in_memory or save_s3:
+
+                        user_content = {
+                            "cli_args": args.__dict__,
+                            "num_params": num_params,
+                            "total_steps": total_steps,
+                            "model_config": model_config,
+                            "start_batch_index": batch_idx + 1,
+                            "data_state": train_dataset.state_dict(),
+                            "rng_state": gather_rng_states(),
+                        }
+
+                        sub_dir = f"{args.model_type}-{total_steps}steps"
+                        checkpoint_start = time.time()
+
+                        save_checkpoint_mtc(
+                            model,
+                            optimizer,
+                            lr_scheduler,
+                            user_content,
+                            args.checkpoint_dir,
+                            sub_dir,
+                            save_in_memory,
+                            save_s3,
+                            total_steps,
+                            s3_tier_base_path=args.s3_tier_base_path,
+                            mtc_namespace=args.mtc_namespace,
+                        )
+                        log_checkpoint(time.time() - checkpoint_start)
+
+                else:
+                    if args.checkpoint_dir and not total_steps % args.checkpoint_freq:
+                        user_content = {
+                            "cli_args": args.__dict__,
+                            "num_params": num_params,
+                            "total_steps": total_steps,
+                            "model_config": model_config,
+                            "start_batch_index": batch_idx + 1,
+                            "data_state": train_dataset.state_dict(),
+                            "rng_state": gather_rng_states(),
+                        }
+                        sub_dir = f"{args.model_type}-{total_steps}steps"
+                        checkpoint_start = time.time()
+
+                        save_checkpoint(
+                            model,
+                            optimizer,
+                            lr_scheduler,
+                            user_content,
+                            args.checkpoint_dir,
+                            sub_dir,
                         )
+                        log_checkpoint(time.time() - checkpoint_start)
 
-            # for MTC
-            if use_mtc:
-                
-                save_in_memory = total_steps % args.in_memory_checkpointing_freq == 0
-                save_s3 = total_steps % args.s3_checkpointing_freq == 0
-
-                if save_in_memory or save_s3:
-
-                    user_content = {
-                        "cli_args": args.__dict__,
-                        "num_params": num_params,
-                        "total_steps": total_steps,
-                        "model_config": model_config,
-                        "start_batch_index": batch_idx + 1,
-                    }
-
-                    sub_dir = f"{args.model_type}-{total_steps}steps"
-
-                    save_checkpoint_mtc(
-                        model,
-                        optimizer,
-                        lr_scheduler,
-                        user_content,
-                        args.checkpoint_dir,
-                        sub_dir,
-                        save_in_memory,
-                        save_s3,
-                        total_steps,
-                        s3_tier_base_path=args.s3_tier_base_path,
-                        mtc_namespace=args.mtc_namespace,
-                    )
+                if total_steps >= args.max_steps:
+                    break
+        finally:
+            # stops the fetch thread when the loop ends early, e.g. at --max_steps
+            batches.close()
 
-            else:
-                if args.checkpoint_dir and not total_steps % args.checkpoint_freq:
-                    user_content = {
-                        "cli_args": args.__dict__,
-                        "num_params": num_params,
-                        "total_steps": total_steps,
-                        "model_config": model_config,
-                        "start_batch_index": batch_idx + 1,
-                    }
-                    sub_dir = f"{args.model_type}-{total_steps}steps"
-
-                    save_checkpoint(
-                        model,
-                        optimizer,
-                        lr_scheduler,
-                        user_content,
-                        args.checkpoint_dir,
-                        sub_dir,
-                    )
+        if total_steps >= args.max_steps:
+            break
+        start_batch_index = 0
 
-            if total_steps >= args.max_steps:
-                break
+    if pending_eval is not None:
+        eval_batch_idx, wait_eval = pending_eval
+        log_validation(eval_batch_idx, *wait_eval())
             
 
 def main(args):
-    dist.init_process_group("cpu:gloo,cuda:nccl")
+    dist.init_process_group("cpu:gloo,cuda:nccl" if torch.cuda.is_available() else "gloo")
     global_rank = dist.get_rank()
-    device = global_rank % torch.cuda.device_count()
+    device = global_rank % torch.cuda.device_count() if torch.cuda.is_available() else "cpu"
     world_size = dist.get_world_size()
-    
-    if args.bf16:
-        dtype = torch.bfloat16
-    else:
-        dtype = torch.get_default_dtype()
-    
+
+    # same initialization on every rank
+    set_seed(args.seed)
+
     model_config = get_model_config(args)
+    init_start = time.time()
     if global_rank == 0:
         logger.info(
             "Creating Model"
         )
-    # Instantiate model on CPU on rank=0 only to prevent CPU OOM
-    # (e.g. 70B * 4 bytes * 8 processes > 2T RAM available on P5)
-    if global_rank == 0:
-        model = AutoModelForCausalLM.from_config(model_config)
-    else:
-        with torch.device("meta"):
-            # Instantiating model on `meta` device doesn't consume CPU memory,
-            # but requires specifing `param_init_fn=...`
-            # and `sync_module_states=True` in FSDP c-tor.
-            model = AutoModelForCausalLM.from_config(model_config)
-    
+    model = create_model(args, model_config, global_rank)
+
     num_params = compute_num_params(model)
     if global_rank == 0:
         logger.info(
             "Created model with total parameters: %d (%.2f B)", num_params, num_params * 1e-9
         )
-    transformer_layer = get_transformer_layer(args.model_type)
-
-    gpt_auto_wrap_policy = functools.partial(
-        transformer_auto_wrap_policy,
-        transformer_layer_cls={
-            transformer_layer,
-        },
-    )
-
-    torch.cuda.set_device(device)
-    mixed_precision_policy = MixedPrecision(
-        param_dtype=dtype, reduce_dtype=dtype, buffer_dtype=dtype
-    )
 
-    if args.sharding_strategy=="full":
-        sharding_strategy = ShardingStrategy.FULL_SHARD
-    elif args.sharding_strategy=="hybrid":
-        sharding_strategy = ShardingStrategy.HYBRID_SHARD
-    else:
-        raise NotImplementedError("Available sharding strategies are full and hybrid")
-    
-    if args.cpu_offload == 1:
-        cpu_offload = CPUOffload(offload_params=True)
-    else: 
-        cpu_offload = None
+    if torch.cuda.is_available():
+        torch.cuda.set_device(device)
+    model = wrap_model_with_fsdp(args, model, global_rank)
 
-    model = FSDP(
-        model,
-        auto_wrap_policy=gpt_auto_wrap_policy,
-        mixed_precision=mixed_precision_policy,
-        limit_all_gathers=args.limit_all_gathers,
-        device_id=torch.cuda.current_device(),
-        use_orig_params=False,
-        sharding_strategy=sharding_strategy,
-        cpu_offload=cpu_offload,
-        sync_module_states=True,
-        param_init_fn=(lambda module: module.to_empty(device=torch.device("cuda"), recurse=False))
-        if global_rank != 0 else None,
-    )
+    if args.pretrained_path:
+        load_pretrained_weights(model, args.pretrained_path, args.pretrained_load_threads)
+        if global_rank == 0:
+            logger.info("Loaded pretrained weights from %s", args.pretrained_path)
 
+    init_time = time.time() - init_start
+    peak_host_memory = get_peak_host_memory()
     if global_rank == 0:
         logger.info("Wrapped model with FSDP")
+        logger.info(
+            "Model initialization took %.2fs, peak host memory %.2f GB",
+            init_time, peak_host_memory / 1024**3
+        )
+
+    # dropout etc. differ across ranks unless --same_seed
+    set_seed(args.seed if args.same_seed else derive_seed(args.seed, global_rank))
 
     if args.activation_checkpointing > 0:
         apply_activation_checkpoint(args, model=model)
@@ -292,6 +357,8 @@ def main(args):
                 lr_scheduler,
                 total_steps,
                 start_batch_index,
+                data_state,
+                rng_state,
             ) = load_checkpoint_mtc(
                     model, 
                     optimizer, 
@@ -309,6 +376,8 @@ def main(args):
                 lr_scheduler,
                 total_steps,
                 start_batch_index,
+                data_state,
+                rng_state,
             ) = load_checkpoint(
                     model, 
                     optimizer, 
@@ -319,27 +388,87 @@ def main(args):
     else:
         total_steps = 0
         start_batch_index = 0
+        data_state = None
+        rng_state = None
+
+    if rng_state is not None:
+        if global_rank < len(rng_state):
+            set_rng_state(rng_state[global_rank])
+        else:
+            # resumed on more ranks than were saved
+            set_seed(derive_seed(args.seed, global_rank, total_steps))
     
     # Use local dataset path if provided, otherwise use remote dataset
     dataset_path = args.local_dataset_path if args.local_dataset_path else args.dataset
+    mixture = load_mixture(args.data_mixture) if args.data_mixture else None
     
     if global_rank == 0:
-        if args.local_dataset_path:
+        if mixture:
+            logger.info(
+                "Using data mixture %s: %s", args.data_mixture,
+                ", ".join(f"{source['name']} ({source.get('weight', 1.0)})" for source in mixture)
+            )
+        elif args.local_dataset_path and args.local_dataset_path.startswith("s3://"):
+            logger.info(f"Streaming dataset from S3: {args.local_dataset_path}")
+        elif args.local_dataset_path:
             logger.info(f"Using local dataset from: {args.local_dataset_path}")
         else:
             logger.info(f"Using remote dataset: {args.dataset} (config: {args.dataset_config_name})")
     
+    # downloaded once per node and shared by both loaders
+    tokenizer = load_tokenizer(args.tokenizer, args.data_cache_dir)
     train_dataloader = create_streaming_dataloader(dataset_path, 
-                                                   args.tokenizer, 
+                                                   tokenizer, 
                                                    name=args.dataset_config_name, 
+                                                   global_rank=global_rank,
+                                                   world_size=world_size,
                                                    batch_size=args.train_batch_size, 
-                                                   split='train')
+                                                   max_context_width=args.max_context_width,
+                                                   split='train',
+                                                   num_stripes=args.data_stripes,
+                                                   seed=args.seed,
+                                                   shuffle_block_size=args.shuffle_block_size,
+                                                   mixture=mixture,
+                                                   pack=args.pack_documents > 0,
+                                                   batch_tokens=args.batch_tokens,
+                                                   cache_dir=args.data_cache_dir,
+                                                   s3_read_ahead=args.s3_read_ahead,
+                                                   # streams split as in the checkpointed run, so positions match
+                                                   min_streams=data_state.get("min_streams", 0)
+                                                   if data_state is not None else None)
+    if data_state is not None:
+        # positions are per stream, so this holds for any world size
+        train_dataloader.dataset.load_state_dict(data_state)
+        if global_rank == 0:
+            logger.info(
+                "Resuming data in epoch %d from %d recorded stream positions, %d samples consumed",
+                data_state.get("epoch", 0), len(data_state["positions"]), data_state["consumed_samples"]
+            )
+    
+    # known up front if every data file has an index sidecar with this tokenizer's token count
+    steps_per_epoch = train_dataloader.dataset.estimated_batches(train_dataloader.num_workers)
+    if global_rank == 0 and steps_per_epoch is not None:
+        logger.info(
+            "Data index: about %d steps per epoch, %d for --epochs %d; --max_steps %d ends in epoch %.2f",
+            steps_per_epoch, steps_per_epoch * args.epochs, args.epochs, args.max_steps,
+            args.max_steps / max(steps_per_epoch, 1),
+        )
     
     val_dataloader = create_streaming_dataloader(dataset_path, 
-                                                  args.tokenizer, 
+                                                  tokenizer, 
                                                   name=args.dataset_config_name, 
-                                                  batch_size=args.train_batch_size, 
-                                                  split='validation')
+                                                  global_rank=global_rank,
+                                                  world_size=world_size,
+                                                  batch_size=args.val_batch_size, 
+                                                  max_context_width=args.max_context_width,
+                                                  split='validation',
+                                                  num_stripes=args.data_stripes,
+                                                  seed=args.seed,
+                                                  mixture=mixture,
+                                                  pack=args.pack_documents > 0,
+                                                  batch_tokens=args.batch_tokens,
+                                                  cache_dir=args.data_cache_dir,
+                                                  s3_read_ahead=args.s3_read_ahead)
     
     train(model, 
           optimizer, 
@@ -352,7 +481,9 @@ def main(args):
           global_rank, 
           world_size,
           total_steps,
-          start_batch_index)
+          start_batch_index,
+          resume_from_positions=data_state is not None,
+          steps_per_epoch=steps_per_epoch)
   
     dist.destroy_process_group()
 
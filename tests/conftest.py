@@ -0,0 +1,7 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the training code imports `model_utils` from FSDP/src, the tools are plain scripts
+sys.path[:0] = [os.path.join(ROOT, "FSDP", "src"), os.path.join(ROOT, "tools"), os.path.join(ROOT, "tools", "dataset")]
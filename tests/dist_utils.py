@@ -0,0 +1,33 @@
+"""Run test functions on several CPU processes with the gloo backend."""
+
+import datetime
+import os
+import socket
+
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _run(rank, fn, world_size, port, args):
+    os.environ.update(RANK=str(rank), WORLD_SIZE=str(world_size), LOCAL_RANK=str(rank),
+                      LOCAL_WORLD_SIZE=str(world_size), MASTER_ADDR="127.0.0.1", MASTER_PORT=str(port))
+    # a deadlocked collective fails the test instead of hanging it
+    dist.init_process_group("gloo", rank=rank, world_size=world_size, timeout=datetime.timedelta(seconds=120))
+    try:
+        fn(rank, world_size, *args)
+    finally:
+        dist.destroy_process_group()
+
+
+def run_distributed(fn, world_size, *args):
+    """Call `fn(rank, world_size, *args)` on `world_size` gloo ranks; fails if any rank raises.
+
+    `fn` must be a module level function. Ranks report results through files.
+    """
+    mp.start_processes(_run, args=(fn, world_size, free_port(), args), nprocs=world_size, start_method="spawn")
@@ -0,0 +1,29 @@
+"""kubectl stand-in replaying recorded pod logs: fake_kubectl.py <log dir> <kubectl arguments>.
+
+`get pods` lists one running pod per <pod>.log file of the log directory;
+`logs -f <pod>` prints the pod's lines and then keeps following, like a
+pod that is still training, until it is terminated.
+"""
+
+import glob
+import os
+import sys
+import time
+
+
+def main(log_dir, args):
+    if args[:2] == ["get", "pods"]:
+        for path in sorted(glob.glob(os.path.join(log_dir, "*.log"))):
+            print(f"{os.path.basename(path)[:-len('.log')]} Running")
+    elif args[:2] == ["logs", "-f"]:
+        with open(os.path.join(log_dir, f"{args[2]}.log"), encoding="utf-8") as f:
+            for line in f:
+                sys.stdout.write(line)
+                sys.stdout.flush()
+        time.sleep(600)
+    else:
+        sys.exit(f"unsupported kubectl arguments: {args}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1], sys.argv[2:])
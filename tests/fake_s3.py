@@ -0,0 +1,126 @@
+"""S3 client stand-in that keeps objects in a local directory, with the calls the repo makes."""
+
+import collections
+import hashlib
+import io
+import os
+import shutil
+import threading
+
+from botocore.exceptions import ClientError
+
+
+class DirectoryS3Client:
+    """Objects of bucket `b` and key `k` are the files `root`/b/k.
+
+    `fail_uploads` maps keys to the number of their uploads that fail
+    with a throttling error before one succeeds. Calls are counted by name
+    and the requested ranges of `get_object` are kept in `ranges`.
+    """
+
+    def __init__(self, root, fail_uploads=None):
+        self.root = str(root)
+        self.fail_uploads = dict(fail_uploads or {})
+        self.calls = collections.Counter()
+        self.ranges = []
+        self.lock = threading.Lock()
+
+    def _count(self, name):
+        with self.lock:
+            self.calls[name] += 1
+
+    def _path(self, bucket, key):
+        return os.path.join(self.root, bucket, key)
+
+    def _no_such_key(self, key, operation):
+        return ClientError({"Error": {"Code": "NoSuchKey", "Message": f"{key} does not exist"}}, operation)
+
+    def create_bucket(self, Bucket, **kwargs):
+        os.makedirs(os.path.join(self.root, Bucket), exist_ok=True)
+
+    def list_buckets(self):
+        return {"Buckets": [{"Name": name} for name in sorted(os.listdir(self.root))]}
+
+    def upload_file(self, Filename, Bucket, Key, Config=None, **kwargs):
+        self._count("upload_file")
+        with self.lock:
+            failures = self.fail_uploads.get(Key, 0)
+            self.fail_uploads[Key] = failures - 1
+        if failures > 0:
+            raise ClientError({"Error": {"Code": "SlowDown", "Message": "Please reduce your request rate"}},
+                              "PutObject")
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copyfile(Filename, path)
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self._count("put_object")
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(Body.encode() if isinstance(Body, str) else Body)
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self._count("head_object")
+        path = self._path(Bucket, Key)
+        if not os.path.isfile(path):
+            raise self._no_such_key(Key, "HeadObject")
+        return {"ContentLength": os.path.getsize(path), "ETag": f'"{self._etag(path)}"'}
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        self._count("get_object")
+        path = self._path(Bucket, Key)
+        if not os.path.isfile(path):
+            raise self._no_such_key(Key, "GetObject")
+        with open(path, "rb") as f:
+            data = f.read()
+        if Range:
+            start, end = map(int, Range[len("bytes="):].split("-"))
+            with self.lock:
+                self.ranges.append((Key, start, end))
+            data = data[start:end + 1]
+        return {"Body": io.BytesIO(data), "ContentLength": len(data)}
+
+    def _etag(self, path):
+        with open(path, "rb") as f:
+            return hashlib.md5(f.read()).hexdigest()
+
+    def list_objects_v2(self, Bucket, Prefix="", MaxKeys=1000, ContinuationToken=None, **kwargs):
+        self._count("list_objects_v2")
+        bucket_dir = os.path.join(self.root, Bucket)
+        keys = sorted(
+            os.path.relpath(os.path.join(directory, name), bucket_dir).replace(os.sep, "/")
+            for directory, _, names in os.walk(bucket_dir) for name in names
+        )
+        keys = [key for key in keys if key.startswith(Prefix)]
+        start = int(ContinuationToken or 0)
+        page = keys[start:start + MaxKeys]
+        response = {"KeyCount": len(page)}
+        if page:
+            response["Contents"] = [
+                {"Key": key, "Size": os.path.getsize(self._path(Bucket, key)),
+                 "ETag": f'"{self._etag(self._path(Bucket, key))}"'}
+                for key in page
+            ]
+        if start + MaxKeys < len(keys):
+            response["IsTruncated"] = True
+            response["NextContinuationToken"] = str(start + MaxKeys)
+        return response
+
+    def get_paginator(self, operation):
+        assert operation == "list_objects_v2", operation
+        return _ListObjectsPaginator(self)
+
+
+class _ListObjectsPaginator:
+    def __init__(self, client):
+        self.client = client
+
+    def paginate(self, **kwargs):
+        token = None
+        while True:
+            page = self.client.list_objects_v2(ContinuationToken=token, **kwargs)
+            yield page
+            token = page.get("NextContinuationToken")
+            if token is None:
+                return
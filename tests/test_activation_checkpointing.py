@@ -0,0 +1,41 @@
+import argparse
+
+import torch
+from transformers.models.llama.modeling_llama import LlamaDecoderLayer
+
+from dist_utils import run_distributed
+from tiny_model import tiny_llama, wrap_cpu_fsdp
+from model_utils.train_utils import g_gigabyte, get_activation_checkpoint_modules, measure_layer_activation_bytes
+
+NUM_LAYERS = 4
+
+
+def budget_args(budget_gb):
+    return argparse.Namespace(
+        activation_checkpointing_policy="memory_budget", activation_memory_budget=budget_gb,
+        train_batch_size=2, max_context_width=32,
+    )
+
+
+def pick_layers(rank, world_size, output):
+    model = wrap_cpu_fsdp(tiny_llama(num_hidden_layers=NUM_LAYERS))
+    layers = [m for m in model.modules() if isinstance(m, LlamaDecoderLayer)]
+    layer_bytes, boundary_bytes = measure_layer_activation_bytes(model, LlamaDecoderLayer, 2, 32)
+    picked = {}
+    for num_kept in range(NUM_LAYERS + 1):
+        # just enough for `num_kept` whole layers and the inputs of the checkpointed ones
+        budget = NUM_LAYERS * boundary_bytes + num_kept * (layer_bytes - boundary_bytes) + 1
+        modules = get_activation_checkpoint_modules(budget_args(budget / g_gigabyte), model, LlamaDecoderLayer)
+        picked[num_kept] = [layers.index(module) for module in modules]
+    if rank == 0:
+        torch.save((layer_bytes, boundary_bytes, picked), output)
+
+
+def test_memory_budget_checkpoints_leading_layers(tmp_path):
+    run_distributed(pick_layers, 2, str(tmp_path / "picked"))
+    layer_bytes, boundary_bytes, picked = torch.load(tmp_path / "picked")
+    # hidden states of 2 x 32 tokens of width 32 in fp32
+    assert boundary_bytes == 2 * 32 * 32 * 4
+    assert layer_bytes > boundary_bytes
+    assert picked == {num_kept: list(range(NUM_LAYERS - num_kept)) for num_kept in range(NUM_LAYERS + 1)}
+
@@ -0,0 +1,75 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+import torch
+
+import autotune
+from dist_utils import free_port, run_distributed
+from tiny_model import TINY_MODEL_FLAGS
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "FSDP", "src")
+
+# trial process of each rank: exit code, or None to hang
+SCENARIOS = {
+    "ok": ([0, 0], autotune.STATUS_OK),
+    "oom_on_one_rank": ([autotune.STATUS_OOM, None], autotune.STATUS_OOM),
+    "error_on_one_rank": ([1, None], autotune.STATUS_ERROR),
+    "hung": ([None, None], autotune.STATUS_TIMEOUT),
+}
+
+
+def fake_trial(exit_code):
+    code = "import time; time.sleep(600)" if exit_code is None else f"import sys; sys.exit({exit_code})"
+    return subprocess.Popen([sys.executable, "-c", code])
+
+
+def wait_for_scenarios(rank, world_size, output):
+    outcomes = {}
+    for name, (exit_codes, _) in SCENARIOS.items():
+        process = fake_trial(exit_codes[rank])
+        start = time.time()
+        status = autotune.wait_for_trial(process, timeout=3, device=torch.device("cpu"), poll_interval=0.1)
+        outcomes[name] = (status, time.time() - start, process.poll() is not None)
+    torch.save(outcomes, f"{output}.{rank}")
+
+
+def test_wait_for_trial_stops_hung_and_failed_trials(tmp_path):
+    run_distributed(wait_for_scenarios, 2, str(tmp_path / "outcomes"))
+    for rank in range(2):
+        outcomes = torch.load(tmp_path / f"outcomes.{rank}")
+        for name, (_, expected) in SCENARIOS.items():
+            status, elapsed, exited = outcomes[name]
+            assert status == expected, name
+            assert exited, name
+            # a failed rank ends the trial right away, a hung one at the timeout
+            assert elapsed < (10 if expected == autotune.STATUS_TIMEOUT else 2.5), name
+
+
+def test_autotune_reports_consistent_step_times(tmp_path):
+    space = tmp_path / "space.json"
+    space.write_text(json.dumps({"train_batch_size": [1, 2]}))
+    output = tmp_path / "tuned.yaml"
+    env = dict(os.environ, PYTHONPATH=SRC)
+    subprocess.run(
+        [sys.executable, "-m", "torch.distributed.run", "--nproc_per_node=2", f"--master_port={free_port()}",
+         os.path.join(SRC, "autotune.py"), *TINY_MODEL_FLAGS,
+         f"--autotune_space={space}", "--autotune_steps=5", "--autotune_warmup_steps=1",
+         f"--autotune_output={output}"],
+        check=True, env=env, timeout=600,
+    )
+    results = json.loads((tmp_path / "tuned.yaml.json").read_text())
+    assert [result["status"] for result in results] == ["ok", "ok"]
+    for result in results:
+        assert result["step_time"] * 1000 == result["step_ms_p50"]
+        assert result["step_ms_p50"] <= result["step_ms_p90"] <= result["step_ms_p99"]
+    assert "--train_batch_size=" in output.read_text()
+
+
+def test_autotune_steps_must_be_positive():
+    assert autotune.parse_autotune_args(["--autotune_steps=1"]).autotune_steps == 1
+    with pytest.raises(SystemExit):
+        autotune.parse_autotune_args(["--autotune_steps=0"])
@@ -0,0 +1,129 @@
+import collections
+import itertools
+import random
+
+import numpy as np
+
+import torch
+
+from dist_utils import run_distributed
+from fake_tokenizer import CharTokenizer
+from test_streaming_dataset import samples, write_jsonl
+from tiny_model import VOCAB_SIZE, assert_same_state, full_state, tiny_training_state, train_args, train_step
+from model_utils.checkpoint import load_checkpoint, save_checkpoint
+from model_utils.seeding import derive_seed, gather_rng_states, set_rng_state, set_seed
+from model_utils.train_utils import create_streaming_dataloader
+
+SAVED_STEPS = 3
+
+
+def data_loader(directory, rank, world_size, min_streams=None):
+    return create_streaming_dataloader(
+        directory, CharTokenizer(), global_rank=rank, world_size=world_size, batch_size=2, max_context_width=16,
+        workers=0, split="train", seed=7, shuffle_block_size=4, min_streams=min_streams,
+    )
+
+
+def train_and_save(rank, world_size, data, checkpoint_dir, output):
+    args = train_args("--seed=3", "--bf16=0")
+    model, optimizer, lr_scheduler, model_config = tiny_training_state(args, rank)
+    loader = data_loader(data, rank, world_size)
+    consumed = []
+    for batch in itertools.islice(loader, SAVED_STEPS):
+        loader.dataset.update_positions(batch["data_position"])
+        consumed.extend(samples(batch))
+        train_step(model, optimizer, lr_scheduler, batch)
+    user_content = {
+        "total_steps": SAVED_STEPS,
+        "start_batch_index": SAVED_STEPS,
+        "data_state": loader.dataset.state_dict(),
+        "rng_state": gather_rng_states(),
+        "model_config": model_config,
+    }
+    save_checkpoint(model, optimizer, lr_scheduler, user_content, checkpoint_dir,
+                    f"{args.model_type}-{SAVED_STEPS}steps")
+    torch.save({"state": full_state(model, optimizer), "lr": lr_scheduler.get_lr(), "consumed": consumed},
+               f"{output}.{rank}")
+
+
+def load_and_continue(rank, world_size, data, checkpoint_dir, output):
+    args = train_args("--seed=3", "--bf16=0", f"--resume_from_checkpoint={checkpoint_dir}")
+    model, optimizer, lr_scheduler, _ = tiny_training_state(args, rank)
+    model, optimizer, lr_scheduler, total_steps, start_batch_index, data_state, rng_state = load_checkpoint(
+        model, optimizer, lr_scheduler, checkpoint_dir, args.model_type, "cpu"
+    )
+    state = full_state(model, optimizer)
+    lr = lr_scheduler.get_lr()
+    loader = data_loader(data, rank, world_size, min_streams=data_state["min_streams"])
+    loader.dataset.load_state_dict(data_state)
+    rest = [sample for batch in loader for sample in samples(batch)]
+    # the loaded optimizer state takes further steps at the new world size
+    batch = {"input_ids": torch.randint(1, VOCAB_SIZE, (2, 16), generator=torch.Generator().manual_seed(0))}
+    loss = train_step(model, optimizer, lr_scheduler, batch)
+    torch.save({"state": state, "lr": lr, "total_steps": total_steps, "rest": rest,
+                "num_rng_states": len(rng_state), "loss": loss}, f"{output}.{rank}")
+
+
+def test_resume_at_a_smaller_world_size(tmp_path):
+    data = tmp_path / "data"
+    data.mkdir()
+    write_jsonl(data, "a-train.jsonl", 60)
+    write_jsonl(data, "b-train.jsonl", 45)
+    checkpoints = str(tmp_path / "checkpoints")
+
+    run_distributed(train_and_save, 4, str(data), checkpoints, str(tmp_path / "saved"))
+    saved = [torch.load(tmp_path / f"saved.{rank}") for rank in range(4)]
+    run_distributed(load_and_continue, 2, str(data), checkpoints, str(tmp_path / "resumed"))
+    resumed = [torch.load(tmp_path / f"resumed.{rank}") for rank in range(2)]
+
+    for rank in resumed:
+        # model and optimizer resharded from 4 ranks to 2, unchanged
+        assert_same_state(rank["state"], saved[0]["state"])
+        assert rank["total_steps"] == SAVED_STEPS and rank["num_rng_states"] == 4
+        assert rank["lr"] == saved[0]["lr"]
+        assert torch.isfinite(torch.tensor(rank["loss"]))
+
+    # the data streams are split for 4 readers in both runs: nothing skipped, nothing read twice
+    expected = collections.Counter(sample for batch in data_loader(str(data), 0, 1, min_streams=4)
+                                   for sample in samples(batch))
+    consumed = collections.Counter(sample for rank in saved for sample in rank["consumed"])
+    assert sum(consumed.values()) == 4 * SAVED_STEPS * 2
+    consumed.update(sample for rank in resumed for sample in rank["rest"])
+    assert consumed == expected
+
+
+def draws():
+    return random.random(), np.random.rand(), torch.rand(3).tolist()
+
+
+def rng_round_trip(rank, world_size, checkpoint_dir, output):
+    args = train_args("--seed=3", "--bf16=0", f"--resume_from_checkpoint={checkpoint_dir}")
+    model, optimizer, lr_scheduler, model_config = tiny_training_state(args, rank)
+    # a step, so there is optimizer state to save and load
+    batch = {"input_ids": torch.randint(1, VOCAB_SIZE, (2, 16), generator=torch.Generator().manual_seed(0))}
+    train_step(model, optimizer, lr_scheduler, batch)
+    set_seed(derive_seed(args.seed, rank))
+    draws()
+    user_content = {
+        "total_steps": 1, "start_batch_index": 1, "data_state": {}, "rng_state": gather_rng_states(),
+        "model_config": model_config,
+    }
+    save_checkpoint(model, optimizer, lr_scheduler, user_content, checkpoint_dir, f"{args.model_type}-1steps")
+    expected = draws()
+
+    set_seed(0)
+    model, optimizer, lr_scheduler, _, _, _, rng_state = load_checkpoint(
+        model, optimizer, lr_scheduler, checkpoint_dir, args.model_type, "cpu"
+    )
+    set_rng_state(rng_state[rank])
+    torch.save((expected, draws()), f"{output}.{rank}")
+
+
+def test_rng_states_round_trip(tmp_path):
+    run_distributed(rng_round_trip, 2, str(tmp_path / "checkpoints"), str(tmp_path / "draws"))
+    draws_by_rank = [torch.load(tmp_path / f"draws.{rank}") for rank in range(2)]
+    for expected, resumed in draws_by_rank:
+        # python, numpy and torch continue where they were saved
+        assert resumed == expected
+    # and every rank gets its own state back
+    assert draws_by_rank[0][0] != draws_by_rank[1][0]
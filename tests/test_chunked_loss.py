@@ -0,0 +1,85 @@
+import torch
+
+from dist_utils import run_distributed
+from tiny_model import VOCAB_SIZE, tiny_llama, wrap_cpu_fsdp
+from model_utils.chunked_loss import apply_chunked_cross_entropy
+
+
+def make_batch():
+    generator = torch.Generator().manual_seed(0)
+    input_ids = torch.randint(1, VOCAB_SIZE, (2, 24), generator=generator)
+    labels = input_ids.clone()
+    # padding at the end of the second sample
+    labels[1, 17:] = -100
+    return input_ids, labels
+
+
+def loss_and_grads(model, input_ids, labels):
+    loss = model(input_ids=input_ids, labels=labels)["loss"]
+    loss.backward()
+    return loss.detach(), {name: param.grad for name, param in model.named_parameters()}
+
+
+def test_chunked_loss_matches_the_model_loss():
+    input_ids, labels = make_batch()
+    expected_loss, expected_grads = loss_and_grads(tiny_llama(), input_ids, labels)
+    # 46 predicted tokens: chunks that do and do not divide them
+    for chunk_size in (5, 23, 1000):
+        model = apply_chunked_cross_entropy(tiny_llama(), chunk_size)
+        loss, grads = loss_and_grads(model, input_ids, labels)
+        torch.testing.assert_close(loss, expected_loss)
+        for name, grad in grads.items():
+            torch.testing.assert_close(grad, expected_grads[name], msg=name)
+
+
+def test_forward_without_labels_returns_logits():
+    input_ids, _ = make_batch()
+    expected = tiny_llama()(input_ids=input_ids)["logits"]
+    logits = apply_chunked_cross_entropy(tiny_llama(), 5)(input_ids=input_ids)["logits"]
+    torch.testing.assert_close(logits, expected)
+
+
+def saved_activation_bytes(model, input_ids, labels):
+    """Forward and backward; returns the loss, the bytes of storage saved for backward and the grad shards."""
+    saved = {}
+
+    def pack(tensor):
+        # non-reentrant checkpoints save their own tensors, out of sight of this hook
+        storage = tensor.untyped_storage()
+        # not by data_ptr: FSDP frees unsharded parameters during forward and their addresses get reused
+        saved.setdefault(storage._cdata, storage)
+        return tensor
+
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+        loss = model(input_ids=input_ids, labels=labels)["loss"]
+    saved_bytes = sum(storage.nbytes() for storage in saved.values())
+    saved.clear()
+    loss.backward()
+    return loss.item(), saved_bytes, [param.grad.clone() for param in model.parameters()]
+
+
+def fsdp_losses(rank, world_size, output):
+    input_ids, labels = make_batch()
+    results = []
+    for chunk_size in (0, 5):
+        model = tiny_llama()
+        if chunk_size:
+            apply_chunked_cross_entropy(model, chunk_size)
+        results.append(saved_activation_bytes(wrap_cpu_fsdp(model), input_ids, labels))
+    torch.save(results, f"{output}.{rank}")
+
+
+def test_chunked_loss_under_fsdp(tmp_path):
+    # the LM head weight is gathered by the root FSDP unit
+    run_distributed(fsdp_losses, 2, str(tmp_path / "losses"))
+    for rank in range(2):
+        (plain, plain_bytes, plain_grads), (chunked, chunked_bytes, chunked_grads) = torch.load(
+            tmp_path / f"losses.{rank}"
+        )
+        assert abs(plain - chunked) < 1e-5
+        # both models are sharded alike, so the flat parameter grad shards line up
+        assert len(plain_grads) == len(chunked_grads)
+        for plain_grad, chunked_grad in zip(plain_grads, chunked_grads):
+            torch.testing.assert_close(chunked_grad, plain_grad)
+        # the full path keeps at least the fp32 log-probs of the 46 predicted tokens for backward
+        assert chunked_bytes <= plain_bytes - 46 * VOCAB_SIZE * 4
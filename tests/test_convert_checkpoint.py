@@ -0,0 +1,69 @@
+import os
+
+import torch
+from transformers import AutoModelForCausalLM
+
+from dist_utils import run_distributed
+from tiny_model import VOCAB_SIZE, assert_same_state, full_state, tiny_training_state, train_args, train_step
+from convert_checkpoint import main, parse_convert_args
+from model_utils.checkpoint import load_checkpoint, save_checkpoint
+from model_utils.seeding import gather_rng_states
+
+FLAGS = ("--seed=3", "--bf16=0")
+
+
+def save_tiny_checkpoint(rank, world_size, checkpoint_dir, output):
+    args = train_args(*FLAGS)
+    model, optimizer, lr_scheduler, model_config = tiny_training_state(args, rank)
+    batch = {"input_ids": torch.randint(1, VOCAB_SIZE, (2, 16), generator=torch.Generator().manual_seed(rank))}
+    # one step, so the optimizer has state to convert
+    train_step(model, optimizer, lr_scheduler, batch)
+    user_content = {
+        "total_steps": 1, "start_batch_index": 1, "data_state": {"consumed_samples": 4},
+        "rng_state": gather_rng_states(), "model_config": model_config,
+    }
+    save_checkpoint(model, optimizer, lr_scheduler, user_content, checkpoint_dir, f"{args.model_type}-1steps")
+    torch.save(full_state(model, optimizer), f"{output}.{rank}")
+
+
+def load_resharded(rank, world_size, checkpoint_dir, output):
+    args = train_args(*FLAGS)
+    model, optimizer, lr_scheduler, _ = tiny_training_state(args, rank)
+    model, optimizer, lr_scheduler, total_steps, _, data_state, _ = load_checkpoint(
+        model, optimizer, lr_scheduler, checkpoint_dir, args.model_type, "cpu"
+    )
+    torch.save((full_state(model, optimizer), total_steps, data_state), f"{output}.{rank}")
+
+
+def save_checkpoint_on_two_ranks(tmp_path):
+    checkpoints = tmp_path / "checkpoints"
+    run_distributed(save_tiny_checkpoint, 2, str(checkpoints), str(tmp_path / "saved"))
+    return checkpoints / "llama_v2-1steps", torch.load(tmp_path / "saved.0")
+
+
+def test_consolidate_loads_in_hf(tmp_path):
+    checkpoint, (model_state, _) = save_checkpoint_on_two_ranks(tmp_path)
+    output = tmp_path / "hf"
+    main(parse_convert_args(["consolidate", str(checkpoint), str(output), "--dtype=float32",
+                             "--max_shard_size=20KB"]))
+    assert len([name for name in os.listdir(output) if name.endswith(".safetensors")]) > 1
+
+    model = AutoModelForCausalLM.from_pretrained(output)
+    state = model.state_dict()
+    assert state.keys() == model_state.keys()
+    for name, tensor in model_state.items():
+        assert torch.equal(state[name], tensor), name
+
+
+def test_reshard_loads_at_another_world_size(tmp_path):
+    checkpoint, saved = save_checkpoint_on_two_ranks(tmp_path)
+    # keep the {model_type}-{N}steps name, load_checkpoint looks for it
+    resharded = tmp_path / "resharded"
+    main(parse_convert_args(["reshard", str(checkpoint), str(resharded / checkpoint.name), "--world_size=3",
+                             "--max_shard_size=20KB"]))
+
+    run_distributed(load_resharded, 3, str(resharded), str(tmp_path / "loaded"))
+    for rank in range(3):
+        state, total_steps, data_state = torch.load(tmp_path / f"loaded.{rank}")
+        assert_same_state(state, saved)
+        assert total_steps == 1 and data_state == {"consumed_samples": 4}
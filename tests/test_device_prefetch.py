@@ -0,0 +1,64 @@
+import time
+
+import pytest
+import torch
+
+from model_utils.device_prefetch import DevicePrefetcher
+
+FETCH_SECONDS = 0.2
+STEP_SECONDS = 0.4
+
+
+def slow_batches(num_batches, fail_at=None):
+    """Batches that take FETCH_SECONDS each to produce, like a DataLoader waiting for its workers."""
+    for i in range(num_batches):
+        time.sleep(FETCH_SECONDS)
+        if i == fail_at:
+            raise RuntimeError("worker died")
+        yield {"input_ids": torch.full((2, 4), i), "data_position": [i]}
+
+
+def test_batches_are_returned_in_order():
+    batches = DevicePrefetcher(slow_batches(5), "cpu", depth=2)
+    assert [batch["data_position"] for batch in batches] == [[i] for i in range(5)]
+    with pytest.raises(StopIteration):
+        next(batches)
+
+
+def test_fetch_overlaps_with_the_step():
+    batches = DevicePrefetcher(slow_batches(6), "cpu", depth=2)
+    waits = []
+    while True:
+        wait_start = time.perf_counter()
+        batch = next(batches, None)
+        waits.append(time.perf_counter() - wait_start)
+        if batch is None:
+            break
+        assert batches.buffered <= 2
+        time.sleep(STEP_SECONDS)
+    # only the first batch is waited for, the others were fetched during the steps
+    assert waits[0] >= FETCH_SECONDS
+    assert max(waits[1:]) < FETCH_SECONDS / 2
+
+
+def test_dataloader_errors_are_raised_by_next():
+    batches = DevicePrefetcher(slow_batches(5, fail_at=2), "cpu", depth=2)
+    next(batches)
+    next(batches)
+    with pytest.raises(RuntimeError, match="worker died"):
+        next(batches)
+
+
+def test_close_stops_the_fetch_thread_of_an_abandoned_iteration():
+    # the thread fills the queue and then waits for room, as at --max_steps
+    batches = DevicePrefetcher(slow_batches(20), "cpu", depth=2)
+    next(batches)
+    time.sleep(5 * FETCH_SECONDS)
+    assert batches.thread.is_alive()
+    batches.close()
+    assert not batches.thread.is_alive()
+    # the batches fetched ahead and the source iterator are released
+    assert batches.fetched.empty() and batches.batches is None
+    with pytest.raises(StopIteration):
+        next(batches)
+    batches.close()
@@ -0,0 +1,78 @@
+import functools
+import itertools
+import json
+
+import pytest
+
+from download_c4 import COMPRESSION_SUFFIXES, download_c4_subset, write_part
+from model_utils.streaming_dataset import open_jsonl
+
+NUM_SOURCE_SHARDS = 10
+
+
+def fake_shard(index, num_shards, size=137, fail_at=None):
+    """Samples of source shard `index`, raising at sample `fail_at[1]` of shard `fail_at[0]`."""
+    for i in range(size):
+        if fail_at == (index, i):
+            raise RuntimeError("network went away")
+        yield {"text": f"shard {index} doc {i} " + "x" * ((index * 7 + i) % 50), "url": f"u{index}/{i}"}
+
+
+def read_samples(path):
+    # as the training loader reads them, compressed parts are several concatenated frames
+    with open_jsonl(str(path)) as f:
+        return [json.loads(line) for line in f]
+
+
+def download(output_dir, fail_at=None, num_parts=3):
+    paths = download_c4_subset(
+        output_dir=str(output_dir), num_samples=1000, num_parts=num_parts, num_workers=num_parts,
+        load_shard=functools.partial(fake_shard, fail_at=fail_at), num_source_shards=NUM_SOURCE_SHARDS,
+    )
+    # a single part is returned as a path
+    return [paths] if isinstance(paths, str) else paths
+
+
+def test_parts_are_read_from_their_own_shards(tmp_path, capsys):
+    paths = download(tmp_path)
+    assert [path.rsplit("/", 1)[1] for path in paths] == [f"c4_train_1000_part00{part}.jsonl" for part in (1, 2, 3)]
+    parts = [read_samples(path) for path in paths]
+    # the first part gets the remainder
+    assert [len(samples) for samples in parts] == [334, 333, 333]
+    for part, samples in enumerate(parts):
+        # part i reads source shards i, i + 3, ... in order, moving on when one runs out
+        shards = (fake_shard(shard, NUM_SOURCE_SHARDS) for shard in range(part, NUM_SOURCE_SHARDS, 3))
+        assert samples == list(itertools.islice(itertools.chain.from_iterable(shards), len(samples)))
+    lengths = [len(sample["text"]) for samples in parts for sample in samples]
+    assert f"Average text length: {sum(lengths) / len(lengths):.0f} characters" in capsys.readouterr().out
+
+
+@pytest.mark.parametrize("compression", ["none", "gzip", "zstd"])
+def test_interrupted_part_continues_from_its_checkpoint(tmp_path, compression):
+    # 50 samples from 2 source shards of 30, checkpointed every 10
+    shard = functools.partial(fake_shard, size=30)
+    suffix = ".jsonl" + COMPRESSION_SUFFIXES[compression]
+    expected = write_part(tmp_path / f"expected{suffix}", tmp_path / "expected.json", [0, 1], 2, 50, shard,
+                          checkpoint_every=10, compression=compression)
+
+    output, progress_path = tmp_path / f"part{suffix}", tmp_path / "part.json"
+    with pytest.raises(RuntimeError):
+        write_part(output, progress_path, [0, 1], 2, 50, functools.partial(shard, fail_at=(1, 15)),
+                   checkpoint_every=10, compression=compression)
+    progress = json.loads(progress_path.read_text())
+    # the 5 samples after the last checkpoint are written again
+    assert (progress["samples"], progress["shard"], progress["shard_samples"], progress["done"]) == (40, 1, 10, False)
+
+    resumed = write_part(output, progress_path, [0, 1], 2, 50, shard, checkpoint_every=10, compression=compression)
+    assert resumed == expected
+    assert read_samples(output) == read_samples(tmp_path / f"expected{suffix}")
+    assert len(read_samples(output)) == 50
+
+
+# a single part is named like the download, c4_train_1000.jsonl
+@pytest.mark.parametrize("num_parts", [3, 1])
+def test_rerun_continues_an_interrupted_download(tmp_path, num_parts):
+    expected = [read_samples(path) for path in download(tmp_path / "expected", num_parts=num_parts)]
+    with pytest.raises(SystemExit):
+        download(tmp_path / "out", fail_at=(0, 100), num_parts=num_parts)
+    assert [read_samples(path) for path in download(tmp_path / "out", num_parts=num_parts)] == expected
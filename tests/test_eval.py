@@ -0,0 +1,104 @@
+import math
+
+import torch
+
+from dist_utils import run_distributed
+from tiny_model import VOCAB_SIZE, tiny_llama, wrap_cpu_fsdp
+from model_utils.train_utils import eval_model, get_model_inputs, next_batch
+
+# validation batches per rank, uneven as at the end of a split
+BATCHES_PER_RANK = [1, 3, 0, 2]
+
+
+def rank_batches(rank):
+    generator = torch.Generator().manual_seed(rank)
+    batches = []
+    for i in range(BATCHES_PER_RANK[rank]):
+        batch = {"input_ids": torch.randint(1, VOCAB_SIZE, (2, 12), generator=generator, dtype=torch.int32)}
+        if i % 2:
+            # padded batch, padding is left out of the loss
+            batch["attention_mask"] = torch.ones(2, 12, dtype=torch.int32)
+            batch["attention_mask"][1, 7:] = 0
+        batches.append(batch)
+    return batches
+
+
+def reference_loss(num_batches=None):
+    """Per-token mean loss over the first `num_batches` batches of all ranks on a single unsharded model."""
+    model = tiny_llama().eval()
+    loss_sum = num_tokens = 0
+    with torch.no_grad():
+        for rank in range(len(BATCHES_PER_RANK)):
+            for batch in rank_batches(rank)[:num_batches]:
+                inputs = get_model_inputs(batch, "cpu")
+                tokens = int((inputs["labels"][..., 1:] != -100).sum())
+                loss_sum += float(model(**inputs)["loss"]) * tokens
+                num_tokens += tokens
+    return loss_sum / num_tokens
+
+
+def evaluate(rank, world_size, output):
+    model = wrap_cpu_fsdp(tiny_llama())
+    batches = rank_batches(rank)
+    loss, ppl = eval_model(model, batches, num_batches=10)
+    async_loss, _ = eval_model(model, batches, num_batches=10, async_op=True)()
+    # checked for the end of the data after every batch
+    synced_loss, _ = eval_model(model, batches, num_batches=10, sync_every=1)
+    # stops after the first batch on every rank
+    limited_loss, _ = eval_model(model, batches, num_batches=1)
+    if rank == 0:
+        torch.save((loss, ppl, async_loss, synced_loss, limited_loss), output)
+
+
+def test_eval_with_uneven_batches_per_rank(tmp_path):
+    run_distributed(evaluate, len(BATCHES_PER_RANK), str(tmp_path / "result"))
+    loss, ppl, async_loss, synced_loss, limited_loss = torch.load(tmp_path / "result")
+    expected = reference_loss()
+    assert math.isclose(loss, expected, rel_tol=1e-4)
+    assert math.isclose(ppl, math.exp(expected), rel_tol=1e-4)
+    assert async_loss == loss
+    assert math.isclose(synced_loss, expected, rel_tol=1e-4)
+    assert math.isclose(limited_loss, reference_loss(num_batches=1), rel_tol=1e-4)
+
+
+# training batches per rank, the epoch ends when the first rank runs out
+TRAIN_BATCHES_PER_RANK = [3, 5, 4, 6]
+
+
+def train_epoch(rank, world_size, sync_every, output):
+    model = wrap_cpu_fsdp(tiny_llama())
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.1)
+    batches = iter(
+        {"input_ids": torch.randint(1, VOCAB_SIZE, (2, 12), dtype=torch.int32)}
+        for _ in range(TRAIN_BATCHES_PER_RANK[rank])
+    )
+    steps = []
+    step = 0
+    while True:
+        batch, _, dry = next_batch(batches, step, sync_every=sync_every)
+        if batch is None:
+            break
+        # the training step of train.py, which keeps FSDP collectives matched
+        optimizer.zero_grad(set_to_none=True)
+        loss = model(**get_model_inputs(batch, "cpu"))["loss"]
+        if dry:
+            loss = loss * 0
+        loss.backward()
+        optimizer.step()
+        steps.append((dry, math.isfinite(loss.item())))
+        step += 1
+    torch.save(steps, f"{output}.{rank}")
+
+
+def test_ranks_stop_together_at_the_next_check(tmp_path):
+    for sync_every in (1, 4):
+        run_distributed(train_epoch, len(TRAIN_BATCHES_PER_RANK), sync_every, str(tmp_path / f"steps{sync_every}"))
+        steps = [torch.load(tmp_path / f"steps{sync_every}.{rank}") for rank in range(len(TRAIN_BATCHES_PER_RANK))]
+        assert all(finite for rank_steps in steps for _, finite in rank_steps)
+        dry_steps = [[dry for dry, _ in rank_steps] for rank_steps in steps]
+        if sync_every == 1:
+            # checked before every step: all ranks stop when rank 0 runs out after 3 batches
+            assert dry_steps == [[False] * 3] * 4
+        else:
+            # checked at steps 0 and 4: rank 0 runs a dummy step 3, then all stop
+            assert dry_steps == [[False] * 3 + [True]] + [[False] * 4] * 3
@@ -0,0 +1,87 @@
+import json
+import random
+import string
+
+import pytest
+
+from filter_dataset import QUALITY_DEFAULTS, filter_parts, open_output, open_text, quality_issue
+
+_rng = random.Random(0)
+VOCABULARY = ["".join(_rng.choice(string.ascii_lowercase) for _ in range(6)) for _ in range(1000)]
+
+
+def document(seed, num_words=200):
+    """Text that passes the quality rules and shares no shingles with other seeds."""
+    rng = random.Random(seed)
+    return " ".join(rng.choice(VOCABULARY) for _ in range(num_words))
+
+
+def near_duplicate(text):
+    # only the last shingle changes, an estimated similarity of about 0.99
+    return text.rsplit(" ", 1)[0] + " changed"
+
+
+def write_part(path, texts):
+    """JSONL file of `texts`, a None text is written as an unreadable line."""
+    with open_output(str(path)) as f:
+        for text in texts:
+            f.write(("not json" if text is None else json.dumps({"text": text})) + "\n")
+    return str(path)
+
+
+def read_texts(path):
+    with open_text(str(path)) as f:
+        return [json.loads(line)["text"] for line in f]
+
+
+@pytest.mark.parametrize("text, issue", [
+    ("word " * 10, "too_short"),
+    ("word " * 30000, "too_long"),
+    ("a" * 250, "too_few_words"),
+    ("abcdefghijklmno " * 60, "long_words"),
+    ("12345 " * 60, "few_alpha_words"),
+    ("the same line with several words in it\n" * 10, "repeated_lines"),
+    (document(0), None),
+])
+def test_quality_rules(text, issue):
+    assert quality_issue(text, QUALITY_DEFAULTS) == issue
+
+
+@pytest.mark.parametrize("suffix", [".jsonl", ".jsonl.gz", ".jsonl.zst"])
+def test_near_duplicates_across_parts(tmp_path, suffix):
+    docs = [document(seed) for seed in range(6)]
+    first = write_part(tmp_path / f"part1{suffix}", [docs[0], docs[1], "word " * 10, None, docs[2]])
+    second = write_part(tmp_path / f"part2{suffix}", [
+        near_duplicate(docs[0]), docs[3], docs[1], "12345 " * 60, docs[4], near_duplicate(docs[4]), docs[5],
+    ])
+    report = filter_parts([first, second], tmp_path / "out", num_workers=2)
+
+    # same names and compression, the first document of every cluster is kept
+    assert read_texts(tmp_path / "out" / f"part1{suffix}") == [docs[0], docs[1], docs[2]]
+    assert read_texts(tmp_path / "out" / f"part2{suffix}") == [docs[3], docs[4], docs[5]]
+    total = report["total"]
+    assert (total["documents"], total["kept"], total["duplicates"], total["duplicate_clusters"]) == (12, 6, 3, 3)
+    assert (total["too_short"], total["few_alpha_words"], total["unreadable"]) == (1, 1, 1)
+    assert total["kept_chars"] == sum(len(doc) for doc in docs)
+    assert [(part["documents"], part["kept"], part["duplicates"]) for part in report["parts"]] == [
+        (5, 3, 0), (7, 3, 3)
+    ]
+    with open(tmp_path / "out" / "filter_report.json", encoding="utf-8") as f:
+        assert json.load(f) == json.loads(json.dumps(report))
+    # the work directory is removed
+    assert sorted(path.name for path in (tmp_path / "out").iterdir()) == [
+        "filter_report.json", f"part1{suffix}", f"part2{suffix}"
+    ]
+
+
+def test_empty_parts(tmp_path):
+    empty = write_part(tmp_path / "part1.jsonl", [])
+    report = filter_parts([empty], tmp_path / "out", num_workers=1)
+    assert report["total"]["documents"] == report["total"]["kept"] == report["total"]["duplicate_clusters"] == 0
+    assert read_texts(tmp_path / "out" / "part1.jsonl") == []
+
+    # next to parts with documents, e.g. when the source ran out
+    full = write_part(tmp_path / "part2.jsonl", [document(0), document(0)])
+    report = filter_parts([empty, full], tmp_path / "out2", num_workers=2)
+    assert (report["total"]["kept"], report["total"]["duplicates"]) == (1, 1)
+    assert read_texts(tmp_path / "out2" / "part2.jsonl") == [document(0)]
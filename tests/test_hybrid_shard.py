@@ -0,0 +1,50 @@
+import logging
+
+import torch
+import torch.distributed as dist
+
+from dist_utils import run_distributed
+from tiny_model import tiny_llama, train_args
+from model_utils.train_utils import get_hybrid_shard_process_groups, get_logger, wrap_model_with_fsdp
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def group_layout(rank, world_size, output):
+    shard_group, replicate_group = get_hybrid_shard_process_groups(2)
+    # created once per size
+    assert get_hybrid_shard_process_groups(2) == (shard_group, replicate_group)
+    layout = {"shard": dist.get_process_group_ranks(shard_group),
+              "replicate": dist.get_process_group_ranks(replicate_group)}
+
+    model = wrap_model_with_fsdp(train_args("--sharding_strategy=hybrid", "--shard_group_size=2"), tiny_llama(), rank)
+    layout["fsdp_shard"] = dist.get_process_group_ranks(model.process_group)
+    layout["fsdp_replicate"] = dist.get_process_group_ranks(model._inter_node_pg)
+
+    handler = RecordingHandler()
+    get_logger().addHandler(handler)
+    model = wrap_model_with_fsdp(train_args("--sharding_strategy=full", "--shard_group_size=2"), tiny_llama(), rank)
+    layout["full_shard"] = dist.get_process_group_ranks(model.process_group)
+    layout["warnings"] = handler.messages
+    torch.save(layout, f"{output}.{rank}")
+
+
+def test_hybrid_shard_group_layout(tmp_path):
+    run_distributed(group_layout, 4, str(tmp_path / "layout"))
+    for rank in range(4):
+        layout = torch.load(tmp_path / f"layout.{rank}")
+        # sharded within blocks of 2 consecutive ranks, replicated across blocks
+        block = rank // 2 * 2
+        assert layout["shard"] == layout["fsdp_shard"] == [block, block + 1]
+        assert layout["replicate"] == layout["fsdp_replicate"] == [rank % 2, rank % 2 + 2]
+        # the full strategy shards across all ranks, the group size is ignored with a warning on rank 0
+        assert layout["full_shard"] == [0, 1, 2, 3]
+        warnings = [message for message in layout["warnings"] if "--shard_group_size" in message]
+        assert len(warnings) == (1 if rank == 0 else 0)
@@ -0,0 +1,260 @@
+import collections
+import json
+import os
+import re
+import subprocess
+import threading
+import time
+
+import pytest
+
+import hyperpod_ssm
+from hyperpod_ssm import HyperPodSSMShell, InventoryCache
+
+CLUSTER_ARN = "arn:aws:sagemaker:us-east-1:111122223333:cluster/abc123"
+
+
+class StubSageMaker:
+    """SageMaker client stand-in for a cluster with the given {group: [instance ids]}, counting calls."""
+
+    def __init__(self, groups):
+        self.groups = groups
+        self.calls = collections.Counter()
+        self.lock = threading.Lock()
+
+    def _count(self, name):
+        with self.lock:
+            self.calls[name] += 1
+
+    def list_clusters(self, **kwargs):
+        self._count("list_clusters")
+        return {"ClusterSummaries": [{"ClusterName": "c1", "ClusterStatus": "InService", "ClusterArn": CLUSTER_ARN}]}
+
+    def describe_cluster(self, ClusterName):
+        self._count("describe_cluster")
+        return {"ClusterArn": CLUSTER_ARN, "ClusterStatus": "InService",
+                "InstanceGroups": [{"InstanceGroupName": group} for group in self.groups]}
+
+    def list_cluster_nodes(self, ClusterName, MaxResults=10, NextToken=None, InstanceGroupNameContains=None):
+        self._count("list_cluster_nodes")
+        nodes = [
+            (group, instance_id) for group, instance_ids in self.groups.items() for instance_id in instance_ids
+            if InstanceGroupNameContains is None or InstanceGroupNameContains in group
+        ]
+        start = int(NextToken or 0)
+        response = {"ClusterNodeSummaries": [
+            {"InstanceId": instance_id, "InstanceGroupName": group, "InstanceType": "ml.p5.48xlarge",
+             "InstanceStatus": {"Status": "Running"}}
+            for group, instance_id in nodes[start:start + MaxResults]
+        ]}
+        if start + MaxResults < len(nodes):
+            response["NextToken"] = str(start + MaxResults)
+        return response
+
+
+def wait_for_refreshes():
+    for thread in threading.enumerate():
+        if thread.name.startswith("refresh-"):
+            thread.join()
+
+
+def node_ids(nodes):
+    return sorted(node["InstanceId"] for node in nodes)
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / "inventory.json")
+
+
+def make_shell(cache_path, groups, ttl=300):
+    client = StubSageMaker(groups)
+    return HyperPodSSMShell(sagemaker_client=client, cache=InventoryCache(cache_path, ttl)), client
+
+
+def test_warm_cache_makes_no_calls(cache_path):
+    shell, client = make_shell(cache_path, {"gpu": ["i-1", "i-2"], "ctrl": ["i-3"]})
+    shell.get_cluster_info("c1")
+    assert node_ids(shell.get_cluster_nodes("c1")) == ["i-1", "i-2", "i-3"]
+    # one page per instance group, listed in parallel
+    assert client.calls == {"describe_cluster": 1, "list_cluster_nodes": 2}
+
+    shell, client = make_shell(cache_path, {"gpu": ["i-1", "i-2"], "ctrl": ["i-3"]})
+    shell.get_cluster_info("c1")
+    shell.get_cluster_nodes("c1")
+    assert client.calls == {}
+
+
+def age_cache(cache_path, seconds):
+    cache = InventoryCache(cache_path)
+    for section in cache.data.values():
+        for entry in section.values():
+            entry["time"] -= seconds
+    cache._save()
+
+
+def test_stale_entry_is_served_and_refreshed_in_background(cache_path):
+    shell, _ = make_shell(cache_path, {"gpu": ["i-1", "i-2"]})
+    shell.get_cluster_info("c1")
+    shell.get_cluster_nodes("c1")
+    age_cache(cache_path, 600)
+
+    # i-2 was replaced by i-4
+    shell, client = make_shell(cache_path, {"gpu": ["i-1", "i-4"]})
+    shell.get_cluster_info("c1")
+    assert node_ids(shell.get_cluster_nodes("c1")) == ["i-1", "i-2"]
+    wait_for_refreshes()
+    assert client.calls["list_cluster_nodes"] == 1
+    assert node_ids(shell.get_cluster_nodes("c1")) == ["i-1", "i-4"]
+
+
+def test_max_age_lists_nodes_again_before_returning(cache_path):
+    shell, _ = make_shell(cache_path, {"gpu": ["i-1", "i-2"]})
+    shell.get_cluster_info("c1")
+    shell.get_cluster_nodes("c1")
+    age_cache(cache_path, 120)
+
+    # within the TTL, but older than the max age
+    shell, client = make_shell(cache_path, {"gpu": ["i-1", "i-4"]})
+    assert shell.get_cluster_info("c1", max_age=60)
+    assert node_ids(shell.get_cluster_nodes("c1", max_age=60)) == ["i-1", "i-4"]
+    assert client.calls == {"describe_cluster": 1, "list_cluster_nodes": 1}
+    # fresh now, no further calls
+    shell.get_cluster_nodes("c1", max_age=60)
+    wait_for_refreshes()
+    assert client.calls == {"describe_cluster": 1, "list_cluster_nodes": 1}
+
+
+def test_command_uses_a_fresh_inventory(cache_path, monkeypatch):
+    shell, _ = make_shell(cache_path, {"gpu": ["i-1", "i-2"]})
+    shell.get_cluster_info("c1")
+    shell.get_cluster_nodes("c1")
+    age_cache(cache_path, 120)
+
+    client = StubSageMaker({"gpu": ["i-1", "i-4"]})
+    targets = []
+    monkeypatch.setattr(hyperpod_ssm.boto3, "client", lambda service: client)
+    monkeypatch.setattr(hyperpod_ssm.boto3.session, "Session",
+                        lambda: type("Session", (), {"profile_name": None, "region_name": None}))
+    monkeypatch.setattr(hyperpod_ssm, "InventoryCache", lambda ttl, profile, region: InventoryCache(cache_path, ttl))
+    monkeypatch.setattr(HyperPodSSMShell, "run_command",
+                        lambda self, nodes, *args: targets.extend(node["InstanceId"] for node in nodes) or [])
+    monkeypatch.setattr(HyperPodSSMShell, "print_command_results", lambda self, results, full_output: None)
+    monkeypatch.setattr("sys.argv", ["hyperpod_ssm.py", "-c", "c1", "-x", "hostname"])
+    with pytest.raises(SystemExit) as exit_info:
+        hyperpod_ssm.main()
+    assert exit_info.value.code in (0, None)
+    assert sorted(targets) == ["i-1", "i-4"]
+    assert client.calls == {"describe_cluster": 1, "list_cluster_nodes": 1}
+
+
+# the patched subprocess.run, taken before any test patches it
+run_locally = subprocess.run
+
+# sagemaker-cluster:<cluster id>_<instance group>-<instance id>
+HYPERPOD_TARGET = re.compile(r"^sagemaker-cluster:(\w+)_(.+)-(i-\w+)$")
+
+
+class FakeSessions:
+    """`subprocess.run` stand-in for `aws ssm start-session` with a non-interactive command.
+
+    Checks the arguments, then runs the command locally with NODE set to the
+    node's instance ID and stderr merged into stdout, framed by the session
+    manager plugin's messages. Nodes in `hanging` time out, nodes in
+    `unreachable` fail to connect.
+    """
+
+    def __init__(self, hanging=(), unreachable=()):
+        self.hanging = set(hanging)
+        self.unreachable = set(unreachable)
+        self.targets = []
+        self.active = self.max_active = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, args, capture_output=False, text=False, timeout=None):
+        assert args[:3] == ["aws", "ssm", "start-session"] and capture_output and text
+        options = dict(zip(args[3::2], args[4::2]))
+        assert sorted(options) == ["--document-name", "--parameters", "--target"]
+        assert options["--document-name"] == "AWS-StartNonInteractiveCommand"
+        match = HYPERPOD_TARGET.match(options["--target"])
+        assert match and match.group(1) == "abc123", options["--target"]
+        parameters = json.loads(options["--parameters"])
+        assert list(parameters) == ["command"] and len(parameters["command"]) == 1
+        instance_id = match.group(3)
+        with self.lock:
+            self.targets.append(options["--target"])
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(0.005)
+            if instance_id in self.hanging:
+                raise subprocess.TimeoutExpired(args, timeout, output=b"\r\nStarting session with SessionId: s-1\r\n")
+            if instance_id in self.unreachable:
+                return subprocess.CompletedProcess(
+                    args, 254, "", f"An error occurred (TargetNotConnected) when calling the StartSession "
+                                   f"operation: {options['--target']} is not connected.\n"
+                )
+            remote = run_locally(["sh", "-c", parameters["command"][0]], stdout=subprocess.PIPE,
+                                 stderr=subprocess.STDOUT, text=True, env={**os.environ, "NODE": instance_id})
+        finally:
+            with self.lock:
+                self.active -= 1
+        stdout = (f"\r\nStarting session with SessionId: s-{instance_id}\r\n" + remote.stdout.replace("\n", "\r\n")
+                  + f"\r\n\r\nExiting session with sessionId: s-{instance_id}.\r\n\r\n")
+        return subprocess.CompletedProcess(args, 0, stdout, "")
+
+
+GPU_NODES = [f"i-{i:04d}" for i in range(84)]
+
+# fails on i-0005 like a node without the NVIDIA driver
+GPU_COMMAND = (
+    'if [ "$NODE" = i-0005 ]; then echo "nvidia-smi: command not found" >&2; exit 1; fi; '
+    "for gpu in 0 1 2 3 4 5 6 7; do echo 'NVIDIA H100 80GB HBM3, 535.183'; done"
+)
+
+
+def fleet_shell(cache_path, sessions, monkeypatch):
+    monkeypatch.setattr(hyperpod_ssm.subprocess, "run", sessions)
+    client = StubSageMaker({"gpu": GPU_NODES, "ctrl": ["i-ctrl"]})
+    shell = HyperPodSSMShell(sagemaker_client=client, cache=InventoryCache(cache_path))
+    shell.get_cluster_info("c1")
+    return shell, shell.filter_nodes(shell.get_cluster_nodes("c1"), instance_group="GPU", status="running")
+
+
+def target(instance_id):
+    return f"sagemaker-cluster:abc123_gpu-{instance_id}"
+
+
+def test_run_command_on_an_instance_group(cache_path, capsys, monkeypatch):
+    sessions = FakeSessions()
+    shell, nodes = fleet_shell(cache_path, sessions, monkeypatch)
+    assert [node["InstanceId"] for node in nodes] == GPU_NODES
+
+    results = shell.run_command(nodes, GPU_COMMAND, max_concurrency=8)
+    assert sorted(sessions.targets) == [target(i) for i in GPU_NODES]
+    assert sessions.max_active <= 8
+    # one result per node, in node order
+    assert [result["InstanceId"] for result in results] == GPU_NODES
+    assert [result["Status"] for result in results].count("Success") == 83
+    assert results[0]["Output"] == "\n".join(["NVIDIA H100 80GB HBM3, 535.183"] * 8)
+    assert results[5]["Status"] == "Failed" and results[5]["ResponseCode"] == 1
+
+    shell.print_command_results(results)
+    output = capsys.readouterr().out
+    assert "i-0005    gpu    Failed   1     nvidia-smi: command not found" in output
+    assert "--- 1 node(s): i-0005" in output
+    assert "83/84 nodes succeeded, 2 distinct output(s)" in output
+
+
+def test_exit_code_and_quoting_survive_the_session(cache_path, monkeypatch):
+    shell, nodes = fleet_shell(cache_path, FakeSessions(), monkeypatch)
+    result = shell.run_node_command(nodes[0], """printf "it's %s" "$NODE"; exit 3""")
+    assert (result["Status"], result["ResponseCode"], result["Output"]) == ("Failed", 3, "it's i-0000")
+
+
+def test_hung_and_unreachable_nodes(cache_path, monkeypatch):
+    shell, nodes = fleet_shell(cache_path, FakeSessions(hanging=["i-0001"], unreachable=["i-0002"]), monkeypatch)
+    results = shell.run_command(nodes[:3], "hostname", timeout=1)
+    assert [result["Status"] for result in results] == ["Success", "TimedOut", "Error"]
+    assert results[1]["Output"] == ""
+    assert "TargetNotConnected" in results[2]["Error"] and results[2]["ResponseCode"] is None
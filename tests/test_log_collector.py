@@ -0,0 +1,68 @@
+import glob
+import os
+import sys
+import time
+
+import pytest
+
+from test_hyperpod_cluster import LogCollector, parse_log_line, summarize_metrics
+
+LOG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "hyperpod_logs")
+LOG_FILES = sorted(glob.glob(os.path.join(LOG_DIR, "*.log")))
+FAKE_KUBECTL = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_kubectl.py"), LOG_DIR]
+
+
+def test_parse_log_line():
+    prefix = "2025-11-01 10:00:10,000 [INFO] __main__: "
+    record = parse_log_line(
+        prefix + "Node 3 Batch 10 Step time: 862.0ms, Data wait: 41.1ms, Speed: 9.28 samples/sec, "
+        "38014 tokens/sec, H2D: 1.20ms, prefetched: 2"
+    )
+    assert record == {
+        "kind": "node", "node": 3, "batch": 10, "step_ms": 862.0, "data_wait_ms": 41.1, "samples_per_sec": 9.28,
+        "tokens_per_sec": 38014.0, "time": record["time"],
+    }
+    assert parse_log_line(prefix + "Batch 20 Loss: 2.80000, Speed: 56.08 samples/sec, lr: 0.000100")["loss"] == 2.8
+    assert parse_log_line(prefix + "Batch 30 Validation loss: 2.75, ppl: 15.6")["kind"] == "validation"
+    assert parse_log_line(prefix + "Step 30 Checkpoint stall: 1.50s")["stall_s"] == 1.5
+    later = parse_log_line(prefix.replace(":10,", ":20,") + "Step 40 Checkpoint stall: 1.00s")
+    assert later["time"] - parse_log_line(prefix + "Step 30 Checkpoint stall: 1.50s")["time"] == pytest.approx(10)
+    assert parse_log_line("NCCL INFO Using network EFA") is None
+
+
+def test_summary_of_recorded_logs():
+    summary = LogCollector.from_log_files(LOG_FILES).summary()
+    assert summary["pods"] == 4
+    assert (summary["first_batch"], summary["last_batch"]) == (0, 50)
+    assert (summary["first_loss"], summary["last_loss"]) == (3.0, 2.5)
+    assert (summary["validation_batch"], summary["validation_loss"]) == (30, 2.75)
+    assert summary["checkpoints"] == 1
+    assert [node["node"] for node in summary["nodes"].values()] == [0, 1, 2, 3]
+    assert summary["step_time_imbalance"] == pytest.approx(1166 / 856)
+    # node 2 computes slowly, node 3 waits for its data
+    stragglers = {straggler["node"]: straggler["reasons"] for straggler in summary["stragglers"]}
+    assert list(stragglers) == [2, 3]
+    assert stragglers[2][0].startswith("step time") and stragglers[3][0].startswith("data wait")
+    assert summarize_metrics(LogCollector.from_log_files(LOG_FILES).snapshot(), straggler_threshold=0.5)[
+        "stragglers"] == [{"pod": "llama-worker-3", "node": 3, "reasons": [stragglers[3][0]]}]
+
+
+def test_follows_all_pods(tmp_path):
+    expected = LogCollector.from_log_files(LOG_FILES)
+    collector = LogCollector(FAKE_KUBECTL, "job-name=llama", log_dir=str(tmp_path))
+    try:
+        assert collector.discover_pods() == {pod: "Running" for pod in expected.records}
+        deadline = time.time() + 30
+        while collector.snapshot() != expected.snapshot() and time.time() < deadline:
+            time.sleep(0.1)
+        # the streams are still open, nothing is followed twice
+        collector.discover_pods()
+        assert len(collector.processes) == len(LOG_FILES)
+    finally:
+        collector.stop()
+    assert collector.snapshot() == expected.snapshot()
+    assert collector.latest("train")["batch"] == 50
+    assert all(process.poll() is not None for process in collector.processes.values())
+    for path in LOG_FILES:
+        with open(path) as recorded, open(tmp_path / os.path.basename(path)) as written:
+            assert written.read() == recorded.read()
@@ -0,0 +1,60 @@
+import zlib
+
+import torch
+import torch.distributed as dist
+
+from dist_utils import run_distributed
+from tiny_model import tiny_llama, train_args
+from model_utils.meta_init import init_parameters_
+from model_utils.seeding import derive_seed
+from model_utils.train_utils import create_model, get_model_config, wrap_model_with_fsdp
+
+
+def local_shards(meta_init, seed):
+    args = train_args(f"--meta_init={meta_init}", f"--seed={seed}")
+    model = create_model(args, get_model_config(args), dist.get_rank())
+    model = wrap_model_with_fsdp(args, model, dist.get_rank())
+    return [param.detach().clone() for param in model.parameters()]
+
+
+def compare_shards(rank, world_size, output):
+    # the global RNG must not matter, only --seed
+    torch.manual_seed(1000 + rank)
+    materialized = local_shards(meta_init=0, seed=5)
+    meta = local_shards(meta_init=1, seed=5)
+    other_seed = local_shards(meta_init=1, seed=6)
+    torch.save((materialized, meta, other_seed), f"{output}.{rank}")
+
+
+def test_meta_init_matches_materialized_init(tmp_path):
+    run_distributed(compare_shards, 2, str(tmp_path / "shards"))
+    for rank in range(2):
+        materialized, meta, other_seed = torch.load(tmp_path / f"shards.{rank}")
+        assert len(materialized) == len(meta) > 0
+        for a, b in zip(materialized, meta):
+            assert torch.equal(a, b)
+        assert not all(torch.equal(a, b) for a, b in zip(meta, other_seed))
+
+
+def test_values_are_drawn_on_the_cpu_generator():
+    # the same draws on every device: a CUDA generator seeded alike would give other values
+    model = tiny_llama(seed=1)
+    init_parameters_(model, 5, 0.02)
+    generator = torch.Generator().manual_seed(derive_seed(5, zlib.crc32(b"lm_head.weight")))
+    expected = torch.empty(model.lm_head.weight.shape).normal_(mean=0.0, std=0.02, generator=generator)
+    assert torch.equal(model.lm_head.weight, expected)
+    assert torch.equal(model.model.norm.weight, torch.ones_like(model.model.norm.weight))
+
+
+def test_materialized_model_is_initialized_once(monkeypatch):
+    from transformers.models.llama.modeling_llama import LlamaPreTrainedModel
+
+    calls = []
+    monkeypatch.setattr(LlamaPreTrainedModel, "_init_weights", lambda self, module: calls.append(module))
+    args = train_args("--seed=5")
+    model = create_model(args, get_model_config(args), 0)
+    assert calls == []
+    expected = tiny_llama()
+    init_parameters_(expected, 5, model.config.initializer_range)
+    for a, b in zip(model.parameters(), expected.parameters()):
+        assert torch.equal(a, b)
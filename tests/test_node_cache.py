@@ -0,0 +1,62 @@
+import json
+import os
+import time
+
+from dist_utils import run_distributed
+from model_utils.node_cache import get_cache_path, node_cached_json, node_local_cache
+
+# 4 ranks as 2 nodes of 2, each node with a cache directory of its own
+RANKS_PER_NODE = 2
+
+
+def cache_on_nodes(rank, world_size, root):
+    os.environ["LOCAL_RANK"] = str(rank % RANKS_PER_NODE)
+    cache_dir = os.path.join(root, f"node{rank // RANKS_PER_NODE}")
+    calls = {"materialize": 0, "compute": 0}
+
+    def materialize(tmp_path):
+        calls["materialize"] += 1
+        # slow, so that the other rank of the node reads too early unless it waits
+        time.sleep(1)
+        with open(tmp_path, "w") as f:
+            f.write(f"written by rank {rank}")
+
+    path = get_cache_path(cache_dir, "file", "s3://bucket/data", "train")
+    with open(node_local_cache(path, materialize)) as f:
+        first = f.read()
+    # an entry already on disk is reused, whether from this run or an earlier one
+    with open(node_local_cache(path, materialize)) as f:
+        second = f.read()
+    with open(node_local_cache(get_cache_path(cache_dir, "file", "earlier"), materialize)) as f:
+        earlier = f.read()
+
+    def compute():
+        calls["compute"] += 1
+        return [rank]
+
+    computed = node_cached_json(get_cache_path(cache_dir, "json", "listing"), compute)
+    with open(os.path.join(root, f"result.{rank}"), "w") as f:
+        json.dump({"first": first, "second": second, "earlier": earlier, "computed": computed, "calls": calls}, f)
+
+
+def test_materialized_once_per_node(tmp_path):
+    for node in ("node0", "node1"):
+        os.mkdir(tmp_path / node)
+        with open(get_cache_path(str(tmp_path / node), "file", "earlier"), "w") as f:
+            f.write("written by an earlier run")
+    run_distributed(cache_on_nodes, 4, str(tmp_path))
+    results = []
+    for rank in range(4):
+        with open(tmp_path / f"result.{rank}") as f:
+            results.append(json.load(f))
+    for rank, result in enumerate(results):
+        node_leader = rank - rank % RANKS_PER_NODE
+        # every rank reads what local rank 0 of its node wrote, once
+        assert result["first"] == result["second"] == f"written by rank {node_leader}"
+        assert result["earlier"] == "written by an earlier run"
+        assert result["computed"] == [node_leader]
+        expected_calls = 1 if rank == node_leader else 0
+        assert result["calls"] == {"materialize": expected_calls, "compute": expected_calls}
+    assert sorted(os.listdir(tmp_path / "node0")) == sorted(os.listdir(tmp_path / "node1"))
+    # no temporary files are left behind
+    assert not [name for name in os.listdir(tmp_path / "node0") if ".tmp" in name]
@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+from perf_gate import accept_results, compare, gate, get_baseline, open_store
+
+
+@pytest.fixture
+def store(tmp_path):
+    conn = open_store(str(tmp_path / "perf.db"))
+    yield conn
+    conn.close()
+
+
+def run_gate(store, tmp_path, samples_per_sec, threshold=0.05, accept=False):
+    path = tmp_path / "metrics.json"
+    path.write_text(json.dumps({"train_lines": 100, "samples_per_sec_p50": samples_per_sec}))
+    return gate(store, str(path), "p5-4nodes", "v1", threshold=threshold, accept=accept)["regression"]
+
+
+def test_regression_against_steady_runs(store, tmp_path):
+    for value in (100, 101, 99, 100, 100):
+        assert not run_gate(store, tmp_path, value)
+    assert not run_gate(store, tmp_path, 97)
+    assert run_gate(store, tmp_path, 90)
+
+
+def test_fast_outlier_does_not_become_the_baseline(store, tmp_path):
+    for value in (100, 101, 99, 100, 150):
+        run_gate(store, tmp_path, value)
+    # the median ignores the outlier, normal runs after it pass
+    for value in (100, 99, 101):
+        assert not run_gate(store, tmp_path, value)
+
+
+def test_regression_does_not_become_the_baseline(store, tmp_path):
+    for value in (100,) * 5:
+        run_gate(store, tmp_path, value)
+    # however often it is rerun
+    assert all(run_gate(store, tmp_path, 90) for _ in range(6))
+    assert get_baseline(store, "p5-4nodes", 1000)["samples_per_sec"] == 100
+
+
+def test_accepted_results_become_the_baseline(store, tmp_path):
+    for value in (100,) * 5:
+        run_gate(store, tmp_path, value)
+    # an expected slowdown: one run accepted after the fact, two while gating
+    assert run_gate(store, tmp_path, 90)
+    assert accept_results(store, [6]) == 1
+    assert run_gate(store, tmp_path, 90, accept=True)
+    assert run_gate(store, tmp_path, 90, accept=True)
+    assert get_baseline(store, "p5-4nodes", 1000)["samples_per_sec"] == 90
+    assert not run_gate(store, tmp_path, 90)
+
+
+def test_noisy_metric_allows_more_change(store, tmp_path):
+    # accepted, so that the runs that fall behind earlier ones still count
+    for value in (100, 120, 85, 110, 95):
+        run_gate(store, tmp_path, value, accept=True)
+    baseline = get_baseline(store, "p5-4nodes", 1000)
+    assert baseline["samples_per_sec"] == 100
+    assert baseline["spread"]["samples_per_sec"] > 0.1
+    (change,) = compare({"samples_per_sec": 90}, baseline, 0.05)
+    assert change["allowed"] > 0.3 and not change["regression"]
+    (change,) = compare({"samples_per_sec": 90}, baseline, 0.05, noise_sigmas=0)
+    assert change["regression"]
@@ -0,0 +1,47 @@
+import os
+
+import pytest
+import torch
+from transformers import LlamaForCausalLM
+
+from dist_utils import run_distributed
+from tiny_model import tiny_llama, train_args
+from model_utils.pretrained_loader import SAFETENSORS_INDEX_NAME, load_pretrained_weights
+from model_utils.train_utils import create_model, get_model_config, wrap_model_with_fsdp
+
+
+def local_shards(model):
+    return [param.detach().clone() for param in model.parameters()]
+
+
+def compare_with_from_pretrained(rank, world_size, path, output):
+    args = train_args(f"--pretrained_path={path}")
+    model = wrap_model_with_fsdp(args, create_model(args, get_model_config(args), rank), rank)
+    loaded = load_pretrained_weights(model, path, num_threads=2)
+    shards = local_shards(model)
+
+    reference = wrap_model_with_fsdp(train_args(), LlamaForCausalLM.from_pretrained(path), rank)
+    torch.save((loaded, shards, local_shards(reference)), f"{output}.{rank}")
+
+
+@pytest.mark.parametrize("max_shard_size", [None, "10KB"])
+def test_shards_match_from_pretrained(tmp_path, max_shard_size):
+    path = tmp_path / "pretrained"
+    kwargs = {"max_shard_size": max_shard_size} if max_shard_size else {}
+    model = tiny_llama(seed=3)
+    model.save_pretrained(path, safe_serialization=True, **kwargs)
+    # a sharded checkpoint has an index mapping the tensors to several files
+    assert os.path.exists(path / SAFETENSORS_INDEX_NAME) == bool(max_shard_size)
+    if max_shard_size:
+        assert len([name for name in os.listdir(path) if name.endswith(".safetensors")]) > 1
+
+    run_distributed(compare_with_from_pretrained, 2, str(path), str(tmp_path / "shards"))
+    total = 0
+    for rank in range(2):
+        loaded, shards, reference = torch.load(tmp_path / f"shards.{rank}")
+        assert len(shards) == len(reference) > 0
+        for a, b in zip(shards, reference):
+            assert torch.equal(a, b)
+        total += loaded
+    # every element is loaded once, on one of the ranks
+    assert total == sum(param.numel() for param in model.parameters())
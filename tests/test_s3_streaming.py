@@ -0,0 +1,126 @@
+import gzip
+import io
+import os
+import shutil
+
+import pytest
+
+from fake_s3 import DirectoryS3Client
+from fake_tokenizer import CharTokenizer
+from test_streaming_dataset import samples, write_jsonl
+from model_utils import s3_reader
+from model_utils.s3_reader import S3RangeReader, list_s3_objects
+from model_utils.train_utils import create_streaming_dataloader
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    client = DirectoryS3Client(tmp_path / "s3")
+    client.create_bucket(Bucket="bucket")
+    monkeypatch.setattr(s3_reader, "get_s3_client", lambda: client)
+    return client
+
+
+@pytest.fixture
+def local_data(tmp_path):
+    data = tmp_path / "data"
+    data.mkdir()
+    write_jsonl(data, "a-train.jsonl", 40)
+    path = write_jsonl(data, "b-train.jsonl", 25)
+    with open(path, "rb") as f, gzip.open(f"{path}.gz", "wb") as g:
+        g.write(f.read())
+    os.remove(path)
+    write_jsonl(data, "a-validation.jsonl", 10)
+    return data
+
+
+def upload_dir(client, directory, prefix):
+    for name in os.listdir(directory):
+        client.upload_file(os.path.join(directory, name), "bucket", f"{prefix}/{name}")
+
+
+def test_list_objects_under_a_prefix(client, local_data):
+    upload_dir(client, local_data, "c4")
+    client.put_object(Bucket="bucket", Key="c4/README.md", Body="not data")
+    client.put_object(Bucket="bucket", Key="c4-other/x.jsonl", Body="{}")
+    objects = list_s3_objects("s3://bucket/c4", (".jsonl", ".jsonl.gz"))
+    assert [obj["name"] for obj in objects] == ["a-train.jsonl", "a-validation.jsonl", "b-train.jsonl.gz"]
+    assert objects[0]["url"] == "s3://bucket/c4/a-train.jsonl"
+    assert objects[0]["size"] == os.path.getsize(local_data / "a-train.jsonl")
+    with pytest.raises(FileNotFoundError):
+        list_s3_objects("s3://bucket/empty", (".jsonl",))
+
+
+def test_range_reader_reads_the_object_in_chunks(client, tmp_path):
+    data = bytes(range(256)) * 3
+    client.put_object(Bucket="bucket", Key="blob", Body=data)
+    cache_path = str(tmp_path / "cache" / "blob")
+    with S3RangeReader("s3://bucket/blob", len(data), chunk_size=100, read_ahead=3, cache_path=cache_path) as reader:
+        assert reader.read() == data
+    assert sorted(client.ranges) == [("blob", start, min(start + 100, len(data)) - 1) for start in range(0, 768, 100)]
+    with open(cache_path, "rb") as f:
+        assert f.read() == data
+
+    # a partial read leaves no cache entry behind
+    shutil.rmtree(tmp_path / "cache")
+    with S3RangeReader("s3://bucket/blob", len(data), chunk_size=100, cache_path=cache_path) as reader:
+        reader.read(150)
+    assert os.listdir(tmp_path / "cache") == []
+
+
+def test_readers_of_one_object_share_its_cache_entry(client, tmp_path):
+    data = bytes(range(256)) * 3
+    client.put_object(Bucket="bucket", Key="blob", Body=data)
+    cache_path = str(tmp_path / "cache" / "blob")
+    # two stripes of an object dealt to one reader read it at the same time
+    # buffered, as streams read them: a raw read returns at most one chunk
+    first = io.BufferedReader(S3RangeReader("s3://bucket/blob", len(data), chunk_size=100, cache_path=cache_path))
+    second = io.BufferedReader(S3RangeReader("s3://bucket/blob", len(data), chunk_size=100, cache_path=cache_path))
+    assert first.read(300) == second.read(300) == data[:300]
+    assert first.read() == second.read() == data[300:]
+    first.close()
+    second.close()
+    assert os.listdir(tmp_path / "cache") == ["blob"]
+    with open(cache_path, "rb") as f:
+        assert f.read() == data
+
+
+def loader(dataset, rank, cache_dir=None, world_size=2):
+    return create_streaming_dataloader(
+        dataset, CharTokenizer(), global_rank=rank, world_size=world_size, batch_size=2, max_context_width=16, workers=0,
+        split="train", seed=7, shuffle_block_size=4, cache_dir=cache_dir,
+    )
+
+
+def test_s3_prefix_reads_like_a_local_directory(client, local_data):
+    upload_dir(client, local_data, "c4")
+    read_objects = []
+    for rank in range(2):
+        expected = [samples(batch) for batch in loader(str(local_data), rank)]
+        client.ranges.clear()
+        assert [samples(batch) for batch in loader("s3://bucket/c4", rank)] == expected
+        read_objects.append({key for key, _, _ in client.ranges})
+    # every rank fetches only the objects dealt to it
+    assert sorted(read_objects, key=sorted) == [{"c4/a-train.jsonl"}, {"c4/b-train.jsonl.gz"}]
+
+
+def test_objects_are_read_again_from_the_node_cache(client, local_data, tmp_path):
+    upload_dir(client, local_data, "c4")
+    cache_dir = str(tmp_path / "cache")
+    expected = [samples(batch) for batch in loader("s3://bucket/c4", 0, cache_dir)]
+    client.calls.clear()
+    assert [samples(batch) for batch in loader("s3://bucket/c4", 0, cache_dir)] == expected
+    assert client.calls["get_object"] == 0
+
+
+def test_stripes_of_an_object_read_through_the_cache(client, local_data, tmp_path):
+    write_jsonl(local_data, "c-train.jsonl", 30)
+    upload_dir(client, local_data, "c4")
+    cache_dir = str(tmp_path / "cache")
+    # 3 objects for 4 ranks: every object is split into 2 stripes and some rank reads both stripes of one
+    for rank in range(4):
+        expected = [samples(batch) for batch in loader(str(local_data), rank, world_size=4)]
+        assert [samples(batch) for batch in loader("s3://bucket/c4", rank, cache_dir, world_size=4)] == expected
+    # one entry per object, no temporary files left behind
+    entries = sorted(os.listdir(cache_dir))
+    assert len(entries) == 3 and not any(".tmp" in entry for entry in entries)
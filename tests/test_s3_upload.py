@@ -0,0 +1,87 @@
+import functools
+import json
+import os
+
+import pytest
+from botocore.exceptions import ClientError
+
+import download_c4
+from download_c4 import S3Uploader, download_c4_subset
+from fake_s3 import DirectoryS3Client
+from test_download_c4 import fake_shard
+
+PREFIX = "c4/subset"
+PART_KEYS = [f"{PREFIX}/c4_train_1000_part00{part}.jsonl.gz" for part in (1, 2, 3)]
+MANIFEST_KEY = f"{PREFIX}/c4_train_1000_manifest.json"
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(download_c4.time, "sleep", lambda seconds: None)
+
+
+def make_client(tmp_path, fail_uploads=None):
+    client = DirectoryS3Client(tmp_path / "s3", fail_uploads)
+    client.create_bucket(Bucket="bucket")
+    return client
+
+
+def download(output_dir, client, cleanup_local=True):
+    return download_c4_subset(
+        output_dir=str(output_dir), num_samples=1000, num_parts=3, num_workers=2, compression="gzip",
+        s3_path=f"s3://bucket/{PREFIX}", cleanup_local=cleanup_local, upload_retries=2, s3_client=client,
+        load_shard=functools.partial(fake_shard, size=400), num_source_shards=10,
+    )
+
+
+def read_object(client, key):
+    return client.get_object(Bucket="bucket", Key=key)["Body"].read()
+
+
+def test_uploaded_parts_and_manifest(tmp_path):
+    # throttled twice, the third attempt succeeds
+    client = make_client(tmp_path, {PART_KEYS[1]: 2})
+    urls = download(tmp_path / "out", client)
+    assert urls == [f"s3://bucket/{key}" for key in PART_KEYS]
+    assert client.calls["upload_file"] == 3 + 2 + 1
+
+    manifest = json.loads(read_object(client, MANIFEST_KEY))
+    assert manifest["total_samples"] == 1000
+    assert [obj["url"] for obj in manifest["objects"]] == urls
+    for obj, key in zip(manifest["objects"], PART_KEYS):
+        assert obj["size"] == len(read_object(client, key))
+    assert [obj["samples"] for obj in manifest["objects"]] == [334, 333, 333]
+    # parts are removed once their upload is confirmed, the progress is kept for reruns
+    assert not [name for name in os.listdir(tmp_path / "out") if name.endswith(".jsonl.gz")]
+
+
+def test_failed_upload_keeps_the_part_and_is_retried_by_a_rerun(tmp_path):
+    # fails every attempt of the first run
+    client = make_client(tmp_path, {PART_KEYS[0]: 3})
+    download(tmp_path / "out", client)
+    assert os.path.exists(tmp_path / "out" / os.path.basename(PART_KEYS[0]))
+    assert not os.path.exists(tmp_path / "out" / os.path.basename(PART_KEYS[1]))
+    # no manifest of an incomplete upload
+    assert client.head_object(Bucket="bucket", Key=PART_KEYS[1])
+    with pytest.raises(ClientError, match="NoSuchKey"):
+        client.head_object(Bucket="bucket", Key=MANIFEST_KEY)
+
+    client.calls.clear()
+    urls = download(tmp_path / "out", client)
+    assert urls == [f"s3://bucket/{key}" for key in PART_KEYS]
+    # only the failed part and the manifest are uploaded again
+    assert client.calls["upload_file"] == 2
+    assert json.loads(read_object(client, MANIFEST_KEY))["total_samples"] == 1000
+
+
+def test_uploader_uses_multipart_transfers(tmp_path):
+    client = make_client(tmp_path)
+    uploader = S3Uploader(client, "bucket", PREFIX, num_workers=2, concurrency=4, chunksize_mb=16)
+    assert uploader.transfer_config.multipart_chunksize == 16 * 1024 * 1024
+    assert uploader.transfer_config.max_concurrency == 4
+    path = tmp_path / "part.jsonl"
+    path.write_text('{"text": "a"}\n')
+    uploaded = []
+    uploader.submit(str(path), uploaded.append)
+    assert uploader.wait() == [f"s3://bucket/{PREFIX}/part.jsonl"]
+    assert uploaded == [f"s3://bucket/{PREFIX}/part.jsonl"]
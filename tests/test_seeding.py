@@ -0,0 +1,40 @@
+import itertools
+
+import torch
+
+from dist_utils import run_distributed
+from fake_tokenizer import CharTokenizer
+from test_streaming_dataset import write_jsonl
+from tiny_model import tiny_training_state, train_args, train_step
+from model_utils.seeding import derive_seed, set_seed
+from model_utils.train_utils import create_streaming_dataloader
+
+
+def train_losses(rank, world_size, data, seed, output):
+    # seeded like train.py: same initialization on every rank, then a seed per rank
+    args = train_args(f"--seed={seed}", "--bf16=0")
+    set_seed(args.seed)
+    model, optimizer, lr_scheduler, _ = tiny_training_state(args, rank)
+    set_seed(derive_seed(args.seed, rank))
+    loader = create_streaming_dataloader(
+        data, CharTokenizer(), global_rank=rank, world_size=world_size, batch_size=2, max_context_width=16,
+        workers=0, split="train", seed=args.seed, shuffle_block_size=4,
+    )
+    losses = [train_step(model, optimizer, lr_scheduler, batch) for batch in itertools.islice(loader, 4)]
+    torch.save(losses, f"{output}.{rank}")
+
+
+def test_identical_runs_give_identical_losses(tmp_path):
+    data = tmp_path / "data"
+    data.mkdir()
+    write_jsonl(data, "a-train.jsonl", 40)
+    write_jsonl(data, "b-train.jsonl", 25)
+
+    runs = {}
+    for name, seed in (("first", 5), ("second", 5), ("other_seed", 6)):
+        run_distributed(train_losses, 2, str(data), seed, str(tmp_path / name))
+        runs[name] = [torch.load(tmp_path / f"{name}.{rank}") for rank in range(2)]
+
+    # bit-identical, not merely close
+    assert runs["first"] == runs["second"]
+    assert runs["first"] != runs["other_seed"]
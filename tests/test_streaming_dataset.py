@@ -0,0 +1,368 @@
+import collections
+import itertools
+import json
+import os
+
+import pytest
+import torch
+
+from dist_utils import run_distributed
+from fake_tokenizer import CharTokenizer
+from model_utils.streaming_dataset import StreamingTokensDataset, get_streams, load_mixture
+from model_utils.train_utils import create_streaming_dataloader, get_model_inputs
+
+
+def write_jsonl(directory, name, num_documents):
+    path = os.path.join(directory, name)
+    with open(path, "w") as f:
+        for i in range(num_documents):
+            f.write(json.dumps({"text": f"{name} document {i} " + "x" * (i % 7)}) + "\n")
+    return path
+
+
+def make_dataset(directory, global_rank=0, world_size=1, num_workers=0, min_streams=0, num_stripes=4, pack=True,
+                 batch_tokens=0):
+    streams = get_streams(directory, split="train", num_stripes=num_stripes, min_streams=min_streams)
+    return StreamingTokensDataset(
+        streams, CharTokenizer(), max_length=16, batch_size=2, global_rank=global_rank, world_size=world_size,
+        seed=7, shuffle_block_size=4, num_workers=num_workers, min_streams=min_streams, pack=pack,
+        batch_tokens=batch_tokens,
+    )
+
+
+def samples(batch):
+    return [tuple(row[row != 0].tolist()) for row in batch["input_ids"]]
+
+
+def sample_lengths(batch):
+    if "attention_mask" not in batch:
+        return [batch["input_ids"].shape[1]] * len(batch["input_ids"])
+    return batch["attention_mask"].sum(dim=1).tolist()
+
+
+def test_streams_are_split_for_every_reader(tmp_path):
+    # P5 layout: 32 ranks x 4 workers reading 2 train files and a single validation file
+    write_jsonl(tmp_path, "c4-train.00000.jsonl", 300)
+    write_jsonl(tmp_path, "c4-train.00001.jsonl", 300)
+    write_jsonl(tmp_path, "c4-validation.00000.jsonl", 300)
+    for split in ("train", "validation"):
+        streams = get_streams(str(tmp_path), split=split, num_stripes=8, min_streams=128)
+        assert len(streams) == 128
+        dataset = StreamingTokensDataset(
+            streams, CharTokenizer(), 16, 2, world_size=32, num_workers=4, min_streams=128
+        )
+        assert all(dataset.dealt_streams(reader, 128) for reader in range(128))
+
+
+def test_hub_dataset_has_no_estimate(tmp_path, monkeypatch):
+    # a relative path without ./ is loaded with the HF datasets library, like a hub dataset
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("hub")
+    write_jsonl("hub", "a-train.jsonl", 20)
+    loader = create_streaming_dataloader(
+        "hub", CharTokenizer(), batch_size=2, max_context_width=16, workers=0, split="train", seed=7,
+    )
+    assert loader.dataset.streams[0].tokens is None
+    assert loader.dataset.estimated_batches(loader.num_workers) is None
+    assert len(list(loader)) > 1
+
+
+def test_too_few_streams_raises(tmp_path):
+    write_jsonl(tmp_path, "train.jsonl", 20)
+    with pytest.raises(ValueError, match="4 data streams for 8 readers"):
+        make_dataset(str(tmp_path), world_size=2, num_workers=4, num_stripes=4)
+
+
+def save_after_batches(rank, world_size, directory, num_batches, output):
+    dataset = make_dataset(directory, rank, world_size, min_streams=world_size)
+    consumed = []
+    for batch in list(iter(dataset))[:num_batches]:
+        dataset.update_positions(batch["data_position"])
+        consumed.extend(samples(batch))
+    state = dataset.state_dict()
+    torch.save({"state": state, "consumed": consumed}, f"{output}.{rank}")
+
+
+def test_resume_at_other_world_size(tmp_path):
+    data = tmp_path / "data"
+    data.mkdir()
+    write_jsonl(data, "a-train.jsonl", 40)
+    write_jsonl(data, "b-train.jsonl", 25)
+    # every sample of the epoch, read by a single reader
+    expected = collections.Counter(sample for batch in make_dataset(str(data)) for sample in samples(batch))
+
+    # save after 3 batches on 2 ranks, resume on 3
+    run_distributed(save_after_batches, 2, str(data), 3, str(tmp_path / "saved"))
+    saved = [torch.load(tmp_path / f"saved.{rank}") for rank in range(2)]
+    state = saved[0]["state"]
+    assert state["min_streams"] == 2 and state["consumed_samples"] == 2 * 3 * 2
+    consumed = collections.Counter(sample for rank in saved for sample in rank["consumed"])
+    for rank in range(3):
+        dataset = make_dataset(str(data), rank, 3, min_streams=state["min_streams"])
+        dataset.load_state_dict(state)
+        consumed.update(sample for batch in dataset for sample in samples(batch))
+
+    # nothing skipped, nothing read twice
+    assert consumed == expected
+
+
+def worker_loader(directory, rank, world_size, min_streams=None):
+    return create_streaming_dataloader(
+        directory, CharTokenizer(), global_rank=rank, world_size=world_size, batch_size=2, max_context_width=16,
+        workers=3, split="train", num_stripes=2, seed=7, shuffle_block_size=4, min_streams=min_streams,
+    )
+
+
+def resume_with_workers(rank, world_size, directory, num_batches, output):
+    expected = [samples(batch) for batch in worker_loader(directory, rank, world_size)]
+
+    loader = worker_loader(directory, rank, world_size)
+    resumed = []
+    for batch in itertools.islice(loader, num_batches):
+        loader.dataset.update_positions(batch["data_position"])
+        resumed.append(samples(batch))
+    state = loader.dataset.state_dict()
+    loader = worker_loader(directory, rank, world_size, min_streams=state["min_streams"])
+    loader.dataset.load_state_dict(state)
+    resumed.extend(samples(batch) for batch in loader)
+    torch.save((expected, resumed), f"{output}.{rank}")
+
+
+def test_resume_keeps_batch_order_across_workers(tmp_path):
+    data = tmp_path / "data"
+    data.mkdir()
+    # files of different lengths, so readers run out at different batches
+    write_jsonl(data, "a-train.jsonl", 60)
+    write_jsonl(data, "b-train.jsonl", 23)
+    write_jsonl(data, "c-train.jsonl", 41)
+    # 4 batches of 3 workers: resumes in the middle of the round-robin
+    run_distributed(resume_with_workers, 2, str(data), 4, str(tmp_path / "order"))
+    for rank in range(2):
+        expected, resumed = torch.load(tmp_path / f"order.{rank}")
+        assert len(expected) > 4
+        assert resumed == expected
+
+
+NUM_EPOCHS = 3
+
+
+def epochs_with_resume(rank, world_size, directory, stop_after, output):
+    # unpacked, so that every epoch has the same samples
+    dataset = make_dataset(directory, rank, world_size, min_streams=world_size, pack=False)
+    expected = []
+    for epoch in range(NUM_EPOCHS):
+        dataset.set_epoch(epoch)
+        expected.append([samples(batch) for batch in dataset])
+
+    # stopped after `stop_after` batches of the second epoch
+    dataset = make_dataset(directory, rank, world_size, min_streams=world_size, pack=False)
+    resumed = []
+    for epoch in range(2):
+        dataset.set_epoch(epoch)
+        resumed.append([])
+        for batch in itertools.islice(dataset, stop_after if epoch == 1 else None):
+            dataset.update_positions(batch["data_position"])
+            resumed[-1].append(samples(batch))
+    state = dataset.state_dict()
+
+    # the training loop: a resumed dataset starts in the epoch it was checkpointed in
+    dataset = make_dataset(directory, rank, world_size, min_streams=world_size, pack=False)
+    dataset.load_state_dict(state)
+    assert dataset.epoch == 1
+    for epoch in range(dataset.epoch, NUM_EPOCHS):
+        dataset.set_epoch(epoch)
+        if epoch > 1:
+            resumed.append([])
+        resumed[-1].extend(samples(batch) for batch in dataset)
+    torch.save((expected, resumed), f"{output}.{rank}")
+
+
+def test_epochs_reshuffle_and_resume_in_the_checkpointed_epoch(tmp_path):
+    data = tmp_path / "data"
+    data.mkdir()
+    write_jsonl(data, "a-train.jsonl", 40)
+    write_jsonl(data, "b-train.jsonl", 25)
+    run_distributed(epochs_with_resume, 2, str(data), 3, str(tmp_path / "epochs"))
+    ranks = [torch.load(tmp_path / f"epochs.{rank}") for rank in range(2)]
+    for expected, resumed in ranks:
+        # nothing skipped or repeated in the resumed epoch, the later one starts from the beginning
+        assert resumed == expected
+    epochs = [
+        [sample for expected, _ in ranks for batch in expected[epoch] for sample in batch]
+        for epoch in range(NUM_EPOCHS)
+    ]
+    # every epoch reads all samples once, each in another order
+    assert all(collections.Counter(epoch) == collections.Counter(epochs[0]) for epoch in epochs)
+    assert len({tuple(epoch) for epoch in epochs}) == NUM_EPOCHS
+
+
+def write_mixture(directory, weights):
+    """A JSON mixture spec with a source of 60 documents per (name, weight)."""
+    sources = []
+    for name, weight in weights.items():
+        os.makedirs(os.path.join(directory, name))
+        write_jsonl(os.path.join(directory, name), f"{name}-train.jsonl", 60)
+        sources.append({"name": name, "dataset": os.path.join(directory, name), "weight": weight})
+    path = os.path.join(directory, "mixture.json")
+    with open(path, "w") as f:
+        json.dump({"sources": sources}, f)
+    return path
+
+
+def mixture_loader(mixture, rank=0, world_size=1, min_streams=None):
+    return create_streaming_dataloader(
+        None, CharTokenizer(), global_rank=rank, world_size=world_size, batch_size=2, max_context_width=16,
+        workers=0, split="train", num_stripes=2, seed=7, shuffle_block_size=4, mixture=load_mixture(mixture),
+        min_streams=min_streams,
+    )
+
+
+def batch_sources(dataset, batch):
+    return [dataset.sources[dataset.stream_sources[index]] for index in batch["data_position"][:, 0].tolist()]
+
+
+def test_load_mixture_rejects_bad_sources(tmp_path):
+    path = tmp_path / "mixture.json"
+    for sources, match in (
+        ([], "No sources"),
+        ([{"name": "web"}], "needs a name and a dataset"),
+        ([{"name": "web", "dataset": "a"}, {"name": "web", "dataset": "b"}], "Duplicate"),
+        ([{"name": "web", "dataset": "a", "weight": 0}], "positive weight"),
+    ):
+        path.write_text(json.dumps({"sources": sources}))
+        with pytest.raises(ValueError, match=match):
+            load_mixture(str(path))
+
+
+def test_mixture_blends_sources_by_weight(tmp_path):
+    loader = mixture_loader(write_mixture(str(tmp_path), {"web": 3, "code": 1}))
+    # every source is split into streams of its own, with keys prefixed by its name
+    assert {stream.key.split("/")[0] for stream in loader.dataset.streams} == {"web", "code"}
+    sources = [source for batch in itertools.islice(loader, 20) for source in batch_sources(loader.dataset, batch)]
+    # the source furthest behind its share goes next: web, web, web, code, ...
+    assert sources == ["web", "web", "web", "code"] * 10
+
+
+def resume_mixture(rank, world_size, mixture, num_batches, output):
+    loader = mixture_loader(mixture, rank, world_size)
+    expected = [samples(batch) for batch in itertools.islice(loader, num_batches + 3)]
+
+    loader = mixture_loader(mixture, rank, world_size)
+    for batch in itertools.islice(loader, num_batches):
+        loader.dataset.update_positions(batch["data_position"])
+    saved = loader.dataset.state_dict()
+    loader = mixture_loader(mixture, rank, world_size, min_streams=saved["min_streams"])
+    loader.dataset.load_state_dict(saved)
+    reloaded = loader.dataset.state_dict()
+    resumed = []
+    for batch in itertools.islice(loader, 3):
+        loader.dataset.update_positions(batch["data_position"])
+        resumed.append(samples(batch))
+    torch.save((saved, reloaded, loader.dataset.state_dict(), expected[num_batches:], resumed), f"{output}.{rank}")
+
+
+def test_mixture_resumes_source_samples(tmp_path):
+    data = tmp_path / "data"
+    data.mkdir()
+    mixture = write_mixture(str(data), {"web": 3, "code": 1})
+    run_distributed(resume_mixture, 2, mixture, 4, str(tmp_path / "mixture"))
+    for rank in range(2):
+        saved, reloaded, final, expected, resumed = torch.load(tmp_path / f"mixture.{rank}")
+        # 2 ranks x 4 batches x 2 samples, blended 3:1 on every rank
+        assert saved["source_samples"] == {"web": 12, "code": 4}
+        assert reloaded["source_samples"] == saved["source_samples"]
+        # the resumed run goes on with the same samples and counts them on top: 7 batches of
+        # web, web, web, code, ... make 11 web and 3 code samples per rank
+        assert resumed == expected
+        assert final["source_samples"] == {"web": 22, "code": 6}
+        assert final["consumed_samples"] == 2 * 7 * 2
+
+
+def write_train_files(directory):
+    write_jsonl(directory, "a-train.jsonl", 40)
+    write_jsonl(directory, "b-train.jsonl", 25)
+
+
+def test_unpacked_samples_hold_one_document(tmp_path):
+    write_train_files(tmp_path)
+    batches = list(make_dataset(str(tmp_path), pack=False))
+    rows = [row[:length] for batch in batches
+            for row, length in zip(batch["input_ids"].tolist(), sample_lengths(batch))]
+    assert all(len(row) <= 16 for row in rows)
+    # the end of sequence token only ends a document, nothing is packed after it
+    assert all(0 not in row[:-1] for row in rows)
+    # every document starts a sample of its own: "a-train.jsonl document 0 " is longer than a sample
+    starts = collections.Counter("".join(map(chr, row[:7])) for row in rows)
+    assert starts["a-train"] == 40 and starts["b-train"] == 25
+
+
+def test_padded_batches_are_int32_with_attention_mask(tmp_path):
+    write_train_files(tmp_path)
+    for batch in make_dataset(str(tmp_path)):
+        # packed samples are all max_length long, nothing to mask
+        assert batch["input_ids"].dtype == torch.int32 and batch["input_ids"].shape[1] == 16
+        assert "attention_mask" not in batch
+
+    padded = [batch for batch in make_dataset(str(tmp_path), pack=False) if "attention_mask" in batch]
+    assert padded
+    for batch in padded:
+        mask = batch["attention_mask"]
+        assert mask.dtype == torch.int32 and mask.shape == batch["input_ids"].shape
+        lengths = torch.tensor(sample_lengths(batch))
+        assert torch.equal(mask, (torch.arange(mask.shape[1]) < lengths[:, None]).int())
+        # padded with the eos token, which the labels ignore
+        assert not batch["input_ids"][mask == 0].any()
+        labels = get_model_inputs(batch, "cpu")["labels"]
+        assert labels.dtype == torch.int64
+        assert torch.equal(labels == -100, mask == 0)
+
+
+def test_batch_tokens_fill_the_budget(tmp_path):
+    write_train_files(tmp_path)
+    batches = list(make_dataset(str(tmp_path), pack=False, batch_tokens=48))
+    for batch, next_batch in zip(batches, batches[1:]):
+        padded_length = batch["input_ids"].shape[1]
+        assert len(batch["input_ids"]) * padded_length <= 48
+        # the next sample did not fit
+        assert (len(batch["input_ids"]) + 1) * max(padded_length, sample_lengths(next_batch)[0]) > 48
+    # the same samples, in the same order, as with a fixed batch size
+    unbudgeted = [sample for batch in make_dataset(str(tmp_path), pack=False) for sample in samples(batch)]
+    assert [sample for batch in batches for sample in samples(batch)] == unbudgeted
+
+    with pytest.raises(ValueError, match="must be at least max_length"):
+        make_dataset(str(tmp_path), batch_tokens=8)
+
+
+def test_train_passes_the_data_flags_to_both_loaders(tmp_path, monkeypatch):
+    from unittest import mock
+
+    import torch.distributed as dist
+
+    import train
+    from dist_utils import free_port
+    from tiny_model import train_args
+
+    data = tmp_path / "data"
+    data.mkdir()
+    write_jsonl(data, "c4-train.jsonl", 20)
+    write_jsonl(data, "c4-validation.jsonl", 20)
+    monkeypatch.setenv("RANK", "0")
+    monkeypatch.setenv("WORLD_SIZE", "1")
+    monkeypatch.setenv("LOCAL_RANK", "0")
+    monkeypatch.setenv("MASTER_ADDR", "127.0.0.1")
+    monkeypatch.setenv("MASTER_PORT", str(free_port()))
+    args = train_args(f"--local_dataset_path={data}", f"--data_cache_dir={tmp_path / 'cache'}",
+                      "--max_context_width=24", "--pack_documents=0", "--batch_tokens=96")
+    try:
+        with mock.patch.object(train, "load_tokenizer", return_value=CharTokenizer()), \
+                mock.patch.object(train, "train") as run_training:
+            train.main(args)
+    finally:
+        if dist.is_initialized():
+            dist.destroy_process_group()
+
+    train_loader, val_loader = run_training.call_args.args[2:4]
+    for loader in (train_loader, val_loader):
+        assert loader.dataset.max_length == 24
+        assert not loader.dataset.pack
+        assert loader.dataset.batch_tokens == 96
@@ -0,0 +1,99 @@
+import functools
+
+import torch
+from torch.distributed.fsdp import FullyShardedDataParallel as FSDP
+from torch.distributed.fsdp.wrap import transformer_auto_wrap_policy
+from transformers import LlamaConfig, LlamaForCausalLM
+from transformers.models.llama.modeling_llama import LlamaDecoderLayer
+
+VOCAB_SIZE = 128
+
+
+def tiny_llama_config(num_hidden_layers=2):
+    return LlamaConfig(
+        vocab_size=VOCAB_SIZE, hidden_size=32, intermediate_size=64, num_hidden_layers=num_hidden_layers,
+        num_attention_heads=4, num_key_value_heads=4, max_position_embeddings=64,
+    )
+
+
+def tiny_llama(seed=0, num_hidden_layers=2):
+    torch.manual_seed(seed)
+    return LlamaForCausalLM(tiny_llama_config(num_hidden_layers))
+
+
+def wrap_cpu_fsdp(model):
+    return FSDP(
+        model, auto_wrap_policy=functools.partial(transformer_auto_wrap_policy,
+                                                  transformer_layer_cls={LlamaDecoderLayer}),
+        device_id=torch.device("cpu"),
+    )
+
+
+TINY_MODEL_FLAGS = [
+    "--model_type=llama_v2", f"--vocab_size={VOCAB_SIZE}", "--hidden_width=32", "--intermediate_size=64",
+    "--num_layers=2", "--num_heads=4", "--num_key_value_heads=4", "--max_context_width=32",
+]
+
+
+def train_args(*flags):
+    """train.py arguments for the tiny model, with `flags` on top."""
+    from unittest import mock
+
+    from model_utils.arguments import parse_args
+
+    with mock.patch("sys.argv", ["train.py", *TINY_MODEL_FLAGS, *flags]):
+        args, _ = parse_args()
+    return args
+
+
+def tiny_training_state(args, rank):
+    """FSDP model, optimizer, LR scheduler and model config, built for `args` like train.py does."""
+    from torch import optim
+
+    from model_utils.train_utils import (create_model, get_learning_rate_scheduler, get_model_config,
+                                         get_param_groups_by_weight_decay, wrap_model_with_fsdp)
+
+    model_config = get_model_config(args)
+    model = wrap_model_with_fsdp(args, create_model(args, model_config, rank), rank)
+    optimizer = optim.AdamW(
+        get_param_groups_by_weight_decay(model), betas=(args.beta1, args.beta2), lr=args.lr,
+        weight_decay=args.weight_decay,
+    )
+    return model, optimizer, get_learning_rate_scheduler(optimizer, args), model_config
+
+
+def train_step(model, optimizer, lr_scheduler, batch):
+    """One optimizer step on `batch` as in train.py; returns the loss."""
+    from model_utils.train_utils import get_model_inputs
+
+    optimizer.zero_grad(set_to_none=True)
+    loss = model(**get_model_inputs(batch, "cpu"))["loss"]
+    loss.backward()
+    optimizer.step()
+    lr_scheduler.step()
+    return loss.item()
+
+
+def full_state(model, optimizer):
+    """Unsharded model and optimizer state dicts, the same on every rank at any world size."""
+    from torch.distributed.fsdp import FullOptimStateDictConfig, FullStateDictConfig, StateDictType
+
+    with FSDP.state_dict_type(model, StateDictType.FULL_STATE_DICT, FullStateDictConfig(rank0_only=False),
+                              FullOptimStateDictConfig(rank0_only=False)):
+        return model.state_dict(), FSDP.optim_state_dict(model, optimizer)
+
+
+def assert_same_state(state, expected):
+    """Compare (model, optimizer) state dicts of `full_state` exactly."""
+    (model_state, optim_state), (expected_model, expected_optim) = state, expected
+    assert model_state.keys() == expected_model.keys()
+    for name, tensor in expected_model.items():
+        assert torch.equal(model_state[name], tensor), name
+    assert optim_state["state"].keys() == expected_optim["state"].keys()
+    for name, param_state in expected_optim["state"].items():
+        assert param_state.keys() == optim_state["state"][name].keys()
+        for key, value in param_state.items():
+            assert torch.equal(torch.as_tensor(optim_state["state"][name][key]), torch.as_tensor(value)), (name, key)
+    assert [group["lr"] for group in optim_state["param_groups"]] == [
+        group["lr"] for group in expected_optim["param_groups"]
+    ]
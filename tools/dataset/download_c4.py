@@ -7,14 +7,22 @@ and development purposes. It supports streaming and local caching.
 """
 
 import argparse
+import functools
+import itertools
+import json
 import os
+import random
 import sys
-import tempfile
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
 from datasets import load_dataset
 from huggingface_hub import login
 import boto3
-from botocore.exceptions import ClientError, NoCredentialsError
+from boto3.exceptions import S3UploadFailedError
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import BotoCoreError, ClientError, NoCredentialsError
 
 
 def setup_hf_token():
@@ -64,16 +72,251 @@ def parse_s3_path(s3_path: str):
     return bucket, key_prefix
 
 
-def upload_to_s3(file_path: str, s3_bucket: str, s3_key: str, s3_client):
-    """Upload file to S3 bucket."""
-    try:
-        print(f"Uploading to S3: s3://{s3_bucket}/{s3_key}")
-        s3_client.upload_file(file_path, s3_bucket, s3_key)
-        print(f"✓ Successfully uploaded to S3")
-        return f"s3://{s3_bucket}/{s3_key}"
-    except ClientError as e:
-        print(f"✗ S3 upload failed: {e}")
-        return None
+def upload_to_s3(file_path: str, s3_bucket: str, s3_key: str, s3_client, transfer_config=None, retries: int = 5):
+    """
+    Upload file to S3 bucket, retrying with exponential backoff.
+
+    The upload only counts as confirmed once the object's size in S3 matches
+    the local file. Returns the S3 URL, or None if all attempts failed.
+    """
+    size = os.path.getsize(file_path)
+    for attempt in range(retries + 1):
+        try:
+            print(f"Uploading to S3: s3://{s3_bucket}/{s3_key} ({size / 1e6:.1f} MB)")
+            s3_client.upload_file(file_path, s3_bucket, s3_key, Config=transfer_config)
+            uploaded_size = s3_client.head_object(Bucket=s3_bucket, Key=s3_key)["ContentLength"]
+            if uploaded_size != size:
+                raise ValueError(f"uploaded object has {uploaded_size} bytes, expected {size}")
+            print(f"✓ Successfully uploaded to S3: s3://{s3_bucket}/{s3_key}")
+            return f"s3://{s3_bucket}/{s3_key}"
+        except (ClientError, BotoCoreError, S3UploadFailedError, OSError, ValueError) as e:
+            if attempt == retries:
+                print(f"✗ S3 upload failed: {e}")
+                return None
+            delay = min(2 ** attempt, 60) * random.uniform(0.5, 1.5)
+            print(f"⚠ S3 upload of {s3_key} failed ({e}), retrying in {delay:.1f}s ({attempt + 1}/{retries})")
+            time.sleep(delay)
+
+
+class S3Uploader:
+    """
+    Upload files to S3 in background threads while the download continues.
+
+    Each file is uploaded as a multipart upload with `concurrency` parts in
+    flight (TransferConfig); up to `num_workers` files are uploaded at once.
+    """
+
+    def __init__(self, s3_client, s3_bucket: str, s3_prefix: str, num_workers: int = 4, concurrency: int = 8,
+                 chunksize_mb: int = 64, retries: int = 5):
+        self.s3_client = s3_client
+        self.s3_bucket = s3_bucket
+        self.s3_prefix = s3_prefix
+        self.retries = retries
+        self.transfer_config = TransferConfig(
+            multipart_threshold=chunksize_mb * 1024 * 1024,
+            multipart_chunksize=chunksize_mb * 1024 * 1024,
+            max_concurrency=concurrency,
+            use_threads=True,
+        )
+        self.executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="s3-upload")
+        self.futures = []
+
+    def key(self, filename: str):
+        return f"{self.s3_prefix}/{filename}" if self.s3_prefix else filename
+
+    def submit(self, file_path: str, on_uploaded=None):
+        """Queue `file_path` for upload; `on_uploaded(s3_url)` runs in the upload thread after a confirmed upload."""
+
+        def upload():
+            s3_url = upload_to_s3(
+                file_path, self.s3_bucket, self.key(Path(file_path).name), self.s3_client,
+                self.transfer_config, self.retries,
+            )
+            if s3_url and on_uploaded:
+                on_uploaded(s3_url)
+            return s3_url
+
+        future = self.executor.submit(upload)
+        self.futures.append(future)
+        return future
+
+    def wait(self):
+        """Wait for all queued uploads, returns their S3 URLs (None for failed ones)."""
+        results = [future.result() for future in self.futures]
+        self.executor.shutdown()
+        return results
+
+
+def write_manifest(manifest_path: Path, objects):
+    """Write the list of uploaded objects (url, size, samples) as JSON."""
+    manifest = {"objects": objects, "total_samples": sum(obj["samples"] for obj in objects)}
+    write_progress(manifest_path, manifest)
+    return manifest
+
+
+def load_c4_shard(index: int, num_shards: int, split: str = "train", streaming: bool = True,
+                  cache_dir: str = None, num_samples: int = None):
+    """Iterate over source shard `index` of `num_shards` of allenai/c4 (en)."""
+    if streaming:
+        dataset = load_dataset("allenai/c4", "en", split=split, streaming=True, cache_dir=cache_dir)
+        return dataset.shard(num_shards=num_shards, index=index)
+    # full download mode: contiguous slices of the first num_samples samples
+    dataset = load_dataset("allenai/c4", "en", split=f"{split}[:{num_samples}]", cache_dir=cache_dir)
+    return dataset.shard(num_shards=num_shards, index=index, contiguous=True)
+
+
+def get_c4_num_shards(split: str = "train", cache_dir: str = None):
+    """Number of source shards (files) of the allenai/c4 (en) split."""
+    return load_dataset("allenai/c4", "en", split=split, streaming=True, cache_dir=cache_dir).n_shards
+
+
+class TextStats:
+    """Count, mean, min and max text length and a preview, in O(1) memory."""
+
+    def __init__(self, state=None):
+        state = state or {}
+        self.count = state.get("count", 0)
+        self.total_length = state.get("total_length", 0)
+        self.min_length = state.get("min_length")
+        self.max_length = state.get("max_length")
+        self.preview = state.get("preview")
+
+    def add(self, text: str):
+        length = len(text)
+        self.count += 1
+        self.total_length += length
+        self.min_length = length if self.min_length is None else min(self.min_length, length)
+        self.max_length = length if self.max_length is None else max(self.max_length, length)
+        if self.preview is None:
+            self.preview = text[:200]
+
+    def merge(self, other: "TextStats"):
+        for length in (other.min_length, other.max_length):
+            if length is not None:
+                self.min_length = length if self.min_length is None else min(self.min_length, length)
+                self.max_length = length if self.max_length is None else max(self.max_length, length)
+        self.count += other.count
+        self.total_length += other.total_length
+        if self.preview is None:
+            self.preview = other.preview
+
+    def state(self):
+        return {
+            "count": self.count,
+            "total_length": self.total_length,
+            "min_length": self.min_length,
+            "max_length": self.max_length,
+            "preview": self.preview,
+        }
+
+
+def read_progress(progress_path: Path):
+    if progress_path.exists():
+        return json.loads(progress_path.read_text(encoding="utf-8"))
+    return None
+
+
+def write_progress(progress_path: Path, progress: dict):
+    # write-then-rename, an interrupted run never leaves a truncated progress file
+    tmp_path = progress_path.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(progress), encoding="utf-8")
+    os.replace(tmp_path, progress_path)
+
+
+COMPRESSION_SUFFIXES = {"none": "", "zstd": ".zst", "gzip": ".gz"}
+
+
+def new_compressor(compression: str):
+    """Compressor for one frame (gzip member) of output, None for plain output."""
+    if compression == "gzip":
+        return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            print("✗ zstd compression requires the zstandard package: pip install zstandard")
+            sys.exit(1)
+        return zstandard.ZstdCompressor(level=3).compressobj()
+    return None
+
+
+def index_part(path: str, tokenizer_names):
+    """Write the FSDP training loader's index sidecar (<file>.index.json) of `path`, see FSDP/src/index_dataset.py."""
+    sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "FSDP" / "src"))
+    from index_dataset import index_file
+    return index_file(path, tokenizer_names)
+
+
+def download_part(output_path: str, progress_path: str, *args, index_tokenizers=(), **kwargs):
+    """`write_part`, then index the finished part for `index_tokenizers` unless that was done before."""
+    progress = write_part(output_path, progress_path, *args, **kwargs)
+    if index_tokenizers and not progress.get("indexed"):
+        print(f"Indexing {Path(output_path).name} for {', '.join(index_tokenizers)}")
+        index_part(output_path, index_tokenizers)
+        progress["indexed"] = True
+        write_progress(Path(progress_path), progress)
+    return progress
+
+
+def write_part(output_path: str, progress_path: str, source_shards, num_source_shards: int, quota: int,
+               load_shard, checkpoint_every: int = 1000, compression: str = "none"):
+    """
+    Write `quota` samples read from `source_shards` (in order) to `output_path`.
+
+    Progress (samples, bytes written, shard and samples read from it) is
+    saved every `checkpoint_every` samples. A rerun truncates the part to
+    the last saved byte offset and continues from the recorded shard position,
+    so nothing is written twice or skipped.
+
+    Compressed output ends a frame at every checkpoint. The file is a
+    sequence of complete zstd frames (gzip members), which readers decode as
+    one stream, so it can be truncated at any checkpoint.
+
+    Returns the final progress.
+    """
+    output_path, progress_path = Path(output_path), Path(progress_path)
+    progress = read_progress(progress_path) or {
+        "samples": 0, "bytes": 0, "shard": 0, "shard_samples": 0, "stats": {}, "done": False,
+    }
+    if progress["done"]:
+        return progress
+    stats = TextStats(progress["stats"])
+    compressor = new_compressor(compression)
+
+    def write(f, data):
+        f.write(compressor.compress(data) if compressor else data)
+
+    def checkpoint(f, done=False):
+        nonlocal compressor
+        if compressor:
+            f.write(compressor.flush())
+            compressor = new_compressor(compression)
+        f.flush()
+        os.fsync(f.fileno())
+        progress.update(bytes=f.tell(), stats=stats.state(), done=done)
+        write_progress(progress_path, progress)
+
+    mode = "r+b" if output_path.exists() else "wb"
+    with open(output_path, mode, buffering=1024 * 1024) as f:
+        f.seek(progress["bytes"])
+        f.truncate()
+        while progress["samples"] < quota and progress["shard"] < len(source_shards):
+            samples = load_shard(source_shards[progress["shard"]], num_source_shards)
+            for sample in itertools.islice(samples, progress["shard_samples"], None):
+                write(f, (json.dumps(sample) + "\n").encode("utf-8"))
+                stats.add(sample["text"])
+                progress["samples"] += 1
+                progress["shard_samples"] += 1
+                if progress["samples"] >= quota:
+                    break
+                if progress["samples"] % checkpoint_every == 0:
+                    checkpoint(f)
+            else:
+                # source shard exhausted, continue with the next one
+                progress["shard"] += 1
+                progress["shard_samples"] = 0
+        checkpoint(f, done=True)
+    return progress
 
 
 def download_c4_subset(
@@ -84,13 +327,29 @@ def download_c4_subset(
     cache_dir: str = None,
     s3_path: str = None,
     cleanup_local: bool = False,
-    max_lines_per_file: int = None
+    max_lines_per_file: int = None,
+    num_parts: int = None,
+    num_workers: int = 4,
+    resume: bool = True,
+    compression: str = "none",
+    upload_workers: int = 4,
+    upload_concurrency: int = 8,
+    upload_retries: int = 5,
+    index_tokenizers=(),
+    filter_options: dict = None,
+    s3_client=None,
+    load_shard=None,
+    num_source_shards: int = None,
 ):
     """
     Download a subset of the C4 dataset.
     
+    Output part files are written concurrently by `num_workers` processes,
+    each streaming its own source shards of the dataset, and record their
+    progress so that rerunning the same command continues where it stopped.
+    
     Args:
-        output_dir: Directory to save the dataset (or temp dir if uploading to S3)
+        output_dir: Directory to save the dataset (parts are staged here when uploading to S3)
         num_samples: Number of samples to download
         split: Dataset split to use ('train', 'validation')
         streaming: Whether to use streaming mode
@@ -98,21 +357,35 @@ def download_c4_subset(
         s3_path: S3 path in format 's3://bucket-name/path' for upload (optional)
         cleanup_local: Whether to delete local file after S3 upload
         max_lines_per_file: Maximum number of lines per JSONL file (splits into multiple files if exceeded)
+        num_parts: Number of output files (default: derived from max_lines_per_file, else 1)
+        num_workers: Number of parts written concurrently
+        resume: Continue from the progress of an earlier, interrupted run
+        compression: Output compression, 'none', 'zstd' (.jsonl.zst) or 'gzip' (.jsonl.gz)
+        upload_workers: Number of files uploaded to S3 at once, in the background
+        upload_concurrency: Number of multipart upload parts in flight per file
+        upload_retries: Number of retries of a failed upload, with exponential backoff
+        index_tokenizers: Write the training loader's index sidecar of every part, with token counts of these tokenizers
+        filter_options: Quality and near-duplicate filter the parts once all are downloaded, with these
+            keyword arguments of filter_dataset.filter_parts ({} for the defaults); the filtered parts are
+            written to output_dir/filtered, and are the ones indexed and uploaded
+        s3_client: S3 client to upload with (default: boto3 client from the environment)
+        load_shard: Callable (shard_index, num_shards) -> iterable of samples; defaults to allenai/c4
+        num_source_shards: Number of source shards `load_shard` accepts (required with `load_shard`)
     """
     print(f"Downloading C4 dataset subset...")
     print(f"  Split: {split}")
     print(f"  Samples: {num_samples}")
     print(f"  Streaming: {streaming}")
+    print(f"  Compression: {compression}")
     
     # Setup S3 client if needed
-    s3_client = None
     s3_bucket = None
     s3_prefix = None
     
     if s3_path:
         try:
             s3_bucket, s3_prefix = parse_s3_path(s3_path)
-            s3_client = setup_s3_client()
+            s3_client = s3_client or setup_s3_client()
             if not s3_client:
                 print("✗ S3 upload requested but AWS credentials not available")
                 sys.exit(1)
@@ -121,294 +394,213 @@ def download_c4_subset(
             print(f"✗ Invalid S3 path: {e}")
             sys.exit(1)
     
-    # Use temp directory if uploading to S3 and cleanup requested
-    if s3_path and cleanup_local:
-        temp_dir = tempfile.mkdtemp()
-        actual_output_dir = temp_dir
-        print(f"  Using temp directory: {actual_output_dir}")
+    if num_parts is None:
+        num_parts = -(-num_samples // max_lines_per_file) if max_lines_per_file else 1
+    num_parts = max(1, min(num_parts, num_samples))
+    # fails here rather than in the workers if the compression library is missing
+    new_compressor(compression)
+    suffix = ".jsonl" + COMPRESSION_SUFFIXES[compression]
+    if num_parts > 1:
+        filenames = [f"c4_{split}_{num_samples}_part{part:03d}{suffix}" for part in range(1, num_parts + 1)]
     else:
-        actual_output_dir = output_dir
-        print(f"  Output: {actual_output_dir}")
-        # Create output directory
-        Path(actual_output_dir).mkdir(parents=True, exist_ok=True)
+        filenames = [f"c4_{split}_{num_samples}{suffix}"]
+    # the first num_samples % num_parts parts get one more sample
+    quotas = [num_samples // num_parts + (part < num_samples % num_parts) for part in range(num_parts)]
     
-    try:
-        import json
-        
-        # Always use streaming for small subsets to avoid downloading large files
-        if num_samples <= 10000 or streaming:
-            print("Loading dataset in streaming mode...")
-            dataset = load_dataset(
-                "allenai/c4",
-                "en",
-                split=split,
-                streaming=True,
-                cache_dir=cache_dir
-            )
-            
-            # Stream and write data directly to files
-            print(f"Streaming {num_samples} samples...")
-            
-            # Initialize tracking variables
-            output_paths = []
-            s3_urls = []
-            current_file = None
-            current_file_path = None
-            samples_in_current_file = 0
-            file_idx = 0
-            total_samples = 0
-            text_lengths = []
-            first_sample_text = None
-            
-            # Determine if we need multiple files
-            lines_per_file = max_lines_per_file if max_lines_per_file else num_samples
-            
-            for i, sample in enumerate(dataset):
-                if i >= num_samples:
-                    break
-                
-                # Track first sample for statistics
-                if first_sample_text is None:
-                    first_sample_text = sample['text']
-                text_lengths.append(len(sample['text']))
-                
-                # Check if we need to start a new file
-                if current_file is None or (max_lines_per_file and samples_in_current_file >= max_lines_per_file):
-                    # Close and upload previous file if it exists
-                    if current_file is not None:
-                        current_file.close()
-                        
-                        # Upload to S3 immediately if requested
-                        if s3_path and s3_client:
-                            s3_key = f"{s3_prefix}/{current_file_path.name}" if s3_prefix else current_file_path.name
-                            s3_url = upload_to_s3(str(current_file_path), s3_bucket, s3_key, s3_client)
-                            if s3_url:
-                                s3_urls.append(s3_url)
-                                
-                                # Clean up local file immediately after successful upload
-                                if cleanup_local:
-                                    print(f"Cleaning up local file: {current_file_path}")
-                                    current_file_path.unlink()
-                                else:
-                                    output_paths.append(str(current_file_path))
-                            else:
-                                # Keep local file if S3 upload failed
-                                output_paths.append(str(current_file_path))
-                        else:
-                            # No S3 upload, keep local file
-                            output_paths.append(str(current_file_path))
-                    
-                    # Start new file
-                    file_idx += 1
-                    if max_lines_per_file and num_samples > max_lines_per_file:
-                        filename = f"c4_{split}_{num_samples}_part{file_idx:03d}.jsonl"
-                        print(f"Starting part {file_idx} - {filename}")
-                    else:
-                        filename = f"c4_{split}_{num_samples}.jsonl"
-                        print(f"Writing to {filename}")
-                    
-                    current_file_path = Path(actual_output_dir) / filename
-                    current_file = open(current_file_path, 'w', encoding='utf-8')
-                    samples_in_current_file = 0
-                
-                # Write sample to current file
-                current_file.write(json.dumps(sample) + '\n')
-                samples_in_current_file += 1
-                total_samples += 1
-                
-                # Progress reporting
-                if num_samples <= 100:
-                    print(f"  Downloaded {total_samples}/{num_samples} samples")
-                elif total_samples % 100 == 0:
-                    print(f"  Downloaded {total_samples}/{num_samples} samples")
-            
-            # Close and upload the final file
-            if current_file is not None:
-                current_file.close()
-                
-                # Upload to S3 immediately if requested
-                if s3_path and s3_client:
-                    s3_key = f"{s3_prefix}/{current_file_path.name}" if s3_prefix else current_file_path.name
-                    s3_url = upload_to_s3(str(current_file_path), s3_bucket, s3_key, s3_client)
-                    if s3_url:
-                        s3_urls.append(s3_url)
-                        
-                        # Clean up local file immediately after successful upload
-                        if cleanup_local:
-                            print(f"Cleaning up local file: {current_file_path}")
-                            current_file_path.unlink()
-                        else:
-                            output_paths.append(str(current_file_path))
-                    else:
-                        # Keep local file if S3 upload failed
-                        output_paths.append(str(current_file_path))
-                else:
-                    # No S3 upload, keep local file
-                    output_paths.append(str(current_file_path))
-            
-            print(f"✓ Successfully streamed {total_samples} samples")
-            
-            # Show results based on what's available
-            if s3_path and s3_urls:
-                print(f"✓ Uploaded to S3: {len(s3_urls)} files")
-                for s3_url in s3_urls:
-                    print(f"    {s3_url}")
-            
-            if output_paths:
-                print(f"✓ Local files: {len(output_paths)} files")
-                for path in output_paths:
-                    print(f"    {path}")
-            
-            # Print sample statistics
-            if total_samples > 0:
-                avg_length = sum(text_lengths) / len(text_lengths)
-                print(f"\nDataset Statistics:")
-                print(f"  Total samples: {total_samples}")
-                print(f"  Files created: {file_idx}")
-                if max_lines_per_file:
-                    print(f"  Max lines per file: {max_lines_per_file}")
-                print(f"  Average text length: {avg_length:.0f} characters")
-                print(f"  Sample text preview: {first_sample_text[:200]}...")
-            
-            # Clean up temp directory if used and all files were uploaded
-            if s3_path and cleanup_local and actual_output_dir != output_dir and len(s3_urls) == file_idx:
-                import shutil
-                shutil.rmtree(actual_output_dir)
-                print(f"✓ Temp directory cleaned up")
-            
-            # Return S3 URLs if available, otherwise local paths
-            return s3_urls if s3_urls else output_paths
-            
+    if load_shard is None:
+        if streaming:
+            num_source_shards = get_c4_num_shards(split, cache_dir)
         else:
-            print("Loading dataset (full download mode)...")
             print("Warning: This will download large files. Consider using --streaming flag.")
-            dataset = load_dataset(
-                "allenai/c4",
-                "en",
-                split=f"{split}[:{num_samples}]",
-                cache_dir=cache_dir
-            )
+            num_source_shards = num_parts
+        load_shard = functools.partial(
+            load_c4_shard, split=split, streaming=streaming, cache_dir=cache_dir, num_samples=num_samples
+        )
+    elif num_source_shards is None:
+        raise ValueError("num_source_shards is required with load_shard")
+    # part i reads source shards i, i + num_parts, ...; extra shards are only read if earlier ones run out
+    source_shards = [list(range(part, num_source_shards, num_parts)) for part in range(num_parts)]
+    if num_source_shards < num_parts:
+        source_shards = [[part % num_source_shards] for part in range(num_parts)]
+        print(f"Warning: only {num_source_shards} source shards for {num_parts} parts, parts will overlap")
+    
+    output_dir = Path(output_dir)
+    progress_dir = output_dir / ".download_progress"
+    progress_dir.mkdir(parents=True, exist_ok=True)
+    print(f"  Output: {output_dir} ({num_parts} parts, {num_workers} workers)")
+    
+    config = {
+        "split": split, "num_samples": num_samples, "num_parts": num_parts, "streaming": streaming,
+        "compression": compression,
+    }
+    # no part is named like this, their progress files are <part filename>.json
+    config_path = progress_dir / "download_config.json"
+    if not resume:
+        for filename in filenames:
+            for path in (output_dir / filename, output_dir / f"{filename}.index.json", progress_dir / f"{filename}.json"):
+                if path.exists():
+                    path.unlink()
+    elif read_progress(config_path) not in (None, config):
+        print(f"✗ {output_dir} holds progress of a download with other settings: {read_progress(config_path)}")
+        print("  Rerun with the same settings, or with --no-resume to start over")
+        sys.exit(1)
+    write_progress(config_path, config)
+    
+    uploader = None
+    if s3_path:
+        uploader = S3Uploader(
+            s3_client, s3_bucket, s3_prefix, num_workers=upload_workers, concurrency=upload_concurrency,
+            retries=upload_retries,
+        )
+    
+    def queue_upload(filename, progress_path, progress, source_dir=output_dir, samples=None):
+        output_path = source_dir / filename
+        size = output_path.stat().st_size
+        index_path = source_dir / f"{filename}.index.json"
+        if index_path.exists():
+            # the index goes next to its part; it is small, so it is kept locally
+            uploader.submit(str(index_path))
+        
+        def on_uploaded(s3_url):
+            progress.update(uploaded=s3_url, size=size)
+            if samples is not None:
+                progress["uploaded_samples"] = samples
+            write_progress(progress_path, progress)
+            # Clean up local file only after a confirmed upload
+            if cleanup_local:
+                print(f"Cleaning up local file: {output_path}")
+                output_path.unlink()
+        
+        uploader.submit(str(output_path), on_uploaded)
+    
+    part_stats = [TextStats() for _ in filenames]
+    total_samples = 0
+    try:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            futures = {}
+            for part, filename in enumerate(filenames):
+                progress_path = progress_dir / f"{filename}.json"
+                progress = read_progress(progress_path)
+                if progress and progress.get("uploaded"):
+                    # finished and uploaded by an earlier run
+                    part_stats[part] = TextStats(progress["stats"])
+                    total_samples += progress["samples"]
+                    continue
+                if progress and progress["samples"]:
+                    print(f"Resuming {filename} at {progress['samples']}/{quotas[part]} samples")
+                future = executor.submit(
+                    download_part, str(output_dir / filename), str(progress_path), source_shards[part],
+                    num_source_shards, quotas[part], load_shard, compression=compression,
+                    # with filtering, the filtered parts are indexed instead
+                    index_tokenizers=() if filter_options is not None else index_tokenizers,
+                )
+                futures[future] = (part, filename, progress_path)
             
-            # For non-streaming mode, use the original approach
-            if max_lines_per_file and len(dataset) > max_lines_per_file:
-                # Split into multiple files
-                num_files = (len(dataset) + max_lines_per_file - 1) // max_lines_per_file
-                print(f"Splitting {len(dataset)} samples into {num_files} files (max {max_lines_per_file} lines per file)...")
-                
-                output_paths = []
-                s3_urls = []
-                
-                for file_idx in range(num_files):
-                    start_idx = file_idx * max_lines_per_file
-                    end_idx = min((file_idx + 1) * max_lines_per_file, len(dataset))
-                    
-                    filename = f"c4_{split}_{num_samples}_part{file_idx + 1:03d}.jsonl"
-                    output_path = Path(actual_output_dir) / filename
-                    
-                    print(f"Saving part {file_idx + 1}/{num_files} to {output_path} (samples {start_idx + 1}-{end_idx})...")
-                    
-                    with open(output_path, 'w', encoding='utf-8') as f:
-                        for i in range(start_idx, end_idx):
-                            f.write(json.dumps(dataset[i]) + '\n')
-                    
-                    # Upload to S3 immediately if requested
-                    if s3_path and s3_client:
-                        s3_key = f"{s3_prefix}/{filename}" if s3_prefix else filename
-                        s3_url = upload_to_s3(str(output_path), s3_bucket, s3_key, s3_client)
-                        if s3_url:
-                            s3_urls.append(s3_url)
-                            
-                            # Clean up local file immediately after successful upload
-                            if cleanup_local:
-                                print(f"Cleaning up local file: {output_path}")
-                                output_path.unlink()
-                            else:
-                                output_paths.append(str(output_path))
-                        else:
-                            # Keep local file if S3 upload failed
-                            output_paths.append(str(output_path))
-                    else:
-                        # No S3 upload, keep local file
-                        output_paths.append(str(output_path))
-                
-                print(f"✓ Successfully downloaded {len(dataset)} samples")
-                
-                # Show results based on what's available
-                if s3_path and s3_urls:
-                    print(f"✓ Uploaded to S3: {len(s3_urls)} files")
-                    for s3_url in s3_urls:
-                        print(f"    {s3_url}")
-                
-                if output_paths:
-                    print(f"✓ Local files: {len(output_paths)} files")
-                    for path in output_paths:
-                        print(f"    {path}")
-                
-                # Print sample statistics
-                if len(dataset) > 0:
-                    sample_text = dataset[0]['text']
-                    avg_length = sum(len(sample['text']) for sample in dataset) / len(dataset)
-                    print(f"\nDataset Statistics:")
-                    print(f"  Total samples: {len(dataset)}")
-                    print(f"  Files created: {num_files}")
-                    print(f"  Max lines per file: {max_lines_per_file}")
-                    print(f"  Average text length: {avg_length:.0f} characters")
-                    print(f"  Sample text preview: {sample_text[:200]}...")
-                
-                # Clean up temp directory if used and all files were uploaded
-                if s3_path and cleanup_local and actual_output_dir != output_dir and len(s3_urls) == num_files:
-                    import shutil
-                    shutil.rmtree(actual_output_dir)
-                    print(f"✓ Temp directory cleaned up")
-                
-                # Return S3 URLs if available, otherwise local paths
-                return s3_urls if s3_urls else output_paths
+            for future in as_completed(futures):
+                part, filename, progress_path = futures[future]
+                progress = future.result()
+                part_stats[part] = TextStats(progress["stats"])
+                total_samples += progress["samples"]
+                print(f"  Completed {filename}: {progress['samples']} samples ({total_samples}/{num_samples} total)")
                 
-            else:
-                # Single file output
-                filename = f"c4_{split}_{num_samples}.jsonl"
-                output_path = Path(actual_output_dir) / filename
-                print(f"Saving dataset to {output_path}...")
-                
-                # Save as JSONL format
-                with open(output_path, 'w', encoding='utf-8') as f:
-                    for sample in dataset:
-                        f.write(json.dumps(sample) + '\n')
-                
-                print(f"✓ Successfully downloaded {len(dataset)} samples")
-                print(f"✓ Saved to: {output_path}")
-                
-                # Upload to S3 immediately if requested
-                s3_url = None
-                if s3_path and s3_client:
-                    s3_key = f"{s3_prefix}/{filename}" if s3_prefix else filename
-                    s3_url = upload_to_s3(str(output_path), s3_bucket, s3_key, s3_client)
-                    
-                    # Clean up local file immediately after successful upload
-                    if cleanup_local and s3_url:
-                        print(f"Cleaning up local file: {output_path}")
-                        output_path.unlink()
-                        if s3_path and cleanup_local and actual_output_dir != output_dir:
-                            # Remove temp directory
-                            import shutil
-                            shutil.rmtree(actual_output_dir)
-                            print(f"✓ Temp directory cleaned up")
-                
-                # Print sample statistics
-                if len(dataset) > 0:
-                    sample_text = dataset[0]['text']
-                    avg_length = sum(len(sample['text']) for sample in dataset) / len(dataset)
-                    print(f"\nDataset Statistics:")
-                    print(f"  Total samples: {len(dataset)}")
-                    print(f"  Average text length: {avg_length:.0f} characters")
-                    print(f"  Sample text preview: {sample_text[:200]}...")
-                
-                # Return S3 URL if available, otherwise local path
-                return s3_url if s3_url else str(output_path)
-        
+                # Upload to S3 in the background as soon as the part is complete, if requested
+                if uploader and filter_options is None:
+                    queue_upload(filename, progress_path, progress)
     except Exception as e:
         print(f"✗ Error downloading dataset: {e}")
+        if uploader:
+            print("  Waiting for queued S3 uploads to finish...")
+            uploader.wait()
+        print("  Rerun the same command to continue from the saved progress")
         sys.exit(1)
+    
+    filtered_dir = output_dir / "filtered"
+    if filter_options is not None:
+        # near-duplicates are found across all parts, so filtering waits for the whole download
+        progresses = [read_progress(progress_dir / f"{filename}.json") for filename in filenames]
+        if all(progress.get("uploaded") for progress in progresses):
+            print("All filtered parts were uploaded by an earlier run")
+        else:
+            from filter_dataset import filter_parts
+            
+            report = filter_parts(
+                [output_dir / filename for filename in filenames], filtered_dir, num_workers=num_workers,
+                **filter_options,
+            )
+            if index_tokenizers:
+                print(f"Indexing filtered parts for {', '.join(index_tokenizers)}")
+                with ProcessPoolExecutor(max_workers=num_workers) as executor:
+                    list(executor.map(
+                        index_part, [str(filtered_dir / filename) for filename in filenames],
+                        itertools.repeat(index_tokenizers),
+                    ))
+            if uploader:
+                for filename, progress, part_report in zip(filenames, progresses, report["parts"]):
+                    if not progress.get("uploaded"):
+                        queue_upload(filename, progress_dir / f"{filename}.json", progress, filtered_dir,
+                                     part_report["kept"])
+    
+    s3_urls = []
+    if uploader:
+        print("Waiting for S3 uploads to finish...")
+        uploader.wait()
+        objects = []
+        for filename in filenames:
+            progress = read_progress(progress_dir / f"{filename}.json")
+            if progress.get("uploaded"):
+                s3_urls.append(progress["uploaded"])
+                objects.append({
+                    "url": progress["uploaded"], "size": progress["size"],
+                    "samples": progress.get("uploaded_samples", progress["samples"]),
+                })
+        manifest_path = output_dir / f"c4_{split}_{num_samples}_manifest.json"
+        manifest = write_manifest(manifest_path, objects)
+        if len(objects) == num_parts:
+            upload_to_s3(str(manifest_path), s3_bucket, uploader.key(manifest_path.name), s3_client, retries=upload_retries)
+            print(f"✓ Manifest of {len(objects)} objects ({manifest['total_samples']} samples): {manifest_path}")
+            if filter_options is not None and cleanup_local:
+                # raw parts are kept until then, as a rerun filters all of them again
+                for filename in filenames:
+                    if (output_dir / filename).exists():
+                        (output_dir / filename).unlink()
+        else:
+            print(f"✗ {num_parts - len(objects)} of {num_parts} files failed to upload, they are kept locally")
+            print("  Rerun the same command to retry the upload")
+    local_dir = filtered_dir if filter_options is not None else output_dir
+    output_paths = [str(local_dir / filename) for filename in filenames if (local_dir / filename).exists()]
+    
+    print(f"✓ Successfully downloaded {total_samples} samples")
+    if total_samples < num_samples:
+        print(f"⚠ The source ran out of samples, {num_samples - total_samples} fewer than requested")
+    
+    # Show results based on what's available
+    if s3_urls:
+        print(f"✓ Uploaded to S3: {len(s3_urls)} files")
+        for s3_url in s3_urls:
+            print(f"    {s3_url}")
+    
+    if output_paths:
+        print(f"✓ Local files: {len(output_paths)} files")
+        for path in output_paths:
+            print(f"    {path}")
+    
+    # Print sample statistics, merged in part order
+    stats = TextStats()
+    for part_stat in part_stats:
+        stats.merge(part_stat)
+    if stats.count > 0:
+        print(f"\nDataset Statistics:")
+        print(f"  Total samples: {stats.count}")
+        print(f"  Files created: {num_parts}")
+        if max_lines_per_file:
+            print(f"  Max lines per file: {max_lines_per_file}")
+        print(f"  Average text length: {stats.total_length / stats.count:.0f} characters")
+        print(f"  Text length range: {stats.min_length}-{stats.max_length} characters")
+        print(f"  Sample text preview: {stats.preview}...")
+    
+    # Return S3 URLs if available, otherwise local paths (a single path for a single file)
+    results = sorted(s3_urls) if s3_urls else sorted(output_paths)
+    return results if num_parts > 1 else results[0]
 
 
 def main():
@@ -481,6 +673,76 @@ def main():
         help="Maximum number of lines per JSONL file (splits into multiple files if exceeded)"
     )
     
+    parser.add_argument(
+        "--num-parts",
+        type=int,
+        help="Number of output JSONL files (default: num-samples / max-lines-per-file, else 1)"
+    )
+    
+    parser.add_argument(
+        "--num-workers",
+        type=int,
+        default=4,
+        help="Number of output files written concurrently, each from its own source shards"
+    )
+    
+    parser.add_argument(
+        "--compression",
+        type=str,
+        default="none",
+        choices=sorted(COMPRESSION_SUFFIXES),
+        help="Compress the output files (.jsonl.zst or .jsonl.gz); the training loader reads them directly"
+    )
+    
+    parser.add_argument(
+        "--upload-workers",
+        type=int,
+        default=4,
+        help="Number of files uploaded to S3 at once, in the background while downloading"
+    )
+    
+    parser.add_argument(
+        "--upload-concurrency",
+        type=int,
+        default=8,
+        help="Number of multipart upload parts in flight per file"
+    )
+    
+    parser.add_argument(
+        "--upload-retries",
+        type=int,
+        default=5,
+        help="Number of retries of a failed S3 upload, with exponential backoff"
+    )
+    
+    parser.add_argument(
+        "--index-tokenizer",
+        type=str,
+        nargs="+",
+        help="Write an index sidecar (<file>.index.json) of every output file with token counts of these "
+             "tokenizers, used by the FSDP training loader (see FSDP/src/index_dataset.py)"
+    )
+    
+    parser.add_argument(
+        "--filter",
+        action="store_true",
+        help="Drop low-quality documents and near-duplicates across all parts once they are downloaded, "
+             "and upload the filtered parts from <output-dir>/filtered (see filter_dataset.py)"
+    )
+    
+    parser.add_argument(
+        "--filter-threshold",
+        type=float,
+        default=0.8,
+        help="Estimated Jaccard similarity from which documents are near-duplicates, with --filter"
+    )
+    
+    parser.add_argument(
+        "--no-resume",
+        action="store_true",
+        help="Start over instead of continuing an interrupted download in the output directory"
+    )
+    
     args = parser.parse_args()
     
     # Determine streaming mode
@@ -510,7 +772,16 @@ def main():
         cache_dir=args.cache_dir,
         s3_path=args.s3_path,
         cleanup_local=cleanup_mode,
-        max_lines_per_file=args.max_lines_per_file
+        max_lines_per_file=args.max_lines_per_file,
+        num_parts=args.num_parts,
+        num_workers=args.num_workers,
+        resume=not args.no_resume,
+        compression=args.compression,
+        upload_workers=args.upload_workers,
+        upload_concurrency=args.upload_concurrency,
+        upload_retries=args.upload_retries,
+        index_tokenizers=args.index_tokenizer or (),
+        filter_options={"threshold": args.filter_threshold} if args.filter else None,
     )
     
     print(f"\n✓ Dataset available at: {result}")
@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+"""
+Remove near-duplicate and low-quality documents from JSONL dataset parts.
+
+Runs in three passes over the parts, each part in its own worker process:
+
+1. Quality heuristics (length, word statistics, repeated lines) and a
+   MinHash signature of every document; signatures and their LSH band
+   hashes are written to a work directory, not kept in memory.
+2. Near-duplicate detection: documents sharing an LSH band hash are
+   candidates, and candidates whose estimated Jaccard similarity reaches
+   the threshold are clustered. The first document of a cluster is kept.
+   Bands are processed one at a time from memory-mapped files, so memory
+   grows with the number of documents, not with the size of the text.
+3. The kept documents of every part are written to the output directory
+   under the same name and compression, plus a JSON report.
+"""
+
+import argparse
+import functools
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import sys
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+# MinHash permutations h(x) = (a * x + b) mod p of 32-bit shingle hashes; with a, b, x < p < 2^32,
+# a * x + b fits in uint64
+MINHASH_PRIME = 4294967291
+
+QUALITY_DEFAULTS = {
+    "min_chars": 200,
+    "max_chars": 100000,
+    "min_words": 50,
+    "max_mean_word_length": 10.0,
+    "min_alpha_word_ratio": 0.8,
+    "max_duplicate_line_ratio": 0.3,
+}
+
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def open_text(path: str):
+    """Open a plain, .gz or .zst JSONL file for reading text."""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    if path.endswith(".zst"):
+        import zstandard
+        raw = open(path, "rb")
+        reader = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True, closefd=True)
+        return io.TextIOWrapper(io.BufferedReader(reader, 4 * 1024 * 1024), encoding="utf-8")
+    return open(path, "r", encoding="utf-8", buffering=4 * 1024 * 1024)
+
+
+def open_output(path: str):
+    """Open a plain, .gz or .zst JSONL file for writing text."""
+    if path.endswith(".gz"):
+        return gzip.open(path, "wt", encoding="utf-8", compresslevel=6)
+    if path.endswith(".zst"):
+        import zstandard
+        writer = zstandard.ZstdCompressor(level=3).stream_writer(open(path, "wb"), closefd=True)
+        return io.TextIOWrapper(writer, encoding="utf-8")
+    return open(path, "w", encoding="utf-8", buffering=4 * 1024 * 1024)
+
+
+def quality_issue(text: str, options: dict):
+    """Name of the first quality rule `text` fails, or None."""
+    if len(text) < options["min_chars"]:
+        return "too_short"
+    if len(text) > options["max_chars"]:
+        return "too_long"
+    words = text.split()
+    if len(words) < options["min_words"]:
+        return "too_few_words"
+    if sum(len(word) for word in words) / len(words) > options["max_mean_word_length"]:
+        return "long_words"
+    if sum(any(c.isalpha() for c in word) for word in words) / len(words) < options["min_alpha_word_ratio"]:
+        return "few_alpha_words"
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if lines and 1 - len(set(lines)) / len(lines) > options["max_duplicate_line_ratio"]:
+        return "repeated_lines"
+    return None
+
+
+def minhash_permutations(num_perm: int, seed: int = 1):
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, MINHASH_PRIME, num_perm, dtype=np.uint64)
+    b = rng.integers(0, MINHASH_PRIME, num_perm, dtype=np.uint64)
+    return a, b
+
+
+def minhash(text: str, a, b, ngram: int = 5):
+    """MinHash signature (uint32, one value per permutation) of the word n-grams of `text`."""
+    words = WORD_RE.findall(text.lower())
+    shingles = {" ".join(words[i:i + ngram]) for i in range(max(len(words) - ngram + 1, 1))}
+    hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+    hashes %= np.uint64(MINHASH_PRIME)
+    values = (hashes[:, None] * a[None, :] + b[None, :]) % np.uint64(MINHASH_PRIME)
+    return values.min(axis=0).astype(np.uint32)
+
+
+def band_hashes(signature, bands: int):
+    rows = len(signature) // bands
+    return np.array(
+        [int.from_bytes(hashlib.blake2b(signature[i * rows:(i + 1) * rows].tobytes(), digest_size=8).digest(), "little")
+         for i in range(bands)],
+        dtype=np.uint64,
+    )
+
+
+STATUS_OK = 0
+STATUS_DUPLICATE = 254
+STATUS_UNREADABLE = 255
+QUALITY_RULES = ["too_short", "too_long", "too_few_words", "long_words", "few_alpha_words", "repeated_lines"]
+
+
+def read_documents(path: str):
+    """Yield the text of every line of `path`, None for lines without a usable `text` field."""
+    with open_text(path) as f:
+        for line in f:
+            try:
+                text = json.loads(line).get("text") if line.strip() else None
+            except (json.JSONDecodeError, AttributeError):
+                text = None
+            yield text if isinstance(text, str) else None
+
+
+def scan_part(part: int, path: str, work_dir: str, quality: dict, num_perm: int, bands: int, ngram: int):
+    """Pass 1: write the status, MinHash signature and band hashes of every line of `path` to `work_dir`."""
+    a, b = minhash_permutations(num_perm)
+    work = Path(work_dir)
+    empty_signature = np.zeros(num_perm, dtype=np.uint32)
+    empty_bands = np.zeros(bands, dtype=np.uint64)
+    lines = chars = 0
+    with open(work / f"part{part}.status.bin", "wb") as status_f, \
+            open(work / f"part{part}.sig.bin", "wb", buffering=4 * 1024 * 1024) as sig_f, \
+            open(work / f"part{part}.bands.bin", "wb", buffering=1024 * 1024) as bands_f:
+        for text in read_documents(path):
+            lines += 1
+            if text is None:
+                status = STATUS_UNREADABLE
+            else:
+                chars += len(text)
+                issue = quality_issue(text, quality)
+                status = QUALITY_RULES.index(issue) + 1 if issue else STATUS_OK
+            if status == STATUS_OK:
+                signature = minhash(text, a, b, ngram)
+                sig_f.write(signature.tobytes())
+                bands_f.write(band_hashes(signature, bands).tobytes())
+            else:
+                sig_f.write(empty_signature.tobytes())
+                bands_f.write(empty_bands.tobytes())
+            status_f.write(bytes([status]))
+    return {"lines": lines, "chars": chars}
+
+
+def find_duplicates(work_dir: str, num_parts: int, num_perm: int, bands: int, threshold: float):
+    """
+    Pass 2: mark near-duplicates in the status files of `work_dir`.
+
+    Documents with equal hashes in any band are candidates; a candidate is a
+    duplicate of the first document of its bucket if their signatures agree
+    on at least `threshold` of the permutations (estimated Jaccard similarity).
+    Returns the number of duplicate clusters.
+    """
+    work = Path(work_dir)
+    statuses = [np.fromfile(work / f"part{part}.status.bin", dtype=np.uint8) for part in range(num_parts)]
+    sizes = [len(status) for status in statuses]
+    offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+    status = np.concatenate(statuses) if statuses else np.zeros(0, dtype=np.uint8)
+    signatures = [
+        np.memmap(work / f"part{part}.sig.bin", dtype=np.uint32, mode="r", shape=(size, num_perm)) if size else None
+        for part, size in enumerate(sizes)
+    ]
+    ok = np.flatnonzero(status == STATUS_OK)
+    if not len(ok):
+        # e.g. empty parts when the source ran out, nothing to compare
+        return 0
+    parent = np.arange(len(status), dtype=np.int64)
+
+    def find(x):
+        root = x
+        while parent[root] != root:
+            root = parent[root]
+        while parent[x] != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    def signature(doc):
+        part = int(np.searchsorted(offsets, doc, side="right")) - 1
+        return signatures[part][doc - offsets[part]]
+
+    for band in range(bands):
+        # one band of all documents at a time
+        column = np.concatenate([
+            np.memmap(work / f"part{part}.bands.bin", dtype=np.uint64, mode="r", shape=(size, bands))[:, band]
+            for part, size in enumerate(sizes) if size
+        ])[ok]
+        order = np.argsort(column, kind="stable")
+        hashes, docs = column[order], ok[order]
+        new_bucket = np.concatenate([[True], hashes[1:] != hashes[:-1]])
+        first = np.maximum.accumulate(np.where(new_bucket, np.arange(len(docs)), 0))
+        for i in np.flatnonzero(~new_bucket):
+            keep, dup = int(docs[first[i]]), int(docs[i])
+            root_keep, root_dup = find(keep), find(dup)
+            if root_keep == root_dup:
+                continue
+            if np.mean(signature(keep) == signature(dup)) >= threshold:
+                # the earliest document of a cluster is kept
+                parent[max(root_keep, root_dup)] = min(root_keep, root_dup)
+
+    roots = np.array([find(doc) for doc in ok], dtype=np.int64)
+    duplicates = ok[roots != ok]
+    status[duplicates] = STATUS_DUPLICATE
+    for part in range(num_parts):
+        status[offsets[part]:offsets[part + 1]].tofile(work / f"part{part}.status.bin")
+    return len(np.unique(roots[roots != ok]))
+
+
+def write_filtered_part(part: int, path: str, output_path: str, work_dir: str):
+    """Pass 3: copy the kept lines of `path` to `output_path`; returns per-status line counts."""
+    status = np.fromfile(Path(work_dir) / f"part{part}.status.bin", dtype=np.uint8)
+    counts = np.bincount(status, minlength=256)
+    kept_chars = 0
+    # hidden, and with the suffix that selects the compression
+    tmp_path = os.path.join(os.path.dirname(output_path), f".tmp-{os.path.basename(output_path)}")
+    with open_text(path) as src, open_output(tmp_path) as dst:
+        for line, line_status in zip(src, status):
+            if line_status == STATUS_OK:
+                dst.write(line if line.endswith("\n") else line + "\n")
+                kept_chars += len(json.loads(line)["text"])
+    os.replace(tmp_path, output_path)
+    result = {rule: int(counts[i + 1]) for i, rule in enumerate(QUALITY_RULES)}
+    result.update(
+        kept=int(counts[STATUS_OK]), duplicates=int(counts[STATUS_DUPLICATE]),
+        unreadable=int(counts[STATUS_UNREADABLE]), kept_chars=kept_chars,
+    )
+    return result
+
+
+def filter_parts(
+    paths,
+    output_dir: str,
+    num_workers: int = 4,
+    num_perm: int = 128,
+    bands: int = 16,
+    ngram: int = 5,
+    threshold: float = 0.8,
+    quality: dict = None,
+    work_dir: str = None,
+):
+    """
+    Filter the JSONL files `paths` into `output_dir` (same file names) and write filter_report.json there.
+
+    Args:
+        paths: Input files (.jsonl, .jsonl.gz or .jsonl.zst)
+        output_dir: Directory for the filtered files and the report
+        num_workers: Number of parts processed at once
+        num_perm: MinHash permutations per document
+        bands: LSH bands (num_perm / bands rows each); more bands find less similar candidates
+        ngram: Words per shingle
+        threshold: Estimated Jaccard similarity from which documents are duplicates
+        quality: Overrides of QUALITY_DEFAULTS
+        work_dir: Directory for signatures and band hashes (default: output_dir/.filter_work, removed at the end)
+    """
+    if num_perm % bands:
+        raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+    paths = [str(path) for path in paths]
+    quality = {**QUALITY_DEFAULTS, **(quality or {})}
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    work = Path(work_dir) if work_dir else output_dir / ".filter_work"
+    work.mkdir(parents=True, exist_ok=True)
+    print(f"Filtering {len(paths)} files into {output_dir} ({num_workers} workers)")
+    print(f"  MinHash: {num_perm} permutations, {bands} bands, {ngram}-word shingles, threshold {threshold}")
+
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        scan = functools.partial(
+            scan_part, work_dir=str(work), quality=quality, num_perm=num_perm, bands=bands, ngram=ngram
+        )
+        scanned = list(executor.map(scan, range(len(paths)), paths))
+        print(f"✓ Scanned {sum(part['lines'] for part in scanned)} documents")
+
+        clusters = find_duplicates(str(work), len(paths), num_perm, bands, threshold)
+        print(f"✓ Found {clusters} clusters of near-duplicates")
+
+        output_paths = [str(output_dir / Path(path).name) for path in paths]
+        written = list(executor.map(write_filtered_part, range(len(paths)), paths, output_paths, [str(work)] * len(paths)))
+
+    parts = []
+    for path, output_path, scan_result, write_result in zip(paths, output_paths, scanned, written):
+        parts.append({"input": path, "output": output_path, "documents": scan_result["lines"],
+                      "chars": scan_result["chars"], **write_result})
+    total = {
+        key: sum(part[key] for part in parts)
+        for key in ["documents", "chars", "kept", "kept_chars", "duplicates", "unreadable", *QUALITY_RULES]
+    }
+    total["duplicate_clusters"] = clusters
+    report = {
+        "options": {"num_perm": num_perm, "bands": bands, "ngram": ngram, "threshold": threshold, **quality},
+        "total": total,
+        "parts": parts,
+    }
+    with open(output_dir / "filter_report.json", "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    if not work_dir:
+        shutil.rmtree(work)
+
+    documents = max(total["documents"], 1)
+    print(f"✓ Kept {total['kept']}/{total['documents']} documents "
+          f"({100 * total['kept'] / documents:.1f}%, {100 * total['kept_chars'] / max(total['chars'], 1):.1f}% of text)")
+    print(f"  Near-duplicates: {total['duplicates']} in {clusters} clusters")
+    for rule in QUALITY_RULES:
+        if total[rule]:
+            print(f"  {rule}: {total[rule]}")
+    if total["unreadable"]:
+        print(f"  unreadable lines: {total['unreadable']}")
+    print(f"  Report: {output_dir / 'filter_report.json'}")
+    return report
+
+
+def get_input_files(input_dir: str):
+    return sorted(
+        str(path) for path in Path(input_dir).iterdir()
+        if path.name.endswith((".jsonl", ".jsonl.gz", ".jsonl.zst"))
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Remove near-duplicate (MinHash/LSH) and low-quality documents from JSONL files",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    
+    parser.add_argument("--input-dir", type=str, required=True,
+                        help="Directory with the JSONL files (.jsonl, .jsonl.gz, .jsonl.zst) to filter")
+    parser.add_argument("--output-dir", type=str, required=True,
+                        help="Directory for the filtered files (same names) and filter_report.json")
+    parser.add_argument("--num-workers", type=int, default=4, help="Number of files processed at once")
+    parser.add_argument("--num-perm", type=int, default=128, help="MinHash permutations per document")
+    parser.add_argument("--bands", type=int, default=16,
+                        help="LSH bands; more bands find candidates of lower similarity")
+    parser.add_argument("--ngram", type=int, default=5, help="Words per shingle")
+    parser.add_argument("--threshold", type=float, default=0.8,
+                        help="Estimated Jaccard similarity from which documents are near-duplicates")
+    parser.add_argument("--work-dir", type=str,
+                        help="Keep signatures and band hashes in this directory instead of a temporary one")
+    for name, default in QUALITY_DEFAULTS.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(default), default=default,
+                            help=f"Quality rule: {name.replace('_', ' ')}")
+    
+    args = parser.parse_args()
+    
+    paths = get_input_files(args.input_dir)
+    if not paths:
+        print(f"✗ No JSONL files found in {args.input_dir}")
+        sys.exit(1)
+    filter_parts(
+        paths,
+        args.output_dir,
+        num_workers=args.num_workers,
+        num_perm=args.num_perm,
+        bands=args.bands,
+        ngram=args.ngram,
+        threshold=args.threshold,
+        quality={name: getattr(args, name) for name in QUALITY_DEFAULTS},
+        work_dir=args.work_dir,
+    )
+
+
+if __name__ == "__main__":
+    main()
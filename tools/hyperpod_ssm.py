@@ -4,22 +4,129 @@ HyperPod SSM Interactive Shell
 
 A utility tool that helps with SSM login to HyperPod nodes and provides 
 an interactive shell for running commands.
+
+Clusters and nodes are cached in ~/.cache/hyperpod_ssm for --cache-ttl
+seconds, and refreshed in the background after that. --command only runs
+on a node list at most --command-max-age seconds old, so it does not
+target nodes that were replaced since.
+
+With --command, runs a shell command on all (or filtered) nodes of a
+cluster at once in non-interactive SSM sessions and prints the results as a table:
+
+    python tools/hyperpod_ssm.py -c my-cluster -g worker-group --status Running -x "nvidia-smi -L"
 """
 
 import argparse
 import boto3
+import json
+import os
+import re
+import shlex
 import subprocess
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Optional
 
 
+# SSM Run Command (send_command) only takes EC2 and managed instance IDs, not the
+# sagemaker-cluster: targets of HyperPod nodes, so batch commands run in
+# non-interactive sessions with this document instead
+NON_INTERACTIVE_DOCUMENT = 'AWS-StartNonInteractiveCommand'
+
+# printed after the command, a session does not report the command's exit code itself
+EXIT_CODE_MARKER = '__hyperpod_ssm_exit_code='
+
+# lines the session manager plugin prints around the command's output
+SESSION_BANNERS = ('Starting session with SessionId', 'Exiting session with sessionId')
+
+
+class InventoryCache:
+    """Cluster and node inventory kept in a JSON file, so that menus show up without listing the cluster.
+    
+    Entries older than `ttl` seconds are stale: they are still used, and
+    refreshed in a background thread. The file lives in the user's cache
+    directory, one per AWS profile and region.
+    """
+    
+    def __init__(self, path: str = None, ttl: float = 300, profile: str = None, region: str = None):
+        if path is None:
+            cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+            name = f"inventory-{profile or 'default'}-{region or 'default'}.json"
+            path = os.path.join(cache_home, 'hyperpod_ssm', name)
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.refreshing = set()
+        self.data = self._load()
+    
+    def _load(self) -> Dict:
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp{os.getpid()}-{threading.get_ident()}"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.data, f, default=str)
+        os.replace(tmp_path, self.path)
+    
+    def get(self, section: str, key: str) -> Optional[Dict]:
+        """Entry {'time': ..., 'data': ...} of `key`, or None."""
+        with self.lock:
+            return self.data.get(section, {}).get(key)
+    
+    def put(self, section: str, key: str, data):
+        """Store `data` under `key`; returns it as read back from the cache (timestamps become strings)."""
+        data = json.loads(json.dumps(data, default=str))
+        with self.lock:
+            self.data.setdefault(section, {})[key] = {'time': time.time(), 'data': data}
+            self._save()
+            return self.data[section][key]['data']
+    
+    def is_stale(self, entry: Dict, max_age: float = None) -> bool:
+        return time.time() - entry['time'] > (self.ttl if max_age is None else max_age)
+    
+    def refresh_in_background(self, section: str, key: str, fetch, debug: bool = False):
+        """Fetch `key` again in a thread, unless that is already happening.
+        
+        The thread is not a daemon, so a short command still finishes the
+        refresh before the process exits.
+        """
+        with self.lock:
+            if (section, key) in self.refreshing:
+                return
+            self.refreshing.add((section, key))
+        
+        def refresh():
+            try:
+                self.put(section, key, fetch())
+            except Exception as e:
+                if debug:
+                    print(f"Background refresh of {section} {key} failed: {e}")
+            finally:
+                with self.lock:
+                    self.refreshing.discard((section, key))
+        
+        threading.Thread(target=refresh, name=f"refresh-{section}-{key}").start()
+
+
 class HyperPodSSMShell:
-    def __init__(self, debug=False):
-        self.sagemaker_client = boto3.client('sagemaker')
+    def __init__(self, debug=False, sagemaker_client=None, cache: InventoryCache = None, refresh: bool = False):
+        self.sagemaker_client = sagemaker_client or boto3.client('sagemaker')
         self.debug = debug
+        # without a cache, every call lists the cluster again
+        self.cache = cache
+        # fetch every entry once, ignoring cached ones
+        self.refresh = refresh
         self.cluster_name = None
         self.cluster_arn = None
         self.cluster_id = None
+        self.instance_groups = []
     
     def extract_cluster_id_from_arn(self, cluster_arn: str) -> str:
         """Extract cluster ID from cluster ARN."""
@@ -40,12 +147,27 @@ class HyperPodSSMShell:
         
         return f"sagemaker-cluster:{self.cluster_id}_{instance_group_name}-{instance_id}"
     
-    def list_clusters(self) -> List[Dict]:
-        """List all available HyperPod clusters."""
-        try:
-            response = self.sagemaker_client.list_clusters()
-            clusters = []
-            
+    def cached(self, section: str, key: str, fetch, max_age: float = None):
+        """Inventory entry from the cache, fetched with `fetch()` if missing (or always without a cache).
+        
+        An entry older than the cache TTL is still returned, and fetched
+        again in a background thread for the next call. An entry older than
+        `max_age` seconds is fetched again before returning.
+        """
+        if self.cache is None:
+            return fetch()
+        entry = None if self.refresh else self.cache.get(section, key)
+        if entry is None or (max_age is not None and self.cache.is_stale(entry, max_age)):
+            return self.cache.put(section, key, fetch())
+        if self.cache.is_stale(entry):
+            self.cache.refresh_in_background(section, key, fetch, debug=self.debug)
+        return entry['data']
+    
+    def _fetch_clusters(self) -> List[Dict]:
+        clusters = []
+        params = {}
+        while True:
+            response = self.sagemaker_client.list_clusters(**params)
             for cluster in response.get('ClusterSummaries', []):
                 clusters.append({
                     'Name': cluster.get('ClusterName'),
@@ -53,60 +175,84 @@ class HyperPodSSMShell:
                     'CreationTime': cluster.get('CreationTime'),
                     'Arn': cluster.get('ClusterArn')
                 })
-            
-            return clusters
+            if not response.get('NextToken'):
+                return clusters
+            params['NextToken'] = response['NextToken']
+    
+    def list_clusters(self) -> List[Dict]:
+        """List all available HyperPod clusters."""
+        try:
+            return self.cached('clusters', 'all', self._fetch_clusters)
         except Exception as e:
             print(f"Error listing clusters: {e}")
             return []
     
-    def get_cluster_info(self, cluster_name: str) -> bool:
+    def _fetch_cluster_info(self, cluster_name: str) -> Dict:
+        response = self.sagemaker_client.describe_cluster(ClusterName=cluster_name)
+        return {
+            'ClusterArn': response.get('ClusterArn'),
+            'ClusterStatus': response.get('ClusterStatus'),
+            'InstanceGroups': [group.get('InstanceGroupName') for group in response.get('InstanceGroups', [])],
+        }
+    
+    def get_cluster_info(self, cluster_name: str, max_age: float = None) -> bool:
         """Get cluster information and set internal state."""
         try:
-            response = self.sagemaker_client.describe_cluster(ClusterName=cluster_name)
+            info = self.cached(
+                'cluster_info', cluster_name, lambda: self._fetch_cluster_info(cluster_name), max_age
+            )
             
             self.cluster_name = cluster_name
-            self.cluster_arn = response.get('ClusterArn')
+            self.cluster_arn = info.get('ClusterArn')
             self.cluster_id = self.extract_cluster_id_from_arn(self.cluster_arn)
+            self.instance_groups = info.get('InstanceGroups', [])
             
             if self.debug:
                 print(f"Cluster ARN: {self.cluster_arn}")
                 print(f"Cluster ID: {self.cluster_id}")
-                print(f"Cluster Status: {response.get('ClusterStatus')}")
+                print(f"Cluster Status: {info.get('ClusterStatus')}")
             
             return True
         except Exception as e:
             print(f"Error getting cluster info: {e}")
             return False
     
-    def get_cluster_nodes(self, cluster_name: str) -> List[Dict]:
-        """Get all nodes in the HyperPod cluster."""
+    def _list_nodes_pages(self, cluster_name: str, instance_group: str = None) -> List[Dict]:
+        """Page through list_cluster_nodes, of one instance group if given."""
+        nodes = []
+        params = {'ClusterName': cluster_name, 'MaxResults': 100}
+        if instance_group:
+            params['InstanceGroupNameContains'] = instance_group
+        while True:
+            response = self.sagemaker_client.list_cluster_nodes(**params)
+            for node in response.get('ClusterNodeSummaries', []):
+                instance_id = node.get('InstanceId')
+                # the filter matches substrings, other groups may contain the name
+                if instance_id and (not instance_group or node.get('InstanceGroupName') == instance_group):
+                    nodes.append({
+                        'InstanceId': instance_id,
+                        'NodeGroup': node.get('InstanceGroupName', 'unknown'),
+                        'InstanceType': node.get('InstanceType', 'unknown'),
+                        'LaunchTime': node.get('LaunchTime'),
+                        'InstanceStatus': node.get('InstanceStatus', {}).get('Status', 'unknown')
+                    })
+            if not response.get('NextToken'):
+                return nodes
+            params['NextToken'] = response['NextToken']
+    
+    def _fetch_cluster_nodes(self, cluster_name: str) -> List[Dict]:
+        """All nodes of the cluster, paging the instance groups in parallel."""
+        groups = self.instance_groups if cluster_name == self.cluster_name else []
+        if len(groups) < 2:
+            return self._list_nodes_pages(cluster_name)
+        with ThreadPoolExecutor(max_workers=min(len(groups), 8)) as executor:
+            pages = executor.map(lambda group: self._list_nodes_pages(cluster_name, group), groups)
+            return [node for group_nodes in pages for node in group_nodes]
+    
+    def get_cluster_nodes(self, cluster_name: str, max_age: float = None) -> List[Dict]:
+        """Get all nodes in the HyperPod cluster, listed at most `max_age` seconds ago if given."""
         try:
-            nodes = []
-            next_token = None
-            
-            while True:
-                params = {'ClusterName': cluster_name}
-                if next_token:
-                    params['NextToken'] = next_token
-                
-                response = self.sagemaker_client.list_cluster_nodes(**params)
-                
-                for node in response.get('ClusterNodeSummaries', []):
-                    instance_id = node.get('InstanceId')
-                    if instance_id:
-                        nodes.append({
-                            'InstanceId': instance_id,
-                            'NodeGroup': node.get('InstanceGroupName', 'unknown'),
-                            'InstanceType': node.get('InstanceType', 'unknown'),
-                            'LaunchTime': node.get('LaunchTime'),
-                            'InstanceStatus': node.get('InstanceStatus', {}).get('Status', 'unknown')
-                        })
-                
-                next_token = response.get('NextToken')
-                if not next_token:
-                    break
-            
-            return nodes
+            return self.cached('nodes', cluster_name, lambda: self._fetch_cluster_nodes(cluster_name), max_age)
         except Exception as e:
             print(f"Error getting cluster nodes: {e}")
             return []
@@ -204,6 +350,110 @@ class HyperPodSSMShell:
             except KeyboardInterrupt:
                 return None
     
+    def filter_nodes(self, nodes: List[Dict], instance_group: str = None, instance_type: str = None,
+                     status: str = None, instance_ids: List[str] = None) -> List[Dict]:
+        """Nodes matching all given filters (group, type and status compare case-insensitively)."""
+        def matches(value, wanted):
+            return wanted is None or value.lower() == wanted.lower()
+        
+        return [
+            node for node in nodes
+            if matches(node['NodeGroup'], instance_group)
+            and matches(node['InstanceType'], instance_type)
+            and matches(node['InstanceStatus'], status)
+            and (not instance_ids or node['InstanceId'] in instance_ids)
+        ]
+    
+    def session_command_args(self, node: Dict, command: str) -> List[str]:
+        """AWS CLI arguments that run `command` on `node` in a non-interactive SSM session."""
+        script = f"sh -c {shlex.quote(command)}; echo {EXIT_CODE_MARKER}$?"
+        return [
+            'aws', 'ssm', 'start-session',
+            '--target', self.get_hyperpod_ssm_target(node['InstanceId'], node['NodeGroup']),
+            '--document-name', NON_INTERACTIVE_DOCUMENT,
+            '--parameters', json.dumps({'command': [script]}),
+        ]
+    
+    @staticmethod
+    def parse_session_output(stdout: str):
+        """(command output, exit code) from a session's output; the exit code is None if the command did not finish."""
+        text = stdout.replace('\r\n', '\n').replace('\r', '\n')
+        exit_code = None
+        markers = list(re.finditer(re.escape(EXIT_CODE_MARKER) + r'(\d+)', text))
+        if markers:
+            exit_code = int(markers[-1].group(1))
+            text = text[:markers[-1].start()] + text[markers[-1].end():]
+        lines = [line for line in text.split('\n') if not line.startswith(SESSION_BANNERS)]
+        return '\n'.join(lines).strip('\n'), exit_code
+    
+    def run_node_command(self, node: Dict, command: str, timeout: int = 600) -> Dict:
+        """Run `command` on `node` and wait for it, at most `timeout` seconds."""
+        result = {
+            'InstanceId': node['InstanceId'],
+            'NodeGroup': node['NodeGroup'],
+            'Status': 'Pending',
+            'ResponseCode': None,
+            'Output': '',
+            'Error': '',
+        }
+        args = self.session_command_args(node, command)
+        if self.debug:
+            print(f"Running on {node['InstanceId']}: {' '.join(shlex.quote(arg) for arg in args)}")
+        try:
+            completed = subprocess.run(args, capture_output=True, text=True, timeout=timeout)
+        except subprocess.TimeoutExpired as e:
+            output = e.stdout.decode(errors='replace') if isinstance(e.stdout, bytes) else e.stdout or ''
+            result.update(Status='TimedOut', Output=self.parse_session_output(output)[0])
+            return result
+        except FileNotFoundError:
+            result.update(Status='Error', Error='AWS CLI not found. Please install and configure AWS CLI.')
+            return result
+        
+        output, exit_code = self.parse_session_output(completed.stdout)
+        if exit_code is None:
+            # the session did not run the command, e.g. the node is not connected to SSM
+            error = completed.stderr.strip() or f"aws ssm start-session exited with code {completed.returncode}"
+            result.update(Status='Error', Output=output, Error=error)
+        else:
+            result.update(Status='Success' if exit_code == 0 else 'Failed', ResponseCode=exit_code, Output=output)
+        return result
+    
+    def run_command(self, nodes: List[Dict], command: str, max_concurrency: int = 16,
+                    timeout: int = 600) -> List[Dict]:
+        """Run `command` on all `nodes` in parallel; returns one result per node, in node order.
+        
+        Every node gets its own session; at most `max_concurrency` run at a
+        time, so large instance groups do not run into SSM API throttling.
+        """
+        with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+            return list(executor.map(lambda node: self.run_node_command(node, command, timeout), nodes))
+    
+    def print_command_results(self, results: List[Dict], full_output: bool = False):
+        """Print a table with one row per node, then the output shared by each set of nodes."""
+        rows = [('INSTANCE', 'GROUP', 'STATUS', 'EXIT', 'OUTPUT')]
+        for result in results:
+            first_line = (result['Output'] or result['Error']).strip().split('\n')[0]
+            exit_code = '' if result['ResponseCode'] is None else str(result['ResponseCode'])
+            rows.append((result['InstanceId'], result['NodeGroup'], result['Status'], exit_code, first_line[:60]))
+        widths = [max(len(row[i]) for row in rows) for i in range(4)]
+        for row in rows:
+            print('  '.join(value.ljust(width) for value, width in zip(row, widths)) + '  ' + row[4])
+        
+        # identical outputs are printed once, e.g. the same driver version on all nodes
+        outputs = {}
+        for result in results:
+            text = result['Output'].rstrip()
+            if result['Error'].strip():
+                text += ('\n' if text else '') + result['Error'].rstrip()
+            outputs.setdefault(text, []).append(result['InstanceId'])
+        if full_output or len(outputs) > 1:
+            for text, instance_ids in outputs.items():
+                print(f"\n--- {len(instance_ids)} node(s): {', '.join(instance_ids)}")
+                print(text if full_output else '\n'.join(text.split('\n')[:20]))
+        
+        succeeded = sum(result['Status'] == 'Success' for result in results)
+        print(f"\n{succeeded}/{len(results)} nodes succeeded, {len(outputs)} distinct output(s)")
+    
     def start_ssm_session(self, node: Dict) -> bool:
         """Start an interactive SSM session to the specified node."""
         instance_id = node['InstanceId']
@@ -311,14 +561,15 @@ class HyperPodSSMShell:
             else:
                 break  # Exit
     
-    def run_direct_mode(self, cluster_name: str, instance_group: str = None, instance_id: str = None):
+    def run_direct_mode(self, cluster_name: str, instance_group: str = None, instance_id: str = None,
+                        instance_type: str = None, status: str = None):
         """Run with direct parameters."""
         # Get cluster info
         if not self.get_cluster_info(cluster_name):
             return
         
         # Get nodes
-        nodes = self.get_cluster_nodes(cluster_name)
+        nodes = self.filter_nodes(self.get_cluster_nodes(cluster_name), instance_type=instance_type, status=status)
         if not nodes:
             print("No nodes found in cluster.")
             return
@@ -355,11 +606,33 @@ def main():
     parser.add_argument('--list-clusters', action='store_true', help='List available clusters')
     parser.add_argument('--list-nodes', action='store_true', help='List nodes in cluster')
     parser.add_argument('--debug', '-d', action='store_true', help='Enable debug mode')
+    parser.add_argument('--command', '-x',
+                        help='Run this shell command on all nodes (filtered by --instance-group, --instance-type, '
+                             '--status, --instance-id) in non-interactive SSM sessions, instead of opening a session')
+    parser.add_argument('--instance-type', help='Only use nodes of this instance type')
+    parser.add_argument('--status', help='Only use nodes with this status, e.g. Running')
+    parser.add_argument('--max-concurrency', type=int, default=16,
+                        help='Number of nodes --command runs on at once')
+    parser.add_argument('--timeout', type=int, default=600, help='Seconds --command may run on a node')
+    parser.add_argument('--full-output', action='store_true', help='Print the complete output of --command')
+    parser.add_argument('--output-json', help='Also write the --command results as JSON to this file')
+    parser.add_argument('--cache-ttl', type=float, default=300,
+                        help='Seconds the cached cluster and node inventory is used before it is refreshed '
+                             'in the background')
+    parser.add_argument('--command-max-age', type=float, default=60,
+                        help='Seconds the cached node inventory may be old for --command; '
+                             'an older one is listed again before sending the command')
+    parser.add_argument('--refresh', action='store_true', help='List the cluster again instead of using the cache')
+    parser.add_argument('--no-cache', action='store_true', help='Neither read nor write the inventory cache')
     
     args = parser.parse_args()
     
     try:
-        shell = HyperPodSSMShell(debug=args.debug)
+        cache = None
+        if not args.no_cache:
+            session = boto3.session.Session()
+            cache = InventoryCache(ttl=args.cache_ttl, profile=session.profile_name, region=session.region_name)
+        shell = HyperPodSSMShell(debug=args.debug, cache=cache, refresh=args.refresh)
         
         if args.list_clusters:
             clusters = shell.list_clusters()
@@ -380,7 +653,9 @@ def main():
             if not shell.get_cluster_info(args.cluster):
                 return
             
-            nodes = shell.get_cluster_nodes(args.cluster)
+            nodes = shell.filter_nodes(
+                shell.get_cluster_nodes(args.cluster), args.instance_group, args.instance_type, args.status
+            )
             if nodes:
                 print(f"Nodes in cluster '{args.cluster}':")
                 
@@ -402,9 +677,32 @@ def main():
                 print("No nodes found.")
             return
         
+        if args.command:
+            if not args.cluster:
+                print("--cluster is required when using --command")
+                sys.exit(1)
+            # a command must not go to nodes replaced since the inventory was cached
+            if not shell.get_cluster_info(args.cluster, args.command_max_age):
+                sys.exit(1)
+            nodes = shell.filter_nodes(
+                shell.get_cluster_nodes(args.cluster, args.command_max_age),
+                args.instance_group, args.instance_type, args.status,
+                [args.instance_id] if args.instance_id else None,
+            )
+            if not nodes:
+                print("No nodes match the filters.")
+                sys.exit(1)
+            print(f"Running on {len(nodes)} nodes: {args.command}")
+            results = shell.run_command(nodes, args.command, args.max_concurrency, args.timeout)
+            shell.print_command_results(results, args.full_output)
+            if args.output_json:
+                with open(args.output_json, 'w') as f:
+                    json.dump(results, f, indent=2)
+            sys.exit(0 if all(result['Status'] == 'Success' for result in results) else 1)
+        
         if args.cluster:
             shell.cluster_name = args.cluster
-            shell.run_direct_mode(args.cluster, args.instance_group, args.instance_id)
+            shell.run_direct_mode(args.cluster, args.instance_group, args.instance_id, args.instance_type, args.status)
         else:
             shell.run_interactive_mode()
     
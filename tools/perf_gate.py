@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Performance Regression Gate
+
+Stores benchmark results per configuration and container image tag in a
+SQLite database, and compares new results against a baseline of earlier
+ones. Results come from a cluster run (the metrics JSON of
+test_hyperpod_cluster.py --metrics-output) or from a local synthetic run
+(the <output>.json trial results of FSDP/src/autotune.py, e.g. on CPU).
+
+Results that fail the gate are kept out of later baselines, so a real
+regression keeps failing however often it is rerun. An expected slowdown
+is accepted with `gate --accept` or `accept <id>`, after which those
+results count towards the baseline.
+"""
+
+import argparse
+import json
+import sqlite3
+import statistics
+import sys
+from datetime import datetime
+from typing import Dict, List, Optional
+
+
+# metric -> True if higher is better
+METRICS = {
+    "samples_per_sec": True,
+    "tokens_per_sec": True,
+    "step_ms_p50": False,
+    "step_ms_p90": False,
+    "step_ms_p99": False,
+    "checkpoint_stall_s": False,
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created TEXT NOT NULL,
+    source TEXT NOT NULL,
+    config TEXT NOT NULL,
+    image_tag TEXT NOT NULL,
+    samples_per_sec REAL,
+    tokens_per_sec REAL,
+    step_ms_p50 REAL,
+    step_ms_p90 REAL,
+    step_ms_p99 REAL,
+    checkpoint_stall_s REAL,
+    details TEXT,
+    regression INTEGER NOT NULL DEFAULT 0,
+    accepted INTEGER NOT NULL DEFAULT 0
+)
+"""
+
+
+def open_store(path: str) -> sqlite3.Connection:
+    """Open (and create if needed) the results database."""
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    conn.execute(SCHEMA)
+    # databases created before results could be accepted
+    if "accepted" not in [row["name"] for row in conn.execute("PRAGMA table_info(results)")]:
+        conn.execute("ALTER TABLE results ADD COLUMN accepted INTEGER NOT NULL DEFAULT 0")
+    conn.execute("CREATE INDEX IF NOT EXISTS results_config ON results (config, id)")
+    return conn
+
+
+def load_results(path: str, config: str) -> List[Dict]:
+    """Read a results file into one result per configuration.
+
+    A cluster metrics summary gives a single result for `config`. Autotune
+    trial results give one result per completed trial, named `config`
+    followed by the trial's flags, so different flags are never compared.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    if isinstance(data, list):
+        results = []
+        for trial in data:
+            if trial.get("status") != "ok":
+                continue
+            flags = " ".join(f"{name}={value}" for name, value in sorted(trial["flags"].items()))
+            result = {"source": "autotune", "config": f"{config} {flags}" if flags else config}
+            result.update({metric: trial.get(metric) for metric in METRICS})
+            if result["step_ms_p50"] is None and "step_time" in trial:
+                result["step_ms_p50"] = trial["step_time"] * 1000
+            result["details"] = {"peak_memory_gb": trial.get("peak_memory_gb")}
+            results.append(result)
+        if not results:
+            raise ValueError(f"{path} has no completed autotune trials")
+        return results
+
+    if "train_lines" in data:
+        if not data["train_lines"]:
+            raise ValueError(f"{path} holds no training progress, the run did not train")
+        result = {
+            "source": "cluster",
+            "config": config,
+            "samples_per_sec": data.get("samples_per_sec_p50"),
+            "tokens_per_sec": data.get("tokens_per_sec_p50"),
+            "step_ms_p50": data.get("step_ms_p50"),
+            "step_ms_p90": data.get("step_ms_p90"),
+            "step_ms_p99": data.get("step_ms_p99"),
+            "checkpoint_stall_s": data.get("checkpoint_stall_s"),
+            "details": {
+                key: data.get(key)
+                for key in ("pods", "last_batch", "last_loss", "step_time_imbalance", "stragglers")
+            },
+        }
+        return [result]
+
+    raise ValueError(f"{path} is neither autotune trial results nor a cluster metrics summary")
+
+
+def record_result(conn: sqlite3.Connection, result: Dict, image_tag: str, accepted: bool = False) -> int:
+    """Store `result`; returns its id."""
+    cursor = conn.execute(
+        "INSERT INTO results (created, source, config, image_tag, " + ", ".join(METRICS) + ", details, accepted) "
+        "VALUES (?, ?, ?, ?, " + ", ".join("?" for _ in METRICS) + ", ?, ?)",
+        [datetime.now().isoformat(timespec="seconds"), result["source"], result["config"], image_tag]
+        + [result.get(metric) for metric in METRICS]
+        + [json.dumps(result.get("details", {})), int(accepted)],
+    )
+    conn.commit()
+    return cursor.lastrowid
+
+
+def get_baseline(conn: sqlite3.Connection, config: str, before_id: int, baseline_tag: Optional[str] = None,
+                 runs: int = 5) -> Optional[Dict]:
+    """Median and spread of each metric over the last `runs` results of `config` stored before `before_id`.
+
+    Results flagged as regressions are left out unless they were accepted,
+    so a regression cannot become the baseline by being rerun. The median
+    keeps a single fast outlier from becoming the bar for every later run.
+    The spread is the median absolute deviation relative to the median,
+    scaled to match a standard deviation for normally distributed noise; it
+    needs at least 3 results. With `baseline_tag`, only results of that
+    image tag count. Returns None if there are no such results.
+    """
+    query = "SELECT * FROM results WHERE config = ? AND id < ? AND (regression = 0 OR accepted = 1)"
+    params = [config, before_id]
+    if baseline_tag:
+        query += " AND image_tag = ?"
+        params.append(baseline_tag)
+    rows = conn.execute(query + " ORDER BY id DESC LIMIT ?", params + [runs]).fetchall()
+    if not rows:
+        return None
+    baseline = {"runs": len(rows), "ids": [row["id"] for row in rows],
+                "image_tags": sorted({row["image_tag"] for row in rows}), "spread": {}}
+    for metric in METRICS:
+        values = [row[metric] for row in rows if row[metric] is not None]
+        baseline[metric] = statistics.median(values) if values else None
+        if len(values) >= 3 and baseline[metric]:
+            mad = statistics.median(abs(value - baseline[metric]) for value in values)
+            baseline["spread"][metric] = 1.4826 * mad / abs(baseline[metric])
+    return baseline
+
+
+def compare(current: Dict, baseline: Dict, threshold: float, noise_sigmas: float = 3.0) -> List[Dict]:
+    """Relative change of every metric both have, and whether it is a regression.
+
+    A change for the worse is a regression beyond `threshold`, or beyond
+    `noise_sigmas` times the baseline's spread if the metric is noisier
+    than that.
+    """
+    changes = []
+    for metric, higher_is_better in METRICS.items():
+        new, old = current.get(metric), baseline.get(metric)
+        if new is None or old is None or old == 0:
+            continue
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        allowed = max(threshold, noise_sigmas * baseline.get("spread", {}).get(metric, 0.0))
+        changes.append({
+            "metric": metric, "baseline": old, "current": new, "change": change, "allowed": allowed,
+            "regression": worse > allowed,
+        })
+    return changes
+
+
+def print_comparison(config: str, image_tag: str, baseline: Optional[Dict], changes: List[Dict], threshold: float):
+    print(f"📊 {config} @ {image_tag}")
+    if baseline is None:
+        print("   No baseline results yet, stored as the first one")
+        return
+    print(f"   Baseline: median of {baseline['runs']} runs ({', '.join(baseline['image_tags'])})")
+    for change in changes:
+        mark = "❌" if change["regression"] else "✅"
+        print(f"   {mark} {change['metric']:<20} {change['baseline']:>12.2f} -> {change['current']:>12.2f} "
+              f"({100 * change['change']:+.1f}%, allowed {100 * change['allowed']:.1f}%)")
+    regressions = [change["metric"] for change in changes if change["regression"]]
+    if regressions:
+        print(f"❌ Regression beyond the allowed change: {', '.join(regressions)}")
+    else:
+        print(f"✅ Within {100 * threshold:.0f}% (or the baseline's noise) of the baseline")
+
+
+def gate(conn: sqlite3.Connection, input_path: str, config: str, image_tag: str, threshold: float = 0.05,
+         baseline_tag: str = None, baseline_runs: int = 5, noise_sigmas: float = 3.0, accept: bool = False) -> Dict:
+    """Store the results of `input_path` and compare each with its baseline; returns the report.
+
+    With `accept`, the results are stored as accepted: they count towards
+    later baselines even if they regressed, e.g. for an expected slowdown.
+    """
+    report = {"config": config, "image_tag": image_tag, "threshold": threshold, "noise_sigmas": noise_sigmas,
+              "accepted": accept, "results": []}
+    for result in load_results(input_path, config):
+        result_id = record_result(conn, result, image_tag, accept)
+        baseline = get_baseline(conn, result["config"], result_id, baseline_tag, baseline_runs)
+        changes = compare(result, baseline, threshold, noise_sigmas) if baseline else []
+        print_comparison(result["config"], image_tag, baseline, changes, threshold)
+        regression = any(change["regression"] for change in changes)
+        conn.execute("UPDATE results SET regression = ? WHERE id = ?", (int(regression), result_id))
+        conn.commit()
+        report["results"].append({
+            "id": result_id, "config": result["config"], "baseline": baseline, "changes": changes,
+            "regression": regression,
+        })
+    report["regression"] = any(result["regression"] for result in report["results"])
+    return report
+
+
+def accept_results(conn: sqlite3.Connection, result_ids: List[int]) -> int:
+    """Let the stored results `result_ids` count towards later baselines; returns the number found."""
+    cursor = conn.execute(
+        "UPDATE results SET accepted = 1 WHERE id IN (" + ", ".join("?" for _ in result_ids) + ")", result_ids
+    )
+    conn.commit()
+    return cursor.rowcount
+
+
+def list_results(conn: sqlite3.Connection, config: str = None, limit: int = 20):
+    query, params = "SELECT * FROM results", []
+    if config:
+        query += " WHERE config = ?"
+        params.append(config)
+    rows = conn.execute(query + " ORDER BY id DESC LIMIT ?", params + [limit]).fetchall()
+    for row in reversed(rows):
+        metrics = ", ".join(f"{metric} {row[metric]:.2f}" for metric in METRICS if row[metric] is not None)
+        mark = ("☑️" if row["accepted"] else "❌") if row["regression"] else "  "
+        print(f"{mark}{row['id']:>5} {row['created']} {row['source']:<8} {row['config']} @ {row['image_tag']}: "
+              f"{metrics}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Performance regression gate for FSDP training benchmarks")
+    parser.add_argument("--db", default="perf_results.db", help="SQLite results database")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    gate_parser = subparsers.add_parser(
+        "gate", help="Store results and fail if they regressed against the baseline"
+    )
+    gate_parser.add_argument("--input", required=True,
+                             help="Cluster metrics JSON (test_hyperpod_cluster.py --metrics-output) "
+                                  "or autotune trial results (<autotune_output>.json)")
+    gate_parser.add_argument("--config", required=True,
+                             help="Name of the benchmarked configuration, e.g. llama3-8b-p5-4nodes")
+    gate_parser.add_argument("--image-tag", required=True, help="Container image tag the results were measured with")
+    gate_parser.add_argument("--threshold", type=float, default=0.05,
+                             help="Relative change for the worse that counts as a regression")
+    gate_parser.add_argument("--baseline-tag", default=None,
+                             help="Compare only with results of this image tag (default: any earlier result)")
+    gate_parser.add_argument("--baseline-runs", type=int, default=5,
+                             help="Number of earlier results whose median is the baseline")
+    gate_parser.add_argument("--noise-sigmas", type=float, default=3.0,
+                             help="Allow changes up to this many times the baseline's spread "
+                                  "if that is more than --threshold")
+    gate_parser.add_argument("--output", default=None, help="Also write the comparison as JSON to this file")
+    gate_parser.add_argument("--accept", action="store_true",
+                             help="Accept the results as a new baseline even if they regressed, e.g. for an "
+                                  "expected slowdown; the gate passes")
+
+    accept_parser = subparsers.add_parser(
+        "accept", help="Let stored results that failed the gate count towards later baselines"
+    )
+    accept_parser.add_argument("ids", type=int, nargs="+", help="Result ids, as shown by list")
+
+    list_parser = subparsers.add_parser("list", help="Show stored results")
+    list_parser.add_argument("--config", default=None)
+    list_parser.add_argument("--limit", type=int, default=20)
+
+    args = parser.parse_args()
+    conn = open_store(args.db)
+
+    if args.command == "gate":
+        try:
+            report = gate(conn, args.input, args.config, args.image_tag, args.threshold, args.baseline_tag,
+                          args.baseline_runs, args.noise_sigmas, args.accept)
+        except (OSError, ValueError) as e:
+            print(f"❌ Cannot read results: {e}")
+            sys.exit(2)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
+        sys.exit(1 if report["regression"] and not args.accept else 0)
+    elif args.command == "accept":
+        found = accept_results(conn, args.ids)
+        print(f"✅ Accepted {found} result(s) as baseline")
+        if found < len(args.ids):
+            print(f"❌ {len(args.ids) - found} of the ids are not stored")
+            sys.exit(1)
+    elif args.command == "list":
+        list_results(conn, args.config, args.limit)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,22 +6,296 @@ HyperPod Cluster Testing Framework
 import subprocess
 import time
 import json
+import math
+import os
+import re
+import shlex
 import sys
 import argparse
-from datetime import datetime
-from typing import Dict, List, Tuple
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+
+# Lines of FSDP/src/train.py, after the "<asctime> [INFO] __main__: " prefix
+LOG_PATTERNS = {
+    "train": re.compile(r"Batch (\d+) Loss: (\S+), Speed: ([\d.]+) samples/sec"),
+    "node": re.compile(
+        r"Node (\d+) Batch (\d+) Step time: ([\d.]+)ms, Data wait: ([\d.]+)ms, Speed: ([\d.]+) samples/sec, "
+        r"([\d.]+) tokens/sec"
+    ),
+    "validation": re.compile(r"Batch (\d+) Validation loss: (\S+), ppl: (\S+)"),
+    "checkpoint": re.compile(r"Step (\d+) Checkpoint stall: ([\d.]+)s"),
+}
+LOG_FIELDS = {
+    "train": [("batch", int), ("loss", float), ("samples_per_sec", float)],
+    "node": [
+        ("node", int), ("batch", int), ("step_ms", float), ("data_wait_ms", float), ("samples_per_sec", float),
+        ("tokens_per_sec", float),
+    ],
+    "validation": [("batch", int), ("loss", float), ("ppl", float)],
+    "checkpoint": [("step", int), ("stall_s", float)],
+}
+TIMESTAMP_RE = re.compile(r"(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3})")
+
+
+def parse_log_line(line: str) -> Optional[Dict]:
+    """Parse a throughput, per-node or validation line of the training log into a record, else None."""
+    for kind, pattern in LOG_PATTERNS.items():
+        match = pattern.search(line)
+        if not match:
+            continue
+        try:
+            record = {name: cast(value) for (name, cast), value in zip(LOG_FIELDS[kind], match.groups())}
+        except ValueError:
+            return None
+        record["kind"] = kind
+        timestamp = TIMESTAMP_RE.search(line)
+        record["time"] = (
+            datetime.strptime(timestamp.group(1), "%Y-%m-%d %H:%M:%S,%f").timestamp() if timestamp else None
+        )
+        return record
+    return None
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile (q in 0-100) of `values`."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))]
+
+
+def summarize_metrics(records: Dict[str, List[Dict]], straggler_threshold: float = 0.2) -> Dict:
+    """Summarize the parsed records of each pod: throughput, loss, step times and stragglers.
+
+    Every node logs its step time and the time it waited for its own data.
+    Steps end together on all nodes, so a node with slow input shows up by
+    its data wait, and a node whose steps are slower than the others (e.g.
+    before collectives line them up) by its step time. A node is a straggler
+    if its median of either is `straggler_threshold` above the median node.
+    """
+    train = sorted((r for pod in records.values() for r in pod if r["kind"] == "train"), key=lambda r: r["batch"])
+    validation = [r for pod in records.values() for r in pod if r["kind"] == "validation"]
+    checkpoints = [r for pod in records.values() for r in pod if r["kind"] == "checkpoint"]
+    summary = {"pods": len(records), "train_lines": len(train)}
+    if train:
+        speeds = [r["samples_per_sec"] for r in train]
+        summary.update(
+            first_batch=train[0]["batch"], last_batch=train[-1]["batch"],
+            first_loss=train[0]["loss"], last_loss=train[-1]["loss"],
+            samples_per_sec_mean=sum(speeds) / len(speeds),
+            samples_per_sec_p50=percentile(speeds, 50),
+        )
+    if validation:
+        last = max(validation, key=lambda r: r["batch"])
+        summary.update(validation_batch=last["batch"], validation_loss=last["loss"], validation_ppl=last["ppl"])
+    if checkpoints:
+        stalls = [r["stall_s"] for r in checkpoints]
+        summary.update(checkpoints=len(stalls), checkpoint_stall_s=sum(stalls) / len(stalls),
+                       checkpoint_stall_max_s=max(stalls))
+
+    nodes = {}
+    for pod, pod_records in sorted(records.items()):
+        node_records = [r for r in pod_records if r["kind"] == "node"]
+        if not node_records:
+            continue
+        step_ms = [r["step_ms"] for r in node_records]
+        data_wait_ms = [r["data_wait_ms"] for r in node_records]
+        nodes[pod] = {
+            "node": node_records[-1]["node"],
+            "lines": len(node_records),
+            "step_ms_p50": percentile(step_ms, 50),
+            "step_ms_p90": percentile(step_ms, 90),
+            "data_wait_ms_p50": percentile(data_wait_ms, 50),
+            "samples_per_sec_p50": percentile([r["samples_per_sec"] for r in node_records], 50),
+        }
+    summary["nodes"] = nodes
+    summary["stragglers"] = []
+    if nodes:
+        node_lines = [r for pod in records.values() for r in pod if r["kind"] == "node"]
+        all_step_ms = [r["step_ms"] for r in node_lines]
+        summary.update(
+            tokens_per_sec_p50=percentile([r["tokens_per_sec"] for r in node_lines], 50),
+            step_ms_p50=percentile(all_step_ms, 50),
+            step_ms_p90=percentile(all_step_ms, 90),
+            step_ms_p99=percentile(all_step_ms, 99),
+        )
+        median_step = percentile([node["step_ms_p50"] for node in nodes.values()], 50)
+        median_wait = percentile([node["data_wait_ms_p50"] for node in nodes.values()], 50)
+        fastest = min(node["step_ms_p50"] for node in nodes.values())
+        summary["step_time_imbalance"] = max(node["step_ms_p50"] for node in nodes.values()) / max(fastest, 1e-9)
+        for pod, node in nodes.items():
+            reasons = []
+            if node["step_ms_p50"] > (1 + straggler_threshold) * median_step:
+                reasons.append(f"step time {node['step_ms_p50']:.0f}ms vs {median_step:.0f}ms median")
+            # waits of a few ms are noise, whatever their ratio
+            if node["data_wait_ms_p50"] > (1 + straggler_threshold) * median_wait + 1.0:
+                reasons.append(f"data wait {node['data_wait_ms_p50']:.1f}ms vs {median_wait:.1f}ms median")
+            if reasons:
+                summary["stragglers"].append({"pod": pod, "node": node["node"], "reasons": reasons})
+    return summary
+
+
+class LogCollector:
+    """Follows the logs of all pods of a job at once and parses them into a time series.
+
+    One `kubectl logs -f` process per pod streams its lines to a reader
+    thread, instead of polling the tail of a single pod. Pods are looked up
+    again by `discover_pods`, which also restarts streams of restarted pods.
+    With `log_dir`, the raw lines are also written to `<log_dir>/<pod>.log`,
+    which `from_log_files` reads back.
+    """
+
+    def __init__(self, kubectl: List[str], selector: str, namespace: str = "default", log_dir: str = None):
+        self.kubectl = kubectl
+        self.selector = selector
+        self.namespace = namespace
+        self.log_dir = Path(log_dir) if log_dir else None
+        self.records: Dict[str, List[Dict]] = {}
+        self.lock = threading.Lock()
+        self.processes: Dict[str, subprocess.Popen] = {}
+        self.threads: Dict[str, threading.Thread] = {}
+        # when the stream of a pod ended, to resume from there if the pod restarts
+        self.stream_ended: Dict[str, str] = {}
+        self.stopped = False
+        if self.log_dir:
+            self.log_dir.mkdir(parents=True, exist_ok=True)
+
+    @classmethod
+    def from_log_files(cls, paths: List[str]) -> "LogCollector":
+        """A collector holding the records of recorded logs, one file per pod (named after the pod)."""
+        collector = cls(kubectl=[], selector="")
+        for path in paths:
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                for line in f:
+                    collector.add_line(Path(path).stem, line)
+        return collector
+
+    def add_line(self, pod: str, line: str):
+        record = parse_log_line(line)
+        with self.lock:
+            pod_records = self.records.setdefault(pod, [])
+            if record:
+                record["pod"] = pod
+                pod_records.append(record)
+
+    def discover_pods(self) -> Dict[str, str]:
+        """Phase of every pod of the job; starts following the logs of pods not followed yet.
+
+        Pods that already finished are read once, running pods are followed
+        again if their stream ended (e.g. the container restarted).
+        """
+        result = subprocess.run(
+            self.kubectl + [
+                "get", "pods", "-n", self.namespace, "-l", self.selector, "-o",
+                "jsonpath={range .items[*]}{.metadata.name}{\" \"}{.status.phase}{\"\\n\"}{end}",
+            ],
+            capture_output=True, text=True, timeout=30,
+        )
+        phases = {}
+        for line in result.stdout.splitlines():
+            if line.strip():
+                name, _, phase = line.strip().partition(" ")
+                phases[name] = phase
+        for pod, phase in phases.items():
+            if self.stopped or phase in ("Pending", "Unknown") or self.is_following(pod):
+                continue
+            if phase == "Running" or pod not in self.threads:
+                self.follow(pod)
+        return phases
+
+    def is_following(self, pod: str) -> bool:
+        thread = self.threads.get(pod)
+        return thread is not None and thread.is_alive()
+
+    def follow(self, pod: str):
+        cmd = self.kubectl + ["logs", "-f", pod, "-n", self.namespace]
+        if pod in self.stream_ended:
+            cmd.append(f"--since-time={self.stream_ended[pod]}")
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, errors="replace")
+        self.processes[pod] = process
+        with self.lock:
+            self.records.setdefault(pod, [])
+        thread = threading.Thread(target=self._read, args=(pod, process), name=f"logs-{pod}", daemon=True)
+        self.threads[pod] = thread
+        thread.start()
+
+    def _read(self, pod: str, process: subprocess.Popen):
+        log_file = open(self.log_dir / f"{pod}.log", "a", encoding="utf-8") if self.log_dir else None
+        try:
+            for line in process.stdout:
+                self.add_line(pod, line)
+                if log_file:
+                    log_file.write(line)
+        finally:
+            process.wait()
+            if log_file:
+                log_file.close()
+            self.stream_ended[pod] = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    def latest(self, kind: str) -> Optional[Dict]:
+        """Most recent record of `kind` of any pod."""
+        with self.lock:
+            candidates = [r for pod in self.records.values() for r in pod if r["kind"] == kind]
+        return max(candidates, key=lambda r: r["batch"]) if candidates else None
+
+    def snapshot(self) -> Dict[str, List[Dict]]:
+        with self.lock:
+            return {pod: list(records) for pod, records in self.records.items()}
+
+    def summary(self, straggler_threshold: float = 0.2) -> Dict:
+        return summarize_metrics(self.snapshot(), straggler_threshold)
+
+    def stop(self):
+        self.stopped = True
+        for process in self.processes.values():
+            if process.poll() is None:
+                process.terminate()
+        for thread in self.threads.values():
+            thread.join(timeout=10)
+
+
+def print_metrics_summary(summary: Dict):
+    """Print the summary of `summarize_metrics`."""
+    print("📊 Training metrics:")
+    if summary.get("train_lines"):
+        print(f"   Batches {summary['first_batch']}-{summary['last_batch']}: "
+              f"loss {summary['first_loss']:.4f} -> {summary['last_loss']:.4f}")
+        print(f"   Throughput: {summary['samples_per_sec_mean']:.2f} samples/sec mean, "
+              f"{summary['samples_per_sec_p50']:.2f} median")
+    else:
+        print("   No training progress lines found")
+    if "validation_loss" in summary:
+        print(f"   Validation at batch {summary['validation_batch']}: "
+              f"loss {summary['validation_loss']:.4f}, ppl {summary['validation_ppl']:.2f}")
+    if "checkpoint_stall_s" in summary:
+        print(f"   Checkpoints: {summary['checkpoints']}, stall {summary['checkpoint_stall_s']:.2f}s mean, "
+              f"{summary['checkpoint_stall_max_s']:.2f}s max")
+    if summary["nodes"]:
+        print(f"   Tokens/sec: {summary['tokens_per_sec_p50']:.0f} median")
+        print(f"   Step time: p50 {summary['step_ms_p50']:.0f}ms, p90 {summary['step_ms_p90']:.0f}ms, "
+              f"p99 {summary['step_ms_p99']:.0f}ms; imbalance {summary['step_time_imbalance']:.2f}x")
+        for pod, node in summary["nodes"].items():
+            print(f"   Node {node['node']} ({pod}): step p50 {node['step_ms_p50']:.0f}ms, "
+                  f"p90 {node['step_ms_p90']:.0f}ms, data wait p50 {node['data_wait_ms_p50']:.1f}ms")
+    for straggler in summary["stragglers"]:
+        print(f"⚠️  Straggler: node {straggler['node']} ({straggler['pod']}): {'; '.join(straggler['reasons'])}")
+    if summary["nodes"] and not summary["stragglers"]:
+        print("✅ No stragglers")
 
 
 class HyperPodTester:
-    def __init__(self, job_name: str = "llama3-1-8b-fsdp-hpto"):
+    def __init__(self, job_name: str = "llama3-1-8b-fsdp-hpto", kubectl: str = None):
         self.job_name = job_name
         self.namespace = "default"
+        # e.g. a script replaying recorded logs, instead of a cluster
+        self.kubectl = shlex.split(kubectl or os.environ.get("KUBECTL", "kubectl"))
         
     def run_kubectl_command(self, cmd: List[str]) -> Tuple[bool, str]:
         """Execute kubectl command and return success status and output."""
         try:
             result = subprocess.run(
-                ["kubectl"] + cmd,
+                self.kubectl + cmd,
                 capture_output=True,
                 text=True,
                 timeout=30
@@ -183,25 +457,28 @@ class HyperPodTester:
         
         return logs if success else f"Failed to get logs: {logs}"
     
-    def monitor_training_progress(self, duration: int = 300) -> None:
-        """Monitor training progress for specified duration."""
+    def monitor_training_progress(self, duration: int = 300, interval: int = 30, log_dir: str = None,
+                                  straggler_threshold: float = 0.2) -> Dict:
+        """Follow the logs of all job pods for `duration` seconds; returns the metrics summary."""
         print(f"👀 Monitoring training progress for {duration} seconds...")
+        collector = LogCollector(self.kubectl, f"job-name={self.job_name}", self.namespace, log_dir)
         start_time = time.time()
+        try:
+            while time.time() - start_time < duration:
+                phases = collector.discover_pods()
+                running_count = sum(phase == "Running" for phase in phases.values())
+                latest = collector.latest("train")
+                if latest:
+                    print(f"📈 Batch {latest['batch']}: loss {latest['loss']:.4f}, "
+                          f"{latest['samples_per_sec']:.2f} samples/sec")
+                print(f"🔄 Pods running: {running_count}/{len(phases)}")
+                time.sleep(min(interval, max(duration - (time.time() - start_time), 0)))
+        finally:
+            collector.stop()
         
-        while time.time() - start_time < duration:
-            logs = self.get_training_logs(lines=10)
-            
-            loss_lines = [line for line in logs.split('\n') if 'Loss:' in line]
-            if loss_lines:
-                print(f"📈 Latest training update: {loss_lines[-1].strip()}")
-            
-            status = self.get_job_status()
-            pods_info = status.get("pods_info", "")
-            running_count = pods_info.count("Running")
-            
-            print(f"🔄 Pods running: {running_count}")
-            
-            time.sleep(30) 
+        summary = collector.summary(straggler_threshold)
+        print_metrics_summary(summary)
+        return summary
    
     def cleanup_job(self) -> bool:
         """Clean up the training job."""
@@ -217,7 +494,8 @@ class HyperPodTester:
             print(f"❌ Job cleanup failed: {output}")
             return False
     
-    def run_full_test(self, monitor_duration: int = 300) -> bool:
+    def run_full_test(self, monitor_duration: int = 300, log_dir: str = None, metrics_output: str = None,
+                      straggler_threshold: float = 0.2) -> bool:
         """Run complete test suite."""
         print("🧪 Starting HyperPod FSDP Training Test Suite")
         print("=" * 60)
@@ -247,7 +525,13 @@ class HyperPodTester:
                 print(json.dumps(status, indent=2))
                 return False
             
-            self.monitor_training_progress(duration=monitor_duration)
+            summary = self.monitor_training_progress(
+                duration=monitor_duration, log_dir=log_dir, straggler_threshold=straggler_threshold
+            )
+            if metrics_output:
+                with open(metrics_output, "w") as f:
+                    json.dump(summary, f, indent=2)
+                print(f"📝 Metrics written to {metrics_output}")
             
             print("-" * 60)
             print("📊 Final Job Status:")
@@ -264,15 +548,36 @@ def main():
     parser = argparse.ArgumentParser(description="HyperPod FSDP Training Test Suite")
     parser.add_argument("--job-name", default="llama3-1-8b-fsdp-hpto")
     parser.add_argument("--monitor-duration", type=int, default=300)
-    parser.add_argument("--action", choices=["full-test", "status", "logs", "cleanup"],
+    parser.add_argument("--action", choices=["full-test", "status", "logs", "cleanup", "report"],
                        default="full-test")
+    parser.add_argument("--kubectl", default=None,
+                        help="kubectl command to run, e.g. a fake that replays recorded logs "
+                             "(default: $KUBECTL or kubectl)")
+    parser.add_argument("--log-dir", default=None,
+                        help="Save the logs of every pod to <log-dir>/<pod>.log while monitoring; "
+                             "with --action report, the recorded logs to summarize")
+    parser.add_argument("--metrics-output", default=None, help="Write the metrics summary as JSON to this file")
+    parser.add_argument("--straggler-threshold", type=float, default=0.2,
+                        help="Fraction above the median node step time or data wait that marks a straggler")
     
     args = parser.parse_args()
-    tester = HyperPodTester(job_name=args.job_name)
+    tester = HyperPodTester(job_name=args.job_name, kubectl=args.kubectl)
     
     if args.action == "full-test":
-        success = tester.run_full_test(monitor_duration=args.monitor_duration)
+        success = tester.run_full_test(
+            monitor_duration=args.monitor_duration, log_dir=args.log_dir, metrics_output=args.metrics_output,
+            straggler_threshold=args.straggler_threshold,
+        )
         sys.exit(0 if success else 1)
+    elif args.action == "report":
+        if not args.log_dir:
+            parser.error("--action report requires --log-dir")
+        collector = LogCollector.from_log_files(sorted(str(path) for path in Path(args.log_dir).glob("*.log")))
+        summary = collector.summary(args.straggler_threshold)
+        print_metrics_summary(summary)
+        if args.metrics_output:
+            with open(args.metrics_output, "w") as f:
+                json.dump(summary, f, indent=2)
     elif args.action == "status":
         status = tester.get_job_status()
         print(json.dumps(status, indent=2))